@@ -195,6 +195,14 @@ __C.TRAIN.COPY_WEIGHTS = False
 # Add StopGrad at a specified stage so the bottom layers are frozen
 __C.TRAIN.FREEZE_AT = 2
 
+# Directory of an on-disk cache of training images that are already decoded and
+# resized to each of TRAIN.SCALES (capped at TRAIN.MAX_SIZE). Cached images are
+# read through memory mapping, skipping JPEG decoding and resizing; flipped
+# images are read from the entry of the unflipped image. Images missing from
+# the cache are added when they are first loaded. The cache can also be built
+# ahead of time with tools/build_image_cache.py. The cache is disabled if empty
+__C.TRAIN.IMAGE_CACHE_DIR = b''
+
 
 # ---------------------------------------------------------------------------- #
 # Data loader options (see detectron/roi_data/loader.py for more info)
@@ -212,6 +220,50 @@ __C.DATA_LOADER.MINIBATCH_QUEUE_SIZE = 64
 # Capacity of the per GPU blobs queue
 __C.DATA_LOADER.BLOBS_QUEUE_CAPACITY = 8
 
+# Construct minibatches in separate processes instead of Python threads. This
+# avoids GIL contention so that throughput scales with the number of cores;
+# NUM_THREADS then sets the number of loader processes (roidb indices are still
+# drawn in the main process, so shuffling and aspect grouping are unchanged)
+__C.DATA_LOADER.USE_PROCESSES = False
+
+# Number of slots of the shared memory pool used to pass minibatches from the
+# loader processes to the enqueue threads (requires USE_PROCESSES). The slots
+# are allocated once and reused: a loader process builds the data blob of a
+# minibatch directly in a free slot and copies the other blobs after it, which
+# avoids pickling the minibatch blobs through a pipe. Loader processes wait for
+# a free slot, so at most this many minibatches are held in shared memory. Set
+# to 0 to disable the pool
+__C.DATA_LOADER.SHARED_MEMORY_SLOTS = 8
+
+# Size (in MB) of each slot of the shared memory pool. If 0, it is twice the
+# size of the largest data blob for TRAIN.MAX_SIZE and TRAIN.IMS_PER_BATCH
+# (e.g., 2 x 23 MB for MAX_SIZE 1000 and 2 images per batch). Minibatches that
+# do not fit into a slot are passed through the pipe
+__C.DATA_LOADER.SHARED_MEMORY_SLOT_MB = 0
+
+
+# ---------------------------------------------------------------------------- #
+# CPU inference options (see detectron/utils/subprocess.py for more info)
+# ---------------------------------------------------------------------------- #
+__C.CPU_INFERENCE = AttrDict()
+
+# Run inference (test_net, rpn_generate and infer_simple) on the CPU instead of
+# GPUs. Blob names keep their 'gpu_0/' prefix. Training is not supported
+__C.CPU_INFERENCE.ENABLED = False
+
+# Number of inference worker processes of test_net and rpn_generate. Each
+# worker has its own Caffe2 workspace and pulls chunks of images from a shared
+# queue (see TEST.WORKER_CHUNK_SIZE). With 1, inference runs in the main process
+__C.CPU_INFERENCE.NUM_WORKERS = 1
+
+# Number of intra-op (OpenMP and MKL) threads of each worker process; 0 splits
+# the cores of the machine evenly among the workers
+__C.CPU_INFERENCE.THREADS_PER_WORKER = 0
+
+# Pin each worker process to its own disjoint set of THREADS_PER_WORKER cores
+# (with taskset), which avoids oversubscription and thread migrations
+__C.CPU_INFERENCE.PIN_WORKERS = True
+
 
 # ---------------------------------------------------------------------------- #
 # Inference ('test') options
@@ -232,6 +284,34 @@ __C.TEST.SCALE = 600
 # Max pixel size of the longest side of a scaled input image
 __C.TEST.MAX_SIZE = 1000
 
+# Number of images per inference minibatch (test_net): images with similar
+# aspect ratios are grouped into one zero padded input blob and detected with a
+# single run of each net. Test-time augmentation (TEST.BBOX_AUG, etc.) requires
+# 1. Note that a padded image may get slightly different detections near its
+# border than it would on its own
+__C.TEST.IMS_PER_BATCH = 1
+
+# Inference (test_net and rpn_generate) can be pipelined into three stages:
+# worker threads that read and preprocess the images ahead of the net, the net
+# itself and worker threads that post-process the net outputs (NMS, masks and
+# keypoints). Results are always collected in image order. By default, all
+# stages run serially on the main thread; setting e.g. 2 threads for each of
+# the loading and post-processing stages overlaps them with the net
+# Number of threads that read and preprocess the images (0 runs this stage
+# serially on the main thread)
+__C.TEST.NUM_LOADER_THREADS = 0
+# Number of threads that post-process the net outputs (0 runs this stage
+# serially on the main thread)
+__C.TEST.NUM_POSTPROCESS_THREADS = 0
+# Maximum number of inference minibatches in flight in each of the loading and
+# post-processing stages
+__C.TEST.PIPELINE_DEPTH = 4
+
+# Number of images per chunk of work pulled by the inference worker
+# subprocesses of multi-GPU inference (see process_in_worker_pool). Small
+# chunks balance the load across workers, at some communication overhead
+__C.TEST.WORKER_CHUNK_SIZE = 16
+
 # Overlap threshold used for non-maximum suppression (suppress boxes with
 # IoU >= this threshold)
 __C.TEST.NMS = 0.3
@@ -429,6 +509,24 @@ __C.TEST.BBOX_VOTE.SCORING_METHOD = b'ID'
 # different methods)
 __C.TEST.BBOX_VOTE.SCORING_METHOD_BETA = 1.0
 
+# ---------------------------------------------------------------------------- #
+# Detection log (see detectron/utils/detection_log.py)
+# ---------------------------------------------------------------------------- #
+__C.TEST.DETECTION_LOG = AttrDict()
+
+# Stream the detections of test_net to an indexed on-disk log (detections_log
+# in the output directory) as the images are processed, instead of collecting
+# them in memory and writing detections.pkl at the end
+__C.TEST.DETECTION_LOG.ENABLED = False
+
+# Resume from an existing detection log, skipping the images that it already
+# holds (e.g., after a crash). If False, an existing log is discarded
+__C.TEST.DETECTION_LOG.RESUME = False
+
+# Number of images whose detections are buffered in memory before they are
+# written to the log as one chunk. A crash loses at most this many images
+__C.TEST.DETECTION_LOG.IMS_PER_CHUNK = 100
+
 
 # ---------------------------------------------------------------------------- #
 # Model options
@@ -752,6 +850,9 @@ __C.FPN.ROI_CANONICAL_LEVEL = 4  # k0: where s0 maps to
 __C.FPN.ROI_MAX_LEVEL = 5
 # Finest level of the FPN pyramid
 __C.FPN.ROI_MIN_LEVEL = 2
+# Check that the RoIs distributed over the FPN levels are restored to their
+# original order by the idx_restore blobs (for debugging)
+__C.FPN.CHECK_ROI_DISTRIBUTION = False
 
 # Use FPN for RPN if True
 __C.FPN.MULTILEVEL_RPN = False
@@ -987,12 +1088,30 @@ __C.RNG_SEED = 3
 # A small number that's used many times
 __C.EPS = 1e-14
 
+# CPU kernel used for (hard) NMS, e.g., of RPN proposals and detections
+# Valid options: ('greedy', 'bitmask')
+# 'greedy' is the classic greedy loop over pairs of boxes. 'bitmask' computes
+# the overlaps of each kept box with the following boxes in tiles of 64 boxes
+# into a suppression bitmask, which is several times faster for large numbers
+# of boxes (see tools/benchmark_nms.py). Both kernels give the same results,
+# including the order in which boxes with tied scores are suppressed
+__C.NMS_KERNEL = b'greedy'
+
 # Root directory of project
 __C.ROOT_DIR = os.getcwd()
 
 # Output basedir
 __C.OUTPUT_DIR = b'/tmp'
 
+# Directory of an on-disk cache of prepared roidbs. JsonDataset.get_roidb and
+# combined_roidb_for_training save the roidbs they build there, keyed by the
+# annotation and proposal files (path, mtime and size) and the config options
+# affecting them, and later load them through memory mapping instead of
+# parsing the annotations again. Dataset metadata (e.g., classes) is cached as
+# well, so that the annotations are only parsed when needed (e.g., for
+# evaluation). The cache is disabled if empty
+__C.ROIDB_CACHE_DIR = b''
+
 # Name (or path to) the matlab executable
 __C.MATLAB = b'matlab'
 
@@ -30,6 +30,7 @@ from __future__ import unicode_literals
 
 import cv2
 import datetime
+import functools
 import logging
 import numpy as np
 import os
@@ -43,6 +44,7 @@ from detectron.datasets import task_evaluation
 from detectron.datasets.json_dataset import JsonDataset
 from detectron.modeling import model_builder
 from detectron.utils.io import save_object
+from detectron.utils.pipeline import OrderedThreadPool
 from detectron.utils.timer import Timer
 import detectron.utils.blob as blob_utils
 import detectron.utils.c2 as c2_utils
@@ -65,8 +67,8 @@ def generate_rpn_on_dataset(
     dataset = JsonDataset(dataset_name)
     test_timer = Timer()
     test_timer.tic()
-    if multi_gpu:
-        num_images = len(dataset.get_roidb())
+    if multi_gpu or subprocess_utils.use_cpu_workers():
+        num_images = dataset.num_images
         _boxes, _scores, _ids, rpn_file = multi_gpu_generate_rpn_on_dataset(
             weights_file, dataset_name, _proposal_file_ignored, num_images,
             output_dir
@@ -88,7 +90,7 @@ def generate_rpn_on_dataset(
 def multi_gpu_generate_rpn_on_dataset(
     weights_file, dataset_name, _proposal_file_ignored, num_images, output_dir
 ):
-    """Multi-gpu inference on a dataset."""
+    """Multi-gpu (or multi-worker CPU) inference on a dataset."""
     # Retrieve the test_net binary path
     binary_dir = envu.get_runtime_dir()
     binary_ext = envu.get_py_bin_ext()
@@ -99,17 +101,17 @@ def multi_gpu_generate_rpn_on_dataset(
     opts = ['TEST.DATASETS', '("{}",)'.format(dataset_name)]
     opts += ['TEST.WEIGHTS', weights_file]
 
-    # Run inference in parallel in subprocesses
-    outputs = subprocess_utils.process_in_parallel(
-        'rpn_proposals', num_images, binary, output_dir, opts
-    )
-
-    # Collate the results from each subprocess
-    boxes, scores, ids = [], [], []
-    for rpn_data in outputs:
-        boxes += rpn_data['boxes']
-        scores += rpn_data['scores']
-        ids += rpn_data['ids']
+    # Run inference in a pool of worker subprocesses that pull chunks of image
+    # indices, and collect the results as the chunks complete
+    boxes = [None] * num_images
+    scores = [None] * num_images
+    ids = [None] * num_images
+    for _, chunk_results in subprocess_utils.process_in_worker_pool(
+        'rpn_proposals', subprocess_utils.get_chunks(num_images), binary,
+        output_dir, opts
+    ):
+        for i, boxes_i, scores_i, id_i in chunk_results:
+            boxes[i], scores[i], ids[i] = boxes_i, scores_i, id_i
     rpn_file = os.path.join(output_dir, 'rpn_proposals.pkl')
     cfg_yaml = yaml.dump(cfg)
     save_object(
@@ -139,13 +141,7 @@ def generate_rpn_on_range(
         'Output will be saved to: {:s}'.format(os.path.abspath(output_dir))
     )
 
-    model = model_builder.create(cfg.MODEL.TYPE, train=False, gpu_id=gpu_id)
-    nu.initialize_gpu_from_weights_file(
-        model, weights_file, gpu_id=gpu_id,
-    )
-    model_builder.add_inference_inputs(model)
-    workspace.CreateNet(model.net)
-
+    model = initialize_rpn_model(weights_file, gpu_id=gpu_id)
     boxes, scores, ids = generate_proposals_on_roidb(
         model,
         roidb,
@@ -168,6 +164,48 @@ def generate_rpn_on_range(
     return boxes, scores, ids, rpn_file
 
 
+def generate_rpn_worker(
+    weights_file,
+    dataset_name,
+    _proposal_file_ignored,
+    output_dir,
+    worker_address,
+    gpu_id=0
+):
+    """Generate RPN proposals as a worker of multi_gpu_generate_rpn_on_dataset:
+    the roidb and the model are set up once, then the chunks of image indices
+    pulled from the worker pool are processed until the pool is exhausted.
+    """
+    assert cfg.MODEL.RPN_ONLY or cfg.MODEL.FASTER_RCNN
+
+    roidb, _, _, total_num_images = get_roidb(dataset_name, None)
+    model = initialize_rpn_model(weights_file, gpu_id=gpu_id)
+
+    def process_chunk(inds):
+        boxes, scores, ids = generate_proposals_on_roidb(
+            model,
+            [roidb[i] for i in inds],
+            start_ind=inds[0],
+            end_ind=inds[-1] + 1,
+            total_num_images=total_num_images,
+            gpu_id=gpu_id,
+        )
+        return list(zip(inds, boxes, scores, ids))
+
+    subprocess_utils.run_worker(worker_address, process_chunk)
+
+
+def initialize_rpn_model(weights_file, gpu_id=0):
+    """Initialize a model from the global cfg for proposal generation."""
+    model = model_builder.create(cfg.MODEL.TYPE, train=False, gpu_id=gpu_id)
+    nu.initialize_gpu_from_weights_file(
+        model, weights_file, gpu_id=gpu_id,
+    )
+    model_builder.add_inference_inputs(model)
+    workspace.CreateNet(model.net)
+    return model
+
+
 def generate_proposals_on_roidb(
     model, roidb, start_ind=None, end_ind=None, total_num_images=None,
     gpu_id=0,
@@ -182,35 +220,61 @@ def generate_proposals_on_roidb(
         start_ind = 0
         end_ind = num_images
         total_num_images = num_images
-    for i in range(num_images):
-        roidb_ids[i] = roidb[i]['id']
-        im = cv2.imread(roidb[i]['image'])
-        with c2_utils.NamedCudaScope(gpu_id):
-            _t.tic()
-            roidb_boxes[i], roidb_scores[i] = im_proposals(model, im)
-            _t.toc()
-        if i % 10 == 0:
-            ave_time = _t.average_time
-            eta_seconds = ave_time * (num_images - i - 1)
-            eta = str(datetime.timedelta(seconds=int(eta_seconds)))
-            logger.info(
-                (
-                    'rpn_generate: range [{:d}, {:d}] of {:d}: '
-                    '{:d}/{:d} {:.3f}s (eta: {})'
-                ).format(
-                    start_ind + 1, end_ind, total_num_images, start_ind + i + 1,
-                    start_ind + num_images, ave_time, eta
+    # The images are read and preprocessed ahead of the net by a pool of
+    # threads (see TEST.NUM_LOADER_THREADS)
+    load_timer = Timer()
+    load_pool = OrderedThreadPool(
+        cfg.TEST.NUM_LOADER_THREADS, timer=load_timer
+    )
+    try:
+        im_blobs = load_pool.imap(
+            functools.partial(_load_image_blob, roidb), range(num_images),
+            cfg.TEST.PIPELINE_DEPTH
+        )
+        for i, im_blob in enumerate(im_blobs):
+            roidb_ids[i] = roidb[i]['id']
+            with c2_utils.NamedDeviceScope(gpu_id):
+                _t.tic()
+                roidb_boxes[i], roidb_scores[i] = im_proposals(
+                    model, None, im_blob=im_blob
                 )
-            )
+                _t.toc()
+            if i % 10 == 0:
+                ave_time = _t.average_time
+                eta_seconds = ave_time * (num_images - i - 1)
+                eta = str(datetime.timedelta(seconds=int(eta_seconds)))
+                logger.info(
+                    (
+                        'rpn_generate: range [{:d}, {:d}] of {:d}: '
+                        '{:d}/{:d} {:.3f}s (load: {:.3f}s, eta: {})'
+                    ).format(
+                        start_ind + 1, end_ind, total_num_images,
+                        start_ind + i + 1, start_ind + num_images, ave_time,
+                        load_timer.average_time, eta
+                    )
+                )
+    finally:
+        load_pool.close()
 
     return roidb_boxes, roidb_scores, roidb_ids
 
 
-def im_proposals(model, im):
-    """Generate RPN proposals on a single image."""
+def _load_image_blob(roidb, i):
+    """Loading stage of generate_proposals_on_roidb."""
+    im = cv2.imread(roidb[i]['image'])
+    return blob_utils.get_image_blob(im, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE)
+
+
+def im_proposals(model, im, im_blob=None):
+    """Generate RPN proposals on a single image. The (blob, im_scale, im_info)
+    of the image, as returned by blob_utils.get_image_blob, may be prepared
+    ahead of time and passed as im_blob (im is not used then)."""
+    if im_blob is None:
+        im_blob = blob_utils.get_image_blob(
+            im, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE
+        )
     inputs = {}
-    inputs['data'], im_scale, inputs['im_info'] = \
-        blob_utils.get_image_blob(im, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE)
+    inputs['data'], im_scale, inputs['im_info'] = im_blob
     for k, v in inputs.items():
         workspace.FeedBlob(core.ScopedName(k), v.astype(np.float32, copy=False))
     workspace.RunNet(model.net.Proto().name)
@@ -256,12 +320,11 @@ def get_roidb(dataset_name, ind_range):
     restrict it to a range of indices if ind_range is a pair of integers.
     """
     dataset = JsonDataset(dataset_name)
-    roidb = dataset.get_roidb()
+    roidb = dataset.get_roidb(ind_range=ind_range)
 
     if ind_range is not None:
-        total_num_images = len(roidb)
+        total_num_images = dataset.num_images
         start, end = ind_range
-        roidb = roidb[start:end]
     else:
         start = 0
         end = len(roidb)
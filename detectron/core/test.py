@@ -30,6 +30,7 @@ from __future__ import unicode_literals
 
 from collections import defaultdict
 import cv2
+import functools
 import logging
 import numpy as np
 
@@ -108,6 +109,138 @@ def im_detect_all(model, im, box_proposals, timers=None):
     return cls_boxes, cls_segms, cls_keyps
 
 
+def im_detect_all_batch(model, ims, box_proposals_list, timers=None):
+    """Batched version of im_detect_all: the images (with their box proposals,
+    or box_proposals_list=None if the model generates them) are detected with
+    a single run of each net (see TEST.IMS_PER_BATCH). Returns the list of the
+    (cls_boxes, cls_segms, cls_keyps) of each image.
+    """
+    if timers is None:
+        timers = defaultdict(Timer)
+    postprocess_fns = im_detect_all_deferred(
+        model, ims, box_proposals_list, timers
+    )
+    timers['misc_postprocess'].tic()
+    results = [postprocess_fn() for postprocess_fn in postprocess_fns]
+    timers['misc_postprocess'].toc()
+    return results
+
+
+def im_detect_all_deferred(
+    model, ims, box_proposals_list, timers=None, im_blobs=None
+):
+    """Run the nets of im_detect_all_batch, deferring the post-processing of
+    their outputs. Returns, for each image, a function without arguments that
+    returns the (cls_boxes, cls_segms, cls_keyps) of the image. The functions
+    do not use the workspace, so they may run on other threads while the nets
+    process the next images (see test_engine.test_net).
+
+    The data blob of the images may be prepared ahead of time and passed as
+    im_blobs, the (blob, im_scales, im_info) returned by
+    blob_utils.get_image_batch_blob. With test-time augmentation, ims must
+    hold a single image, which is fully processed by im_detect_all.
+    """
+    if timers is None:
+        timers = defaultdict(Timer)
+
+    if cfg.TEST.BBOX_AUG.ENABLED or cfg.TEST.MASK_AUG.ENABLED or \
+            cfg.TEST.KPS_AUG.ENABLED:
+        assert len(ims) == 1, \
+            'Test-time augmentation is not supported with batched inference'
+        results = im_detect_all(
+            model, ims[0],
+            None if box_proposals_list is None else box_proposals_list[0],
+            timers
+        )
+        return [lambda: results]
+
+    # Handle RetinaNet testing separately for now
+    if cfg.RETINANET.RETINANET_ON:
+        return [
+            functools.partial(_retinanet_results, cls_boxes_fn)
+            for cls_boxes_fn in test_retinanet.im_detect_bbox_deferred(
+                model, ims, timers, im_blobs=im_blobs
+            )
+        ]
+
+    timers['im_detect_bbox'].tic()
+    bbox_results = im_detect_bbox_batch(
+        model, ims, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE,
+        boxes_list=box_proposals_list, im_blobs=im_blobs
+    )
+    timers['im_detect_bbox'].toc()
+
+    if not cfg.MODEL.MASK_ON and not cfg.MODEL.KEYPOINTS_ON:
+        # No head needs the detections, so NMS is deferred as well
+        return [
+            functools.partial(
+                _postprocess_detections, scores, boxes, None, None, None,
+                im.shape
+            ) for im, (scores, boxes, _) in zip(ims, bbox_results)
+        ]
+
+    timers['misc_bbox'].tic()
+    im_scales, boxes_list, cls_boxes_list = [], [], []
+    for scores, boxes, im_scale in bbox_results:
+        scores, boxes, cls_boxes = box_results_with_nms_and_limit(
+            scores, boxes
+        )
+        im_scales.append(im_scale)
+        boxes_list.append(boxes)
+        cls_boxes_list.append(cls_boxes)
+    timers['misc_bbox'].toc()
+    has_boxes = any(boxes.shape[0] > 0 for boxes in boxes_list)
+
+    masks_list = [None] * len(ims)
+    if cfg.MODEL.MASK_ON and has_boxes:
+        timers['im_detect_mask'].tic()
+        masks_list = im_detect_mask_batch(model, im_scales, boxes_list)
+        timers['im_detect_mask'].toc()
+
+    heatmaps_list = [None] * len(ims)
+    if cfg.MODEL.KEYPOINTS_ON and has_boxes:
+        timers['im_detect_keypoints'].tic()
+        heatmaps_list = im_detect_keypoints_batch(model, im_scales, boxes_list)
+        timers['im_detect_keypoints'].toc()
+
+    postprocess_fns = []
+    for im, boxes, cls_boxes, masks, heatmaps in zip(
+        ims, boxes_list, cls_boxes_list, masks_list, heatmaps_list
+    ):
+        if boxes.shape[0] == 0:
+            masks, heatmaps = None, None
+        postprocess_fns.append(
+            functools.partial(
+                _postprocess_detections, None, boxes, cls_boxes, masks,
+                heatmaps, im.shape
+            )
+        )
+    return postprocess_fns
+
+
+def _postprocess_detections(
+    scores, boxes, cls_boxes, masks, heatmaps, im_shape
+):
+    """Post-processing of the net outputs for one image (see
+    im_detect_all_deferred). NMS is applied to the scores and boxes if
+    cls_boxes is None. The masks and heatmaps are None if there are none."""
+    if cls_boxes is None:
+        scores, boxes, cls_boxes = box_results_with_nms_and_limit(scores, boxes)
+    cls_segms = None
+    if masks is not None:
+        cls_segms = segm_results(
+            cls_boxes, masks, boxes, im_shape[0], im_shape[1]
+        )
+    cls_keyps = None
+    if heatmaps is not None:
+        cls_keyps = keypoint_results(cls_boxes, heatmaps, boxes)
+    return cls_boxes, cls_segms, cls_keyps
+
+
+def _retinanet_results(cls_boxes_fn):
+    return cls_boxes_fn(), None, None
+
+
 def im_conv_body_only(model, im, target_scale, target_max_size):
     """Runs `model.conv_body_net` on the given image `im`."""
     im_blob, im_scale, _im_info = blob_utils.get_image_blob(
@@ -134,20 +267,47 @@ def im_detect_bbox(model, im, target_scale, target_max_size, boxes=None):
         im_scales (list): list of image scales used in the input blob (as
             returned by _get_blobs and for use with im_detect_mask, etc.)
     """
-    inputs, im_scale = _get_blobs(im, boxes, target_scale, target_max_size)
-
-    # When mapping from image ROIs to feature map ROIs, there's some aliasing
-    # (some distinct image ROIs get mapped to the same feature ROI).
-    # Here, we identify duplicate feature ROIs, so we only compute features
-    # on the unique subset.
-    if cfg.DEDUP_BOXES > 0 and not cfg.MODEL.FASTER_RCNN:
-        v = np.array([1, 1e3, 1e6, 1e9, 1e12])
-        hashes = np.round(inputs['rois'] * cfg.DEDUP_BOXES).dot(v)
-        _, index, inv_index = np.unique(
-            hashes, return_index=True, return_inverse=True
-        )
-        inputs['rois'] = inputs['rois'][index, :]
-        boxes = boxes[index, :]
+    return im_detect_bbox_batch(
+        model, [im], target_scale, target_max_size,
+        boxes_list=None if boxes is None else [boxes]
+    )[0]
+
+
+def im_detect_bbox_batch(
+    model, ims, target_scale, target_max_size, boxes_list=None, im_blobs=None
+):
+    """Batched version of im_detect_bbox: bounding box object detection for a
+    list of images (with their R_i x 4 box proposals, or boxes_list=None if
+    using RPN) in a single run of the net. Returns the list of the (scores,
+    boxes, im_scale) of each image (see im_detect_bbox). The data blob of the
+    images may be passed as im_blobs (see im_detect_all_deferred).
+    """
+    num_images = len(ims)
+    inputs, im_scales = _get_blobs(
+        ims, boxes_list, target_scale, target_max_size, im_blobs=im_blobs
+    )
+
+    if boxes_list is not None:
+        rois_list = inputs.pop('rois')
+        boxes_list = list(boxes_list)
+        inv_indices = [None] * num_images
+        for i, rois in enumerate(rois_list):
+            # When mapping from image ROIs to feature map ROIs, there's some
+            # aliasing (some distinct image ROIs get mapped to the same feature
+            # ROI). Here, we identify duplicate feature ROIs, so we only compute
+            # features on the unique subset.
+            if cfg.DEDUP_BOXES > 0 and not cfg.MODEL.FASTER_RCNN:
+                v = np.array([1, 1e3, 1e6, 1e9, 1e12])
+                hashes = np.round(rois * cfg.DEDUP_BOXES).dot(v)
+                _, index, inv_indices[i] = np.unique(
+                    hashes, return_index=True, return_inverse=True
+                )
+                rois = rois[index, :]
+                boxes_list[i] = boxes_list[i][index, :]
+            # Batch index of the rois
+            rois[:, 0] = i
+            rois_list[i] = rois
+        inputs['rois'] = np.concatenate(rois_list)
 
     # Add multi-level rois for FPN
     if cfg.FPN.MULTILEVEL_ROIS and not cfg.MODEL.FASTER_RCNN:
@@ -182,8 +342,8 @@ def im_detect_bbox(model, im, target_scale, target_max_size, boxes=None):
     # Read out blobs
     if cfg.MODEL.FASTER_RCNN:
         rois = workspace.FetchBlob(core.ScopedName(rois_name))
-        # unscale back to raw image space
-        boxes = rois[:, 1:5] / im_scale
+    else:
+        rois = inputs['rois']
 
     # Softmax class probabilities
     scores = workspace.FetchBlob(core.ScopedName(cls_prob_name)).squeeze()
@@ -199,22 +359,38 @@ def im_detect_bbox(model, im, target_scale, target_max_size, boxes=None):
         if cfg.MODEL.CLS_AGNOSTIC_BBOX_REG:
             # Remove predictions for bg class (compat with MSRA code)
             box_deltas = box_deltas[:, -4:]
-        pred_boxes = box_utils.bbox_transform(
-            boxes, box_deltas, bbox_reg_weights
-        )
-        pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im.shape)
-        if cfg.MODEL.CLS_AGNOSTIC_BBOX_REG:
-            pred_boxes = np.tile(pred_boxes, (1, scores.shape[1]))
-    else:
-        # Simply repeat the boxes, once for each class
-        pred_boxes = np.tile(boxes, (1, scores.shape[1]))
 
-    if cfg.DEDUP_BOXES > 0 and not cfg.MODEL.FASTER_RCNN:
-        # Map scores and predictions back to the original set of boxes
-        scores = scores[inv_index, :]
-        pred_boxes = pred_boxes[inv_index, :]
+    # Split the rois (and their predictions) by batch index
+    order = np.argsort(rois[:, 0], kind='mergesort')
+    im_offsets = np.searchsorted(rois[order, 0], np.arange(num_images + 1))
+    results = []
+    for i, (im, im_scale) in enumerate(zip(ims, im_scales)):
+        im_inds = order[im_offsets[i]:im_offsets[i + 1]]
+        if cfg.MODEL.FASTER_RCNN:
+            # unscale back to raw image space
+            boxes = rois[im_inds, 1:5] / im_scale
+        else:
+            boxes = boxes_list[i]
+        im_scores = scores[im_inds, :]
+
+        if cfg.TEST.BBOX_REG:
+            pred_boxes = box_utils.bbox_transform(
+                boxes, box_deltas[im_inds, :], bbox_reg_weights
+            )
+            pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im.shape)
+            if cfg.MODEL.CLS_AGNOSTIC_BBOX_REG:
+                pred_boxes = np.tile(pred_boxes, (1, im_scores.shape[1]))
+        else:
+            # Simply repeat the boxes, once for each class
+            pred_boxes = np.tile(boxes, (1, im_scores.shape[1]))
 
-    return scores, pred_boxes, im_scale
+        if cfg.DEDUP_BOXES > 0 and not cfg.MODEL.FASTER_RCNN:
+            # Map scores and predictions back to the original set of boxes
+            im_scores = im_scores[inv_indices[i], :]
+            pred_boxes = pred_boxes[inv_indices[i], :]
+
+        results.append((im_scores, pred_boxes, im_scale))
+    return results
 
 
 def im_detect_bbox_aug(model, im, box_proposals=None):
@@ -409,12 +585,19 @@ def im_detect_mask(model, im_scale, boxes):
             output by the network (must be processed by segm_results to convert
             into hard masks in the original image coordinate space)
     """
+    return im_detect_mask_batch(model, [im_scale], [boxes])[0]
+
+
+def im_detect_mask_batch(model, im_scales, boxes_list):
+    """Batched version of im_detect_mask: infer the masks of the boxes of a
+    batch of images (see im_detect_bbox_batch) in a single run of the mask
+    net. Returns the list of the pred_masks of each image.
+    """
     M = cfg.MRCNN.RESOLUTION
-    if boxes.shape[0] == 0:
-        pred_masks = np.zeros((0, M, M), np.float32)
-        return pred_masks
+    if all(boxes.shape[0] == 0 for boxes in boxes_list):
+        return [np.zeros((0, M, M), np.float32) for _ in boxes_list]
 
-    inputs = {'mask_rois': _get_rois_blob(boxes, im_scale)}
+    inputs = {'mask_rois': _get_batch_rois_blob(boxes_list, im_scales)}
     # Add multi-level rois for FPN
     if cfg.FPN.MULTILEVEL_ROIS:
         _add_multilevel_rois_for_test(inputs, 'mask_rois')
@@ -433,7 +616,7 @@ def im_detect_mask(model, im_scale, boxes):
     else:
         pred_masks = pred_masks.reshape([-1, 1, M, M])
 
-    return pred_masks
+    return _split_by_image(pred_masks, boxes_list)
 
 
 def im_detect_mask_aug(model, im, boxes):
@@ -577,12 +760,22 @@ def im_detect_keypoints(model, im_scale, boxes):
             by the network (must be processed by keypoint_results to convert
             into point predictions in the original image coordinate space)
     """
+    return im_detect_keypoints_batch(model, [im_scale], [boxes])[0]
+
+
+def im_detect_keypoints_batch(model, im_scales, boxes_list):
+    """Batched version of im_detect_keypoints: infer the keypoints of the
+    boxes of a batch of images (see im_detect_bbox_batch) in a single run of
+    the keypoint net. Returns the list of the pred_heatmaps of each image.
+    """
     M = cfg.KRCNN.HEATMAP_SIZE
-    if boxes.shape[0] == 0:
-        pred_heatmaps = np.zeros((0, cfg.KRCNN.NUM_KEYPOINTS, M, M), np.float32)
-        return pred_heatmaps
+    if all(boxes.shape[0] == 0 for boxes in boxes_list):
+        return [
+            np.zeros((0, cfg.KRCNN.NUM_KEYPOINTS, M, M), np.float32)
+            for _ in boxes_list
+        ]
 
-    inputs = {'keypoint_rois': _get_rois_blob(boxes, im_scale)}
+    inputs = {'keypoint_rois': _get_batch_rois_blob(boxes_list, im_scales)}
 
     # Add multi-level rois for FPN
     if cfg.FPN.MULTILEVEL_ROIS:
@@ -598,7 +791,7 @@ def im_detect_keypoints(model, im_scale, boxes):
     if pred_heatmaps.ndim == 3:
         pred_heatmaps = np.expand_dims(pred_heatmaps, axis=0)
 
-    return pred_heatmaps
+    return _split_by_image(pred_heatmaps, boxes_list)
 
 
 def im_detect_keypoints_aug(model, im, boxes):
@@ -784,51 +977,71 @@ def box_results_with_nms_and_limit(scores, boxes):
     box at `boxes[i, j * 4:(j + 1) * 4]`.
     """
     num_classes = cfg.MODEL.NUM_CLASSES
-    cls_boxes = [[] for _ in range(num_classes)]
-    # Apply threshold on detection probabilities and apply NMS
+    # Apply threshold on detection probabilities of all classes at once
     # Skip j = 0, because it's the background class
-    for j in range(1, num_classes):
-        inds = np.where(scores[:, j] > cfg.TEST.SCORE_THRESH)[0]
-        scores_j = scores[inds, j]
-        boxes_j = boxes[inds, j * 4:(j + 1) * 4]
-        dets_j = np.hstack((boxes_j, scores_j[:, np.newaxis])).astype(
-            np.float32, copy=False
-        )
-        if cfg.TEST.SOFT_NMS.ENABLED:
-            nms_dets, _ = box_utils.soft_nms(
-                dets_j,
-                sigma=cfg.TEST.SOFT_NMS.SIGMA,
-                overlap_thresh=cfg.TEST.NMS,
-                score_thresh=0.0001,
-                method=cfg.TEST.SOFT_NMS.METHOD
-            )
-        else:
-            keep = box_utils.nms(dets_j, cfg.TEST.NMS)
-            nms_dets = dets_j[keep, :]
-        # Refine the post-NMS boxes using bounding-box voting
-        if cfg.TEST.BBOX_VOTE.ENABLED:
-            nms_dets = box_utils.box_voting(
-                nms_dets,
-                dets_j,
-                cfg.TEST.BBOX_VOTE.VOTE_TH,
-                scoring_method=cfg.TEST.BBOX_VOTE.SCORING_METHOD
-            )
-        cls_boxes[j] = nms_dets
+    # The detections are grouped by class, those of class j are
+    # dets[class_offsets[j]:class_offsets[j + 1]]
+    cls_inds, inds = np.where(scores[:, 1:].T > cfg.TEST.SCORE_THRESH)
+    cls_inds += 1
+    dets = np.empty((len(inds), 5), dtype=np.float32)
+    dets[:, :4] = boxes.reshape((boxes.shape[0], -1, 4))[inds, cls_inds]
+    dets[:, 4] = scores[inds, cls_inds]
+    class_offsets = np.searchsorted(cls_inds, np.arange(num_classes + 1))
+
+    # Apply NMS, with the detections of all classes in a single call, unless
+    # the per-class results are modified by soft NMS or box voting
+    if cfg.TEST.SOFT_NMS.ENABLED or cfg.TEST.BBOX_VOTE.ENABLED:
+        if not cfg.TEST.SOFT_NMS.ENABLED:
+            keep = box_utils.batched_nms(dets, class_offsets, cfg.TEST.NMS)
+            keep_offsets = np.searchsorted(keep, class_offsets)
+        cls_dets = []
+        for j in range(1, num_classes):
+            dets_j = dets[class_offsets[j]:class_offsets[j + 1]]
+            if cfg.TEST.SOFT_NMS.ENABLED:
+                nms_dets, _ = box_utils.soft_nms(
+                    dets_j,
+                    sigma=cfg.TEST.SOFT_NMS.SIGMA,
+                    overlap_thresh=cfg.TEST.NMS,
+                    score_thresh=0.0001,
+                    method=cfg.TEST.SOFT_NMS.METHOD
+                )
+            else:
+                nms_dets = dets[keep[keep_offsets[j]:keep_offsets[j + 1]]]
+            # Refine the post-NMS boxes using bounding-box voting
+            if cfg.TEST.BBOX_VOTE.ENABLED:
+                nms_dets = box_utils.box_voting(
+                    nms_dets,
+                    dets_j,
+                    cfg.TEST.BBOX_VOTE.VOTE_TH,
+                    scoring_method=cfg.TEST.BBOX_VOTE.SCORING_METHOD
+                )
+            cls_dets.append(nms_dets)
+        nms_class_offsets = np.zeros(num_classes + 1, dtype=np.int64)
+        np.cumsum([len(d) for d in cls_dets], out=nms_class_offsets[2:])
+        nms_dets = np.vstack(cls_dets)
+    else:
+        keep = box_utils.batched_nms(dets, class_offsets, cfg.TEST.NMS)
+        nms_class_offsets = np.searchsorted(keep, class_offsets)
+        nms_dets = dets[keep]
 
     # Limit to max_per_image detections **over all classes**
-    if cfg.TEST.DETECTIONS_PER_IM > 0:
-        image_scores = np.hstack(
-            [cls_boxes[j][:, -1] for j in range(1, num_classes)]
-        )
-        if len(image_scores) > cfg.TEST.DETECTIONS_PER_IM:
-            image_thresh = np.sort(image_scores)[-cfg.TEST.DETECTIONS_PER_IM]
-            for j in range(1, num_classes):
-                keep = np.where(cls_boxes[j][:, -1] >= image_thresh)[0]
-                cls_boxes[j] = cls_boxes[j][keep, :]
-
-    im_results = np.vstack([cls_boxes[j] for j in range(1, num_classes)])
-    boxes = im_results[:, :-1]
-    scores = im_results[:, -1]
+    if cfg.TEST.DETECTIONS_PER_IM > 0 and \
+            len(nms_dets) > cfg.TEST.DETECTIONS_PER_IM:
+        image_thresh = np.partition(
+            nms_dets[:, -1], -cfg.TEST.DETECTIONS_PER_IM
+        )[-cfg.TEST.DETECTIONS_PER_IM]
+        keep = nms_dets[:, -1] >= image_thresh
+        num_kept = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=num_kept[1:])
+        nms_class_offsets = num_kept[nms_class_offsets]
+        nms_dets = nms_dets[keep]
+
+    cls_boxes = [[]] + [
+        nms_dets[nms_class_offsets[j]:nms_class_offsets[j + 1]]
+        for j in range(1, num_classes)
+    ]
+    boxes = nms_dets[:, :-1]
+    scores = nms_dets[:, -1]
     return scores, boxes, cls_boxes
 
 
@@ -962,11 +1175,38 @@ def _add_multilevel_rois_for_test(blobs, name):
     )
 
 
-def _get_blobs(im, rois, target_scale, target_max_size):
-    """Convert an image and RoIs within that image into network inputs."""
+def _get_batch_rois_blob(boxes_list, im_scales):
+    """Converts the RoIs of a batch of images into a single RoI blob, with the
+    batch index of each image in its first column (see _get_rois_blob)."""
+    rois_list = []
+    for i, (boxes, im_scale) in enumerate(zip(boxes_list, im_scales)):
+        rois = _get_rois_blob(boxes, im_scale)
+        rois[:, 0] = i
+        rois_list.append(rois)
+    return np.concatenate(rois_list)
+
+
+def _split_by_image(preds, boxes_list):
+    """Split per RoI predictions for the RoIs of a batch of images (as
+    returned by _get_batch_rois_blob) into the predictions of each image."""
+    num_boxes = [boxes.shape[0] for boxes in boxes_list]
+    return np.split(preds, np.cumsum(num_boxes)[:-1])
+
+
+def _get_blobs(ims, rois_list, target_scale, target_max_size, im_blobs=None):
+    """Convert a batch of images and the lists of RoIs within each image (or
+    None) into network inputs. The 'rois' are returned as one RoI blob per
+    image. The data blob of the images is used as is if given in im_blobs (as
+    returned by blob_utils.get_image_batch_blob)."""
+    if im_blobs is None:
+        im_blobs = blob_utils.get_image_batch_blob(
+            ims, target_scale, target_max_size
+        )
     blobs = {}
-    blobs['data'], im_scale, blobs['im_info'] = \
-        blob_utils.get_image_blob(im, target_scale, target_max_size)
-    if rois is not None:
-        blobs['rois'] = _get_rois_blob(rois, im_scale)
-    return blobs, im_scale
+    blobs['data'], im_scales, blobs['im_info'] = im_blobs
+    if rois_list is not None:
+        blobs['rois'] = [
+            _get_rois_blob(rois, im_scale)
+            for rois, im_scale in zip(rois_list, im_scales)
+        ]
+    return blobs, im_scales
@@ -23,9 +23,11 @@ from __future__ import unicode_literals
 from collections import defaultdict
 import cv2
 import datetime
+import functools
 import logging
 import numpy as np
 import os
+import time
 import yaml
 
 from caffe2.python import workspace
@@ -34,12 +36,19 @@ from detectron.core.config import cfg
 from detectron.core.config import get_output_dir
 from detectron.core.rpn_generator import generate_rpn_on_dataset
 from detectron.core.rpn_generator import generate_rpn_on_range
-from detectron.core.test import im_detect_all
+from detectron.core.rpn_generator import generate_rpn_worker
+from detectron.core.test import im_detect_all  # NOQA (used by tools)
+from detectron.core.test import im_detect_all_deferred
 from detectron.datasets import task_evaluation
 from detectron.datasets.json_dataset import JsonDataset
 from detectron.modeling import model_builder
+from detectron.utils.detection_log import DetectionLogWriter
+from detectron.utils.detection_log import load_detection_log
+from detectron.utils.detection_results import DetectionResultsBuilder
 from detectron.utils.io import save_object
+from detectron.utils.pipeline import OrderedThreadPool
 from detectron.utils.timer import Timer
+import detectron.utils.blob as blob_utils
 import detectron.utils.c2 as c2_utils
 import detectron.utils.env as envu
 import detectron.utils.net as net_utils
@@ -54,13 +63,15 @@ def get_eval_functions():
     if cfg.MODEL.RPN_ONLY:
         child_func = generate_rpn_on_range
         parent_func = generate_rpn_on_dataset
+        worker_func = generate_rpn_worker
     else:
         # Generic case that handles all network types other than RPN-only nets
         # and RetinaNet
         child_func = test_net
         parent_func = test_net_on_dataset
+        worker_func = test_net_worker
 
-    return parent_func, child_func
+    return parent_func, child_func, worker_func
 
 
 def get_inference_dataset(index, is_parent=True):
@@ -85,10 +96,10 @@ def get_inference_dataset(index, is_parent=True):
 def run_inference(
     weights_file, ind_range=None,
     multi_gpu_testing=False, gpu_id=0,
-    check_expected_results=False,
+    check_expected_results=False, worker_address=None,
 ):
-    parent_func, child_func = get_eval_functions()
-    is_parent = ind_range is None
+    parent_func, child_func, worker_func = get_eval_functions()
+    is_parent = ind_range is None and worker_address is None
 
     def result_getter():
         if is_parent:
@@ -110,6 +121,21 @@ def run_inference(
                 all_results.update(results)
 
             return all_results
+        elif worker_address is not None:
+            # Worker subprocess case:
+            # In this case test_net was called via subprocess.Popen to run on
+            # the chunks of inputs of a single dataset pulled from the worker
+            # pool of the parent at worker_address
+            dataset_name, proposal_file = get_inference_dataset(0, is_parent=False)
+            output_dir = get_output_dir(dataset_name, training=False)
+            return worker_func(
+                weights_file,
+                dataset_name,
+                proposal_file,
+                output_dir,
+                worker_address,
+                gpu_id=gpu_id
+            )
         else:
             # Subprocess child case:
             # In this case test_net was called via subprocess.Popen to execute on a
@@ -149,27 +175,25 @@ def test_net_on_dataset(
     dataset = JsonDataset(dataset_name)
     test_timer = Timer()
     test_timer.tic()
-    if multi_gpu:
-        num_images = len(dataset.get_roidb())
-        all_boxes, all_segms, all_keyps = multi_gpu_test_net_on_dataset(
+    if multi_gpu or subprocess_utils.use_cpu_workers():
+        num_images = dataset.num_images
+        detections = multi_gpu_test_net_on_dataset(
             weights_file, dataset_name, proposal_file, num_images, output_dir
         )
     else:
-        all_boxes, all_segms, all_keyps = test_net(
+        detections = test_net(
             weights_file, dataset_name, proposal_file, output_dir, gpu_id=gpu_id
         )
     test_timer.toc()
     logger.info('Total inference time: {:.3f}s'.format(test_timer.average_time))
-    results = task_evaluation.evaluate_all(
-        dataset, all_boxes, all_segms, all_keyps, output_dir
-    )
+    results = task_evaluation.evaluate_all(dataset, detections, output_dir)
     return results
 
 
 def multi_gpu_test_net_on_dataset(
     weights_file, dataset_name, proposal_file, num_images, output_dir
 ):
-    """Multi-gpu inference on a dataset."""
+    """Multi-gpu (or multi-worker CPU) inference on a dataset."""
     binary_dir = envu.get_runtime_dir()
     binary_ext = envu.get_py_bin_ext()
     binary = os.path.join(binary_dir, 'test_net' + binary_ext)
@@ -181,38 +205,23 @@ def multi_gpu_test_net_on_dataset(
     if proposal_file:
         opts += ['TEST.PROPOSAL_FILES', '("{}",)'.format(proposal_file)]
 
-    # Run inference in parallel in subprocesses
-    # Outputs will be a list of outputs from each subprocess, where the output
-    # of each subprocess is the dictionary saved by test_net().
-    outputs = subprocess_utils.process_in_parallel(
-        'detection', num_images, binary, output_dir, opts
-    )
-
-    # Collate the results from each subprocess
-    all_boxes = [[] for _ in range(cfg.MODEL.NUM_CLASSES)]
-    all_segms = [[] for _ in range(cfg.MODEL.NUM_CLASSES)]
-    all_keyps = [[] for _ in range(cfg.MODEL.NUM_CLASSES)]
-    for det_data in outputs:
-        all_boxes_batch = det_data['all_boxes']
-        all_segms_batch = det_data['all_segms']
-        all_keyps_batch = det_data['all_keyps']
-        for cls_idx in range(1, cfg.MODEL.NUM_CLASSES):
-            all_boxes[cls_idx] += all_boxes_batch[cls_idx]
-            all_segms[cls_idx] += all_segms_batch[cls_idx]
-            all_keyps[cls_idx] += all_keyps_batch[cls_idx]
+    # Run inference in a pool of worker subprocesses that pull chunks of image
+    # indices, and collect the results as the chunks complete
     det_file = os.path.join(output_dir, 'detections.pkl')
-    cfg_yaml = yaml.dump(cfg)
-    save_object(
-        dict(
-            all_boxes=all_boxes,
-            all_segms=all_segms,
-            all_keyps=all_keyps,
-            cfg=cfg_yaml
-        ), det_file
-    )
-    logger.info('Wrote detections to: {}'.format(os.path.abspath(det_file)))
-
-    return all_boxes, all_segms, all_keyps
+    collector = _get_detection_collector(det_file, num_images)
+    done_inds = _get_done_inds(collector)
+    chunks = [
+        [i for i in chunk if i not in done_inds]
+        for chunk in subprocess_utils.get_chunks(num_images)
+    ]
+    chunks = [chunk for chunk in chunks if len(chunk) > 0]
+    for _, chunk in subprocess_utils.process_in_worker_pool(
+        'detection', chunks, binary, output_dir, opts
+    ):
+        # The workers send the detections of their chunks as flat arrays
+        if chunk is not None:
+            collector.append_chunk(chunk)
+    return _save_detections(collector, det_file)
 
 
 def test_net(
@@ -234,81 +243,226 @@ def test_net(
     )
     model = initialize_model_from_cfg(weights_file, gpu_id=gpu_id)
     num_images = len(roidb)
-    num_classes = cfg.MODEL.NUM_CLASSES
-    all_boxes, all_segms, all_keyps = empty_results(num_classes, num_images)
+    if ind_range is not None:
+        det_name = 'detection_range_%s_%s.pkl' % tuple(ind_range)
+    else:
+        det_name = 'detections.pkl'
+    det_file = os.path.join(output_dir, det_name)
+    collector = _get_detection_collector(det_file, num_images)
+    done_inds = _get_done_inds(collector)
+    inds = [i for i in range(num_images) if i not in done_inds]
     timers = defaultdict(Timer)
-    for i, entry in enumerate(roidb):
-        if cfg.TEST.PRECOMPUTED_PROPOSALS:
-            # The roidb may contain ground-truth rois (for example, if the roidb
-            # comes from the training or val split). We only want to evaluate
-            # detection on the *non*-ground-truth rois. We select only the rois
-            # that have the gt_classes field set to 0, which means there's no
-            # ground truth.
-            box_proposals = entry['boxes'][entry['gt_classes'] == 0]
-            if len(box_proposals) == 0:
-                continue
-        else:
-            # Faster R-CNN type models generate proposals on-the-fly with an
-            # in-network RPN; 1-stage models don't require proposals.
-            box_proposals = None
-
-        im = cv2.imread(entry['image'])
-        with c2_utils.NamedCudaScope(gpu_id):
-            cls_boxes_i, cls_segms_i, cls_keyps_i = im_detect_all(
-                model, im, box_proposals, timers
-            )
-
-        extend_results(i, all_boxes, cls_boxes_i)
-        if cls_segms_i is not None:
-            extend_results(i, all_segms, cls_segms_i)
-        if cls_keyps_i is not None:
-            extend_results(i, all_keyps, cls_keyps_i)
+    batches = _get_inference_batches(roidb, cfg.TEST.IMS_PER_BATCH, inds)
+    start_time = time.time()
+    num_done = num_images - len(inds)
+    for batch_i, (batch_inds, ims, im_results) in enumerate(
+        detect_batches(model, roidb, batches, timers, gpu_id=gpu_id)
+    ):
+        num_done += len(batches[batch_i])
+        for i, im, (cls_boxes_i, cls_segms_i, cls_keyps_i) in zip(
+            batch_inds, ims, im_results
+        ):
+            collector.append(i, cls_boxes_i, cls_segms_i, cls_keyps_i)
+            if cfg.VIS:
+                vis_results(
+                    roidb[i], i, im, cls_boxes_i, cls_segms_i, cls_keyps_i,
+                    dataset, output_dir
+                )
 
-        if i % 10 == 0:  # Reduce log file size
-            ave_total_time = np.sum([t.average_time for t in timers.values()])
-            eta_seconds = ave_total_time * (num_images - i - 1)
+        if batch_i % 10 == 0:  # Reduce log file size
+            # The stages overlap, so the eta is based on the wall time
+            elapsed = time.time() - start_time
+            eta_seconds = elapsed / (batch_i + 1) * (
+                len(batches) - batch_i - 1
+            )
             eta = str(datetime.timedelta(seconds=int(eta_seconds)))
             det_time = (
                 timers['im_detect_bbox'].average_time +
                 timers['im_detect_mask'].average_time +
                 timers['im_detect_keypoints'].average_time
             )
-            misc_time = (
-                timers['misc_bbox'].average_time +
-                timers['misc_mask'].average_time +
-                timers['misc_keypoints'].average_time
-            )
             logger.info(
                 (
                     'im_detect: range [{:d}, {:d}] of {:d}: '
-                    '{:d}/{:d} {:.3f}s + {:.3f}s (eta: {})'
+                    '{:d}/{:d} {:.3f}s + {:.3f}s (load: {:.3f}s, '
+                    'postprocess: {:.3f}s, eta: {})'
                 ).format(
-                    start_ind + 1, end_ind, total_num_images, start_ind + i + 1,
-                    start_ind + num_images, det_time, misc_time, eta
+                    start_ind + 1, end_ind, total_num_images,
+                    start_ind + num_done, start_ind + num_images,
+                    det_time, timers['misc_bbox'].average_time,
+                    timers['load'].average_time,
+                    timers['postprocess'].average_time, eta
                 )
             )
 
-        if cfg.VIS:
-            im_name = os.path.splitext(os.path.basename(entry['image']))[0]
-            vis_utils.vis_one_image(
-                im[:, :, ::-1],
-                '{:d}_{:s}'.format(i, im_name),
-                os.path.join(output_dir, 'vis'),
-                cls_boxes_i,
-                segms=cls_segms_i,
-                keypoints=cls_keyps_i,
-                thresh=cfg.VIS_TH,
-                box_alpha=0.8,
-                dataset=dataset,
-                show_class=True
+    return _save_detections(collector, det_file)
+
+
+def test_net_worker(
+    weights_file,
+    dataset_name,
+    proposal_file,
+    output_dir,
+    worker_address,
+    gpu_id=0
+):
+    """Run inference as a worker of multi_gpu_test_net_on_dataset: the roidb
+    and the model are set up once, then the chunks of image indices pulled
+    from the worker pool are detected until the pool is exhausted.
+    """
+    assert not cfg.MODEL.RPN_ONLY, \
+        'Use rpn_generate to generate proposals from RPN-only models'
+
+    roidb, dataset, _, _, _ = get_roidb_and_dataset(
+        dataset_name, proposal_file, None
+    )
+    model = initialize_model_from_cfg(weights_file, gpu_id=gpu_id)
+    timers = defaultdict(Timer)
+
+    def process_chunk(inds):
+        batches = _get_inference_batches(roidb, cfg.TEST.IMS_PER_BATCH, inds)
+        builder = DetectionResultsBuilder(
+            len(roidb), cfg.MODEL.NUM_CLASSES,
+            has_segms=cfg.MODEL.MASK_ON, has_keyps=cfg.MODEL.KEYPOINTS_ON
+        )
+        for batch_inds, ims, im_results in detect_batches(
+            model, roidb, batches, timers, gpu_id=gpu_id
+        ):
+            for i, im, (cls_boxes_i, cls_segms_i, cls_keyps_i) in zip(
+                batch_inds, ims, im_results
+            ):
+                builder.append(i, cls_boxes_i, cls_segms_i, cls_keyps_i)
+                if cfg.VIS:
+                    vis_results(
+                        roidb[i], i, im, cls_boxes_i, cls_segms_i,
+                        cls_keyps_i, dataset, output_dir
+                    )
+        logger.info(
+            'im_detect: images [{:d}, {:d}]: {:.3f}s + {:.3f}s (load: '
+            '{:.3f}s, postprocess: {:.3f}s)'.format(
+                inds[0] + 1, inds[-1] + 1,
+                timers['im_detect_bbox'].average_time +
+                timers['im_detect_mask'].average_time +
+                timers['im_detect_keypoints'].average_time,
+                timers['misc_bbox'].average_time, timers['load'].average_time,
+                timers['postprocess'].average_time
             )
+        )
+        return builder.pop_chunk()
+
+    subprocess_utils.run_worker(worker_address, process_chunk)
+
+
+def detect_batches(model, roidb, batches, timers, gpu_id=0):
+    """Detect objects in the inference minibatches of roidb indices in
+    batches, running the loading, net and post-processing stages of the
+    inference pipeline concurrently. Yields the (batch_inds, ims, im_results)
+    of each minibatch in order, where im_results holds the (cls_boxes,
+    cls_segms, cls_keyps) of each image of ims (images without proposals
+    are skipped).
+    """
+    # The images are read and preprocessed ahead of the net by the load pool,
+    # and the net outputs are post-processed by the post-processing pool while
+    # the net runs on the next minibatches
+    load_pool = OrderedThreadPool(
+        cfg.TEST.NUM_LOADER_THREADS, timer=timers['load']
+    )
+    postprocess_pool = OrderedThreadPool(
+        cfg.TEST.NUM_POSTPROCESS_THREADS, timer=timers['postprocess']
+    )
+    try:
+        loaded_batches = load_pool.imap(
+            functools.partial(_load_inference_batch, roidb), batches,
+            cfg.TEST.PIPELINE_DEPTH
+        )
+        for batch_inds, ims, box_proposals_list, im_blobs in loaded_batches:
+            postprocess_fns = []
+            if len(ims) > 0:
+                with c2_utils.NamedDeviceScope(gpu_id):
+                    postprocess_fns = im_detect_all_deferred(
+                        model, ims, box_proposals_list, timers,
+                        im_blobs=im_blobs
+                    )
+            postprocess_pool.submit(
+                _postprocess_batch, batch_inds, ims, postprocess_fns
+            )
+            # Yield the results that are ready, and wait for the oldest ones
+            # if post-processing falls behind
+            while len(postprocess_pool) > 0 and (
+                len(postprocess_pool) >= cfg.TEST.PIPELINE_DEPTH or
+                postprocess_pool.ready()
+            ):
+                yield postprocess_pool.get()
+        while len(postprocess_pool) > 0:
+            yield postprocess_pool.get()
+    finally:
+        load_pool.close()
+        postprocess_pool.close()
+
+
+def vis_results(
+    entry, i, im, cls_boxes_i, cls_segms_i, cls_keyps_i, dataset, output_dir
+):
+    """Visualize the detections of image i (see cfg.VIS)."""
+    im_name = os.path.splitext(os.path.basename(entry['image']))[0]
+    vis_utils.vis_one_image(
+        im[:, :, ::-1],
+        '{:d}_{:s}'.format(i, im_name),
+        os.path.join(output_dir, 'vis'),
+        cls_boxes_i,
+        segms=cls_segms_i,
+        keypoints=cls_keyps_i,
+        thresh=cfg.VIS_TH,
+        box_alpha=0.8,
+        dataset=dataset,
+        show_class=True
+    )
+
+
+def _get_detection_collector(det_file, num_images):
+    """Return the collector of the detections of test_net: a writer of the
+    detection log that replaces det_file if cfg.TEST.DETECTION_LOG is enabled,
+    or else a DetectionResultsBuilder."""
+    if not cfg.TEST.DETECTION_LOG.ENABLED:
+        return DetectionResultsBuilder(
+            num_images, cfg.MODEL.NUM_CLASSES,
+            has_segms=cfg.MODEL.MASK_ON, has_keyps=cfg.MODEL.KEYPOINTS_ON
+        )
+    return DetectionLogWriter(
+        os.path.splitext(det_file)[0] + '_log',
+        num_images,
+        cfg.MODEL.NUM_CLASSES,
+        has_segms=cfg.MODEL.MASK_ON,
+        has_keyps=cfg.MODEL.KEYPOINTS_ON,
+        cfg_yaml=yaml.dump(cfg),
+        resume=cfg.TEST.DETECTION_LOG.RESUME,
+        ims_per_chunk=cfg.TEST.DETECTION_LOG.IMS_PER_CHUNK
+    )
+
+
+def _get_done_inds(collector):
+    """Return the indices of the images that a resumed detection log already
+    holds."""
+    if isinstance(collector, DetectionLogWriter):
+        return collector.done_inds
+    return set()
 
+
+def _save_detections(collector, det_file):
+    """Write the collected detections to det_file (or the remaining ones to
+    the detection log), and return their DetectionResults."""
+    if isinstance(collector, DetectionLogWriter):
+        collector.close()
+        logger.info(
+            'Wrote detections to: {}'.format(
+                os.path.abspath(collector.log_dir)
+            )
+        )
+        detections, _ = load_detection_log(collector.log_dir)
+        return detections
+    detections = collector.build()
+    all_boxes, all_segms, all_keyps = detections.to_all_results()
     cfg_yaml = yaml.dump(cfg)
-    if ind_range is not None:
-        det_name = 'detection_range_%s_%s.pkl' % tuple(ind_range)
-    else:
-        det_name = 'detections.pkl'
-    det_file = os.path.join(output_dir, det_name)
     save_object(
         dict(
             all_boxes=all_boxes,
@@ -318,7 +472,64 @@ def test_net(
         ), det_file
     )
     logger.info('Wrote detections to: {}'.format(os.path.abspath(det_file)))
-    return all_boxes, all_segms, all_keyps
+    return detections
+
+
+def _get_inference_batches(roidb, ims_per_batch, inds):
+    """Split the roidb indices inds into inference minibatches of
+    ims_per_batch images. The images are grouped by aspect ratio to minimize
+    the padding of the minibatch blobs."""
+    inds = list(inds)
+    if ims_per_batch == 1:
+        return [[i] for i in inds]
+    aspect_ratios = [
+        float(roidb[i]['width']) / float(roidb[i]['height']) for i in inds
+    ]
+    order = np.argsort(aspect_ratios, kind='mergesort')
+    return [
+        [inds[j] for j in order[start:start + ims_per_batch]]
+        for start in range(0, len(order), ims_per_batch)
+    ]
+
+
+def _load_inference_batch(roidb, batch):
+    """Loading stage of test_net: read the images of an inference minibatch,
+    select their box proposals (images without proposals are skipped) and
+    prepare their data blob."""
+    batch_inds, ims, box_proposals_list = [], [], []
+    for i in batch:
+        entry = roidb[i]
+        if cfg.TEST.PRECOMPUTED_PROPOSALS:
+            # The roidb may contain ground-truth rois (for example, if the
+            # roidb comes from the training or val split). We only want to
+            # evaluate detection on the *non*-ground-truth rois. We select
+            # only the rois that have the gt_classes field set to 0, which
+            # means there's no ground truth.
+            box_proposals = entry['boxes'][entry['gt_classes'] == 0]
+            if len(box_proposals) == 0:
+                continue
+            box_proposals_list.append(box_proposals)
+        batch_inds.append(i)
+        ims.append(cv2.imread(entry['image']))
+    if not cfg.TEST.PRECOMPUTED_PROPOSALS:
+        # Faster R-CNN type models generate proposals on-the-fly with an
+        # in-network RPN; 1-stage models don't require proposals.
+        box_proposals_list = None
+
+    im_blobs = None
+    test_aug = cfg.TEST.BBOX_AUG.ENABLED or cfg.TEST.MASK_AUG.ENABLED or \
+        cfg.TEST.KPS_AUG.ENABLED
+    if len(ims) > 0 and not test_aug:
+        im_blobs = blob_utils.get_image_batch_blob(
+            ims, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE
+        )
+    return batch_inds, ims, box_proposals_list, im_blobs
+
+
+def _postprocess_batch(batch_inds, ims, postprocess_fns):
+    """Post-processing stage of test_net (see im_detect_all_deferred)."""
+    im_results = [postprocess_fn() for postprocess_fn in postprocess_fns]
+    return batch_inds, ims, im_results
 
 
 def initialize_model_from_cfg(weights_file, gpu_id=0):
@@ -348,15 +559,15 @@ def get_roidb_and_dataset(dataset_name, proposal_file, ind_range):
         assert proposal_file, 'No proposal file given'
         roidb = dataset.get_roidb(
             proposal_file=proposal_file,
-            proposal_limit=cfg.TEST.PROPOSAL_LIMIT
+            proposal_limit=cfg.TEST.PROPOSAL_LIMIT,
+            ind_range=ind_range
         )
     else:
-        roidb = dataset.get_roidb()
+        roidb = dataset.get_roidb(ind_range=ind_range)
 
     if ind_range is not None:
-        total_num_images = len(roidb)
+        total_num_images = dataset.num_images
         start, end = ind_range
-        roidb = roidb[start:end]
     else:
         start = 0
         end = len(roidb)
@@ -364,33 +575,3 @@ def get_roidb_and_dataset(dataset_name, proposal_file, ind_range):
 
     return roidb, dataset, start, end, total_num_images
 
-
-def empty_results(num_classes, num_images):
-    """Return empty results lists for boxes, masks, and keypoints.
-    Box detections are collected into:
-      all_boxes[cls][image] = N x 5 array with columns (x1, y1, x2, y2, score)
-    Instance mask predictions are collected into:
-      all_segms[cls][image] = [...] list of COCO RLE encoded masks that are in
-      1:1 correspondence with the boxes in all_boxes[cls][image]
-    Keypoint predictions are collected into:
-      all_keyps[cls][image] = [...] list of keypoints results, each encoded as
-      a 3D array (#rois, 4, #keypoints) with the 4 rows corresponding to
-      [x, y, logit, prob] (See: utils.keypoints.heatmaps_to_keypoints).
-      Keypoints are recorded for person (cls = 1); they are in 1:1
-      correspondence with the boxes in all_boxes[cls][image].
-    """
-    # Note: do not be tempted to use [[] * N], which gives N references to the
-    # *same* empty list.
-    all_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
-    all_segms = [[[] for _ in range(num_images)] for _ in range(num_classes)]
-    all_keyps = [[[] for _ in range(num_images)] for _ in range(num_classes)]
-    return all_boxes, all_segms, all_keyps
-
-
-def extend_results(index, all_res, im_res):
-    """Add results for an image to the set of all results at the specified
-    index.
-    """
-    # Skip cls_idx 0 (__background__)
-    for cls_idx in range(1, len(im_res)):
-        all_res[cls_idx][index] = im_res[cls_idx]
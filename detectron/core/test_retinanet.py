@@ -21,6 +21,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import numpy as np
+import functools
 import logging
 from collections import defaultdict
 
@@ -64,19 +65,55 @@ def _create_cell_anchors():
     return anchors
 
 
+# Cache of the cell anchors (see _get_cell_anchors)
+_cell_anchors_cache = {}
+
+
+def _get_cell_anchors():
+    """Return the cell anchors of all FPN levels, created once per anchor
+    configuration."""
+    cache_key = (
+        cfg.FPN.RPN_MIN_LEVEL, cfg.FPN.RPN_MAX_LEVEL,
+        cfg.RETINANET.SCALES_PER_OCTAVE, tuple(cfg.RETINANET.ASPECT_RATIOS),
+        cfg.RETINANET.ANCHOR_SCALE
+    )
+    if cache_key not in _cell_anchors_cache:
+        _cell_anchors_cache[cache_key] = _create_cell_anchors()
+    return _cell_anchors_cache[cache_key]
+
+
 def im_detect_bbox(model, im, timers=None):
     """Generate RetinaNet detections on a single image."""
+    return im_detect_bbox_batch(model, [im], timers)[0]
+
+
+def im_detect_bbox_batch(model, ims, timers=None):
+    """Generate RetinaNet detections on a batch of images with a single run of
+    the net. Returns the list of the cls_boxes of each image."""
+    if timers is None:
+        timers = defaultdict(Timer)
+    cls_boxes_fns = im_detect_bbox_deferred(model, ims, timers)
+    timers['misc_bbox'].tic()
+    cls_boxes_list = [cls_boxes_fn() for cls_boxes_fn in cls_boxes_fns]
+    timers['misc_bbox'].toc()
+    return cls_boxes_list
+
+
+def im_detect_bbox_deferred(model, ims, timers=None, im_blobs=None):
+    """Run the net of im_detect_bbox_batch, deferring the post-processing of
+    its outputs. Returns, for each image, a function without arguments that
+    returns the cls_boxes of the image (see core.test.im_detect_all_deferred).
+    """
     if timers is None:
         timers = defaultdict(Timer)
-    # Although anchors are input independent and could be precomputed,
-    # recomputing them per image only brings a small overhead
-    anchors = _create_cell_anchors()
     timers['im_detect_bbox'].tic()
     k_max, k_min = cfg.FPN.RPN_MAX_LEVEL, cfg.FPN.RPN_MIN_LEVEL
-    A = cfg.RETINANET.SCALES_PER_OCTAVE * len(cfg.RETINANET.ASPECT_RATIOS)
+    if im_blobs is None:
+        im_blobs = blob_utils.get_image_batch_blob(
+            ims, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE
+        )
     inputs = {}
-    inputs['data'], im_scale, inputs['im_info'] = \
-        blob_utils.get_image_blob(im, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE)
+    inputs['data'], im_scales, inputs['im_info'] = im_blobs
     cls_probs, box_preds = [], []
     for lvl in range(k_min, k_max + 1):
         suffix = 'fpn{}'.format(lvl)
@@ -88,13 +125,55 @@ def im_detect_bbox(model, im, timers=None):
     workspace.RunNet(model.net.Proto().name)
     cls_probs = workspace.FetchBlobs(cls_probs)
     box_preds = workspace.FetchBlobs(box_preds)
+    timers['im_detect_bbox'].toc()
 
-    # here the boxes_all are [x0, y0, x1, y1, score]
-    boxes_all = defaultdict(list)
+    cls_boxes_fns = []
+    for i, (im, im_scale) in enumerate(zip(ims, im_scales)):
+        if len(ims) == 1:
+            # Nothing to crop: the outputs are those of the image on its own
+            im_cls_probs, im_box_preds = cls_probs, box_preds
+        else:
+            # The outputs of image i, cropped to the feature maps that the
+            # image would have on its own. The height and width of im_info are
+            # those of the blob of the image on its own, i.e., including its
+            # FPN.COARSEST_STRIDE padding (see get_image_batch_blob), such
+            # that only the padding added by the batch is dropped
+            padded_height, padded_width = inputs['im_info'][i, :2]
+            im_cls_probs, im_box_preds = [], []
+            for lvl, cls_prob, box_pred in zip(
+                range(k_min, k_max + 1), cls_probs, box_preds
+            ):
+                h = int(np.ceil(padded_height / 2. ** lvl))
+                w = int(np.ceil(padded_width / 2. ** lvl))
+                im_cls_probs.append(cls_prob[i:i + 1, :, :h, :w])
+                im_box_preds.append(box_pred[i:i + 1, :, :h, :w])
+        cls_boxes_fns.append(
+            functools.partial(
+                box_results_from_outputs, im_cls_probs, im_box_preds,
+                im_scale, im.shape
+            )
+        )
+    return cls_boxes_fns
 
-    cnt = 0
-    for lvl in range(k_min, k_max + 1):
-        # create cell anchors array
+
+def box_results_from_outputs(cls_probs, box_preds, im_scale, im_shape):
+    """Decode the RetinaNet outputs of all FPN levels (lists of the per level
+    class probabilities and box predictions of one image) into detections,
+    apply class specific NMS and keep the top scoring detections. Returns the
+    detections in the image cls_boxes format (see utils/detection_results.py).
+    """
+    k_max, k_min = cfg.FPN.RPN_MAX_LEVEL, cfg.FPN.RPN_MIN_LEVEL
+    A = cfg.RETINANET.SCALES_PER_OCTAVE * len(cfg.RETINANET.ASPECT_RATIOS)
+    num_classes = cfg.MODEL.NUM_CLASSES
+    anchors = _get_cell_anchors()
+
+    # The candidates of all levels: [x0, y0, x1, y1, score] and class
+    max_candidates = (k_max - k_min + 1) * cfg.RETINANET.PRE_NMS_TOP_N
+    dets = np.empty((max_candidates, 5), dtype=np.float32)
+    det_classes = np.empty((max_candidates, ), dtype=np.int64)
+    num_dets = 0
+
+    for cnt, lvl in enumerate(range(k_min, k_max + 1)):
         stride = 2. ** lvl
         cell_anchors = anchors[lvl]
 
@@ -104,9 +183,6 @@ def im_detect_bbox(model, im, timers=None):
         cls_prob = cls_prob.reshape((
             cls_prob.shape[0], A, int(cls_prob.shape[1] / A),
             cls_prob.shape[2], cls_prob.shape[3]))
-        box_pred = box_pred.reshape((
-            box_pred.shape[0], A, 4, box_pred.shape[2], box_pred.shape[3]))
-        cnt += 1
 
         if cfg.RETINANET.SOFTMAX:
             cls_prob = cls_prob[:, :, 1::, :, :]
@@ -126,66 +202,60 @@ def im_detect_bbox(model, im, timers=None):
             cls_prob_ravel[candidate_inds], -pre_nms_topn)[-pre_nms_topn:]
         inds = candidate_inds[inds]
 
-        inds_5d = np.array(np.unravel_index(inds, cls_prob.shape)).transpose()
-        classes = inds_5d[:, 2]
-        anchor_ids, y, x = inds_5d[:, 1], inds_5d[:, 3], inds_5d[:, 4]
-        scores = cls_prob[:, anchor_ids, classes, y, x]
+        _, anchor_ids, classes, y, x = np.unravel_index(inds, cls_prob.shape)
+        scores = cls_prob_ravel[inds]
 
         boxes = np.column_stack((x, y, x, y)).astype(dtype=np.float32)
         boxes *= stride
         boxes += cell_anchors[anchor_ids, :]
 
         if not cfg.RETINANET.CLASS_SPECIFIC_BBOX:
+            box_pred = box_pred.reshape((
+                box_pred.shape[0], A, 4, box_pred.shape[2],
+                box_pred.shape[3]))
             box_deltas = box_pred[0, anchor_ids, :, y, x]
         else:
-            box_cls_inds = classes * 4
-            box_deltas = np.vstack(
-                [box_pred[0, ind:ind + 4, yi, xi]
-                 for ind, yi, xi in zip(box_cls_inds, y, x)]
-            )
+            # The deltas of anchor a and class c are at channels
+            # (a * (num_classes - 1) + c) * 4 (see roi_data/retinanet.py)
+            box_pred = box_pred.reshape((
+                box_pred.shape[0], A, num_classes - 1, 4, box_pred.shape[2],
+                box_pred.shape[3]))
+            box_deltas = box_pred[0, anchor_ids, classes, :, y, x]
         pred_boxes = (
             box_utils.bbox_transform(boxes, box_deltas)
             if cfg.TEST.BBOX_REG else boxes)
         pred_boxes /= im_scale
-        pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im.shape)
-        box_scores = np.zeros((pred_boxes.shape[0], 5))
-        box_scores[:, 0:4] = pred_boxes
-        box_scores[:, 4] = scores
-
-        for cls in range(1, cfg.MODEL.NUM_CLASSES):
-            inds = np.where(classes == cls - 1)[0]
-            if len(inds) > 0:
-                boxes_all[cls].extend(box_scores[inds, :])
-    timers['im_detect_bbox'].toc()
+        pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im_shape)
 
-    # Combine predictions across all levels and retain the top scoring by class
-    timers['misc_bbox'].tic()
-    detections = []
-    for cls, boxes in boxes_all.items():
-        cls_dets = np.vstack(boxes).astype(dtype=np.float32)
-        # do class specific nms here
-        keep = box_utils.nms(cls_dets, cfg.TEST.NMS)
-        cls_dets = cls_dets[keep, :]
-        out = np.zeros((len(keep), 6))
-        out[:, 0:5] = cls_dets
-        out[:, 5].fill(cls)
-        detections.append(out)
-
-    # detections (N, 6) format:
-    #   detections[:, :4] - boxes
-    #   detections[:, 4] - scores
-    #   detections[:, 5] - classes
-    detections = np.vstack(detections)
-    # sort all again
-    inds = np.argsort(-detections[:, 4])
-    detections = detections[inds[0:cfg.TEST.DETECTIONS_PER_IM], :]
-
-    # Convert the detections to image cls_ format (see core/test_engine.py)
-    num_classes = cfg.MODEL.NUM_CLASSES
-    cls_boxes = [[] for _ in range(cfg.MODEL.NUM_CLASSES)]
-    for c in range(1, num_classes):
-        inds = np.where(detections[:, 5] == c)[0]
-        cls_boxes[c] = detections[inds, :5]
-    timers['misc_bbox'].toc()
+        end = num_dets + len(inds)
+        dets[num_dets:end, 0:4] = pred_boxes
+        dets[num_dets:end, 4] = scores
+        det_classes[num_dets:end] = classes + 1
+        num_dets = end
+
+    # Combine predictions across all levels and do class specific nms, for all
+    # classes in a single call
+    order = np.argsort(det_classes[:num_dets], kind='mergesort')
+    dets = dets[order, :]
+    det_classes = det_classes[order]
+    class_offsets = np.searchsorted(det_classes, np.arange(1, num_classes + 1))
+    keep = box_utils.batched_nms(dets, class_offsets, cfg.TEST.NMS)
+    dets = dets[keep, :]
+    det_classes = det_classes[keep]
 
+    # Retain the top scoring detections. The (float64) scores are sorted as
+    # in the per class implementation, such that tied scores keep its order
+    order = np.argsort(-dets[:, 4].astype(np.float64))
+    order = order[:cfg.TEST.DETECTIONS_PER_IM]
+
+    # Convert the detections to image cls_ format (see
+    # utils/detection_results.py), in decreasing score order within each class
+    order = order[np.argsort(det_classes[order], kind='mergesort')]
+    detections = dets[order, :].astype(np.float64)
+    class_offsets = np.searchsorted(
+        det_classes[order], np.arange(1, num_classes + 1)
+    )
+    cls_boxes = [[] for _ in range(num_classes)]
+    for c in range(1, num_classes):
+        cls_boxes[c] = detections[class_offsets[c - 1]:class_offsets[c], :]
     return cls_boxes
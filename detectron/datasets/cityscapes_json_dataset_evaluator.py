@@ -35,8 +35,7 @@ logger = logging.getLogger(__name__)
 
 def evaluate_masks(
     json_dataset,
-    all_boxes,
-    all_segms,
+    detections,
     output_dir,
     use_salt=True,
     cleanup=False
@@ -71,11 +70,12 @@ def evaluate_masks(
         with open(txtname, 'w') as fid_txt:
             if i % 10 == 0:
                 logger.info('i: {}: {}'.format(i, basename))
-            for j in range(1, len(all_segms)):
+            cls_boxes_i, cls_segms_i, _ = detections.get_image_results(i)
+            for j in range(1, detections.num_classes):
                 clss = json_dataset.classes[j]
                 clss_id = cityscapes_eval.name2label[clss].id
-                segms = all_segms[j][i]
-                boxes = all_boxes[j][i]
+                segms = cls_segms_i[j]
+                boxes = cls_boxes_i[j]
                 if segms == []:
                     continue
                 masks = mask_util.decode(segms)
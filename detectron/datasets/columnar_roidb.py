@@ -0,0 +1,525 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Columnar (struct of arrays) storage of a roidb.
+
+A roidb is a list of dicts, one per image, each holding a few small arrays, a
+sparse gt_overlaps matrix and the segms as nested lists. For large datasets
+that amounts to millions of small Python objects. ColumnarRoidb stores the
+same data in a few large arrays instead:
+
+  - per box fields ('boxes', 'gt_classes', ...) are concatenated over all
+    images and indexed by per image box offsets
+  - 'gt_overlaps' is a single sparse matrix with one row per box
+  - 'segms' are flattened into arrays (see roidb_blob.segms_to_arrays)
+  - numeric per image fields ('height', 'flipped', ...) are arrays and other
+    per image fields ('image', ...) are lists
+
+Indexing a ColumnarRoidb returns a RoidbEntry, a lightweight dict-like view of
+one image, so that code written against the list of dicts roidb works
+unmodified. Per box arrays returned by a view are views into the columns.
+
+Horizontally flipped entries are virtual: they refer to the stored entries and
+their boxes, segms and keypoints are flipped on every access and never
+stored, so that the memory held by the roidb does not grow as flipped entries
+are used (also in each of the forked loader processes).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import numbers
+import numpy as np
+import os
+import scipy.sparse
+
+from detectron.utils.io import save_object
+import detectron.utils.keypoints as keypoint_utils
+import detectron.utils.roidb_blob as roidb_blob_utils
+import detectron.utils.segms as segm_utils
+
+# Keys of roidb entries holding one row per box, which are stored as columns
+# when set for all entries
+BOX_KEYS = [
+    'boxes', 'gt_classes', 'seg_areas', 'is_crowd', 'box_to_gt_ind_map',
+    'max_classes', 'max_overlaps', 'gt_keypoints', 'bbox_targets'
+]
+# Keys stored in a dedicated way
+_SPECIAL_KEYS = ['dataset', 'gt_overlaps', 'segms']
+# Names of the segms arrays (see _init_segms)
+_SEGMS_ARRAYS = [
+    'segm_kinds', 'segm_num_parts', 'part_kinds', 'part_lengths',
+    'part_sizes', 'poly_coords', 'rle_counts', 'rle_bytes', 'segm_offsets',
+    'part_offsets', 'kind_offsets'
+]
+
+
+class ColumnarRoidb(object):
+    """Columnar storage of a list of roidb entries."""
+
+    def __init__(self, entries):
+        num_images = len(entries)
+        self._num_images = num_images
+        # Number of stored entries, which are followed by virtual flipped
+        # entries if extend_with_flipped_entries() was called
+        self._num_physical = num_images
+        self._box_offsets = _get_offsets(
+            [len(entry['boxes']) for entry in entries]
+        )
+        # Per image dicts of the fields that are not stored in columns
+        self._overrides = {}
+
+        self._datasets = []
+        self._dataset_inds = None
+        if num_images > 0 and all('dataset' in e for e in entries):
+            dataset_inds = []
+            for entry in entries:
+                dataset = entry['dataset']
+                if not any(dataset is d for d in self._datasets):
+                    self._datasets.append(dataset)
+                dataset_inds.append(
+                    [d is dataset for d in self._datasets].index(True)
+                )
+            self._dataset_inds = np.array(dataset_inds, dtype=np.int32)
+
+        self._gt_overlaps = None
+        if num_images > 0 and all('gt_overlaps' in e for e in entries):
+            self._gt_overlaps = scipy.sparse.vstack(
+                [entry['gt_overlaps'] for entry in entries], format='csr'
+            )
+
+        self._segms = None
+        if num_images > 0 and all('segms' in e for e in entries):
+            self._init_segms([entry['segms'] for entry in entries])
+
+        # Per box columns and, for columns that are not set for all entries,
+        # masks of the entries for which they are set
+        self._box_columns = {}
+        self._box_column_masks = {}
+        for k in BOX_KEYS:
+            values = [entry.get(k) for entry in entries]
+            if num_images > 0 and all(
+                self._is_box_array(i, v, values[0])
+                for i, v in enumerate(values)
+            ):
+                self._box_columns[k] = np.concatenate(values)
+
+        # Per image columns
+        self._image_columns = {}
+        all_keys = set()
+        for entry in entries:
+            all_keys.update(entry.keys())
+        for k in all_keys:
+            if k in _SPECIAL_KEYS and self._has_special(k) \
+                    or k in self._box_columns:
+                continue
+            if all(k in entry for entry in entries) and k not in BOX_KEYS \
+                    and k not in _SPECIAL_KEYS:
+                values = [entry[k] for entry in entries]
+                value_types = set(type(v) for v in values)
+                if len(value_types) == 1 and \
+                        isinstance(values[0], numbers.Number):
+                    self._image_columns[k] = np.array(values)
+                else:
+                    self._image_columns[k] = values
+                continue
+            for i, entry in enumerate(entries):
+                if k in entry:
+                    self._overrides.setdefault(i, {})[k] = entry[k]
+
+    @classmethod
+    def load(cls, directory, get_dataset):
+        """Load a roidb saved by save(). Arrays are memory mapped (copy on
+        write). Datasets are looked up by name through get_dataset.
+        """
+        def load_array(name):
+            return np.load(
+                os.path.join(directory, name + '.npy'), mmap_mode='c'
+            )
+
+        with open(os.path.join(directory, 'objects.pkl'), 'rb') as f:
+            objects = pickle.load(f)
+        roidb = cls([])
+        roidb._num_images = objects['num_images']
+        roidb._num_physical = objects['num_physical']
+        roidb._box_offsets = load_array('box_offsets')
+        roidb._overrides = objects['overrides']
+        roidb._datasets = [get_dataset(name) for name in objects['datasets']]
+        if objects['has_dataset_inds']:
+            roidb._dataset_inds = load_array('dataset_inds')
+        if objects['gt_overlaps_shape'] is not None:
+            roidb._gt_overlaps = scipy.sparse.csr_matrix(
+                (
+                    load_array('gt_overlaps_data'),
+                    load_array('gt_overlaps_indices'),
+                    load_array('gt_overlaps_indptr')
+                ),
+                shape=objects['gt_overlaps_shape']
+            )
+        if objects['has_segms']:
+            arrays = [load_array('segms_' + name) for name in _SEGMS_ARRAYS]
+            roidb._segms = (tuple(arrays[:8]), ) + tuple(arrays[8:])
+        for k in objects['box_columns']:
+            roidb._box_columns[k] = load_array('box_' + k)
+        for k in objects['box_column_masks']:
+            roidb._box_column_masks[k] = load_array('box_mask_' + k)
+        for k in objects['image_array_columns']:
+            roidb._image_columns[k] = load_array('image_' + k)
+        roidb._image_columns.update(objects['image_list_columns'])
+        return roidb
+
+    def save(self, directory):
+        """Save the roidb to a directory holding one .npy file per array and
+        a pickle of everything else. Datasets are saved by name.
+        """
+        def save_array(name, a):
+            np.save(os.path.join(directory, name + '.npy'), a)
+
+        save_array('box_offsets', self._box_offsets)
+        if self._dataset_inds is not None:
+            save_array('dataset_inds', self._dataset_inds)
+        if self._gt_overlaps is not None:
+            save_array('gt_overlaps_data', self._gt_overlaps.data)
+            save_array('gt_overlaps_indices', self._gt_overlaps.indices)
+            save_array('gt_overlaps_indptr', self._gt_overlaps.indptr)
+        if self._segms is not None:
+            arrays = list(self._segms[0]) + list(self._segms[1:])
+            for name, a in zip(_SEGMS_ARRAYS, arrays):
+                save_array('segms_' + name, a)
+        for k, v in self._box_columns.items():
+            save_array('box_' + k, v)
+        for k, v in self._box_column_masks.items():
+            save_array('box_mask_' + k, v)
+        image_array_columns = []
+        image_list_columns = {}
+        for k, v in self._image_columns.items():
+            if isinstance(v, np.ndarray):
+                save_array('image_' + k, v)
+                image_array_columns.append(k)
+            else:
+                image_list_columns[k] = v
+        objects = {
+            'num_images': self._num_images,
+            'num_physical': self._num_physical,
+            'overrides': self._overrides,
+            'datasets': [dataset.name for dataset in self._datasets],
+            'has_dataset_inds': self._dataset_inds is not None,
+            'gt_overlaps_shape':
+                self._gt_overlaps.shape
+                if self._gt_overlaps is not None else None,
+            'has_segms': self._segms is not None,
+            'box_columns': list(self._box_columns.keys()),
+            'box_column_masks': list(self._box_column_masks.keys()),
+            'image_array_columns': image_array_columns,
+            'image_list_columns': image_list_columns,
+        }
+        save_object(objects, os.path.join(directory, 'objects.pkl'))
+
+    def __len__(self):
+        return self._num_images
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [RoidbEntry(self, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += self._num_images
+        if i < 0 or i >= self._num_images:
+            raise IndexError('roidb index out of range')
+        return RoidbEntry(self, i)
+
+    def __iter__(self):
+        for i in range(self._num_images):
+            yield RoidbEntry(self, i)
+
+    def extend_with_flipped_entries(self):
+        """Append a horizontally flipped copy of each entry. Flipped entries
+        are virtual: they refer to the stored entries, whose boxes, segms and
+        keypoints are flipped when accessed through a flipped entry.
+        """
+        assert self._num_images == self._num_physical, \
+            'Flipped entries have already been added'
+        self._num_images = 2 * self._num_physical
+        # Per entry columns have rows for the flipped entries too
+        for k, mask in self._box_column_masks.items():
+            column = self._box_columns[k]
+            self._box_columns[k] = np.concatenate(
+                [column, np.zeros(column.shape, dtype=column.dtype)]
+            )
+            self._box_column_masks[k] = np.concatenate(
+                [mask, np.zeros(mask.shape, dtype=mask.dtype)]
+            )
+
+    def num_boxes(self, i):
+        """Return the number of boxes of the i-th entry."""
+        i = self._get_physical_index(i)
+        return int(self._box_offsets[i + 1] - self._box_offsets[i])
+
+    def get_field(self, i, k):
+        """Return field k of the i-th entry. Raise KeyError if not set."""
+        overrides = self._overrides.get(i)
+        if overrides is not None and k in overrides:
+            return overrides[k]
+        mask = self._box_column_masks.get(k)
+        if mask is not None:
+            if mask[i]:
+                return self._box_columns[k][self._get_box_slice(i)]
+            raise KeyError(k)
+        if i >= self._num_physical:
+            return self._get_flipped_field(i - self._num_physical, k)
+        column = self._box_columns.get(k)
+        if column is not None:
+            return column[self._get_box_slice(i)]
+        column = self._image_columns.get(k)
+        if column is not None:
+            value = column[i]
+            return value.item() if isinstance(column, np.ndarray) else value
+        if k == 'dataset' and self._dataset_inds is not None:
+            return self._datasets[self._dataset_inds[i]]
+        if k == 'gt_overlaps' and self._gt_overlaps is not None:
+            return self._gt_overlaps[self._get_box_slice(i)]
+        if k == 'segms' and self._segms is not None:
+            return self._get_segms(i)
+        raise KeyError(k)
+
+    def set_field(self, i, k, value):
+        """Set field k of the i-th entry. Per box arrays are written into
+        their column (which is created if needed); all other values are kept
+        per entry. Columns of the stored entries are not written through
+        flipped entries.
+        """
+        overrides = self._overrides.get(i)
+        if k in BOX_KEYS and self._is_box_array(
+            i, value, self._box_columns.get(k)
+        ):
+            if k not in self._box_columns:
+                self._add_entry_box_column(k, value)
+            mask = self._box_column_masks.get(k)
+            if mask is not None or i < self._num_physical:
+                self._box_columns[k][self._get_box_slice(i)] = value
+                if mask is not None:
+                    mask[i] = True
+                if overrides is not None:
+                    overrides.pop(k, None)
+                return
+        if k in self._image_columns and i < self._num_physical and \
+                not isinstance(self._image_columns[k], np.ndarray):
+            self._image_columns[k][i] = value
+            return
+        self._overrides.setdefault(i, {})[k] = value
+
+    def has_field(self, i, k):
+        """Whether field k of the i-th entry is set (same as k in
+        get_keys(i), without listing the keys)."""
+        overrides = self._overrides.get(i)
+        if overrides is not None and k in overrides:
+            return True
+        mask = self._box_column_masks.get(k)
+        if mask is not None:
+            return bool(mask[i])
+        if k in self._box_columns or k in self._image_columns:
+            return True
+        if k in _SPECIAL_KEYS and self._has_special(k):
+            return True
+        # Flipped entries also have the fields of their stored entry
+        if i >= self._num_physical:
+            overrides = self._overrides.get(i - self._num_physical)
+            return overrides is not None and k in overrides
+        return False
+
+    def get_keys(self, i):
+        """Return the keys of the fields of the i-th entry."""
+        keys = [
+            k for k in self._box_columns
+            if k not in self._box_column_masks or self._box_column_masks[k][i]
+        ]
+        keys += list(self._image_columns.keys())
+        keys += [k for k in _SPECIAL_KEYS if self._has_special(k)]
+        # Flipped entries also have the fields of their stored entry
+        for j in set([self._get_physical_index(i), i]):
+            overrides = self._overrides.get(j)
+            if overrides is not None:
+                keys += [
+                    k for k in overrides if k not in keys and
+                    (j == i or k not in self._box_column_masks)
+                ]
+        return keys
+
+    def _get_physical_index(self, i):
+        """Return the index of the stored entry of the i-th entry."""
+        return i if i < self._num_physical else i - self._num_physical
+
+    def _get_box_slice(self, i):
+        """Return the slice of the i-th entry in the per box columns. Flipped
+        entries only have rows in the columns with masks."""
+        start = 0
+        if i >= self._num_physical:
+            i -= self._num_physical
+            start = self._box_offsets[-1]
+        return slice(
+            start + self._box_offsets[i], start + self._box_offsets[i + 1]
+        )
+
+    def _add_entry_box_column(self, k, like):
+        """Add a per box column (with a mask) for field k, which has rows for
+        all (including flipped) entries."""
+        num_copies = self._num_images // max(self._num_physical, 1)
+        self._box_columns[k] = np.zeros(
+            (num_copies * self._box_offsets[-1], ) + like.shape[1:],
+            dtype=like.dtype
+        )
+        self._box_column_masks[k] = np.zeros(
+            self._num_images, dtype=np.bool_
+        )
+
+    def _get_flipped_field(self, i, k):
+        """Return field k of the i-th stored entry flipped horizontally."""
+        value = self.get_field(i, k)
+        if k == 'flipped':
+            return not value
+        if k == 'boxes':
+            width = self.get_field(i, 'width')
+            boxes = value.copy()
+            boxes[:, 0] = width - value[:, 2] - 1
+            boxes[:, 2] = width - value[:, 0] - 1
+            return boxes
+        if k == 'segms':
+            return segm_utils.flip_segms(
+                value, self.get_field(i, 'height'), self.get_field(i, 'width')
+            )
+        if k == 'gt_keypoints':
+            dataset = self.get_field(i, 'dataset')
+            return keypoint_utils.flip_keypoints(
+                dataset.keypoints, dataset.keypoint_flip_map, value,
+                self.get_field(i, 'width')
+            )
+        if k == 'bbox_targets':
+            # Flipping negates the x offset (the class stays the same)
+            bbox_targets = value.copy()
+            bbox_targets[:, 1] *= -1
+            return bbox_targets
+        return value
+
+    def _is_box_array(self, i, value, like):
+        """Whether value can be stored in a per box column shaped like the
+        array like (if not None) for the i-th entry."""
+        if not isinstance(value, np.ndarray) or value.ndim == 0 or \
+                len(value) != self.num_boxes(i):
+            return False
+        return like is None or (
+            value.dtype == like.dtype and value.shape[1:] == like.shape[1:]
+        )
+
+    def _has_special(self, k):
+        if k == 'dataset':
+            return self._dataset_inds is not None
+        if k == 'gt_overlaps':
+            return self._gt_overlaps is not None
+        return self._segms is not None
+
+    def _init_segms(self, segms_list):
+        segms = []
+        for entry_segms in segms_list:
+            segms += entry_segms
+        arrays = roidb_blob_utils.segms_to_arrays(segms)
+        segm_num_parts, part_kinds, part_lengths = arrays[1:4]
+        # Offsets of the first segm of each entry and of the first part of
+        # each segm
+        segm_offsets = _get_offsets([len(s) for s in segms_list])
+        part_offsets = _get_offsets(segm_num_parts)
+        # Offsets of the data of the first part of each kind at each part
+        kind_lengths = np.zeros((len(part_kinds), 3), dtype=np.int64)
+        kind_lengths[np.arange(len(part_kinds)), part_kinds] = part_lengths
+        kind_offsets = np.zeros((len(part_kinds) + 1, 3), dtype=np.int64)
+        np.cumsum(kind_lengths, axis=0, out=kind_offsets[1:])
+        self._segms = (arrays, segm_offsets, part_offsets, kind_offsets)
+
+    def _get_segms(self, i):
+        (
+            (
+                segm_kinds, segm_num_parts, part_kinds, part_lengths,
+                part_sizes, poly_coords, rle_counts, rle_bytes
+            ), segm_offsets, part_offsets, kind_offsets
+        ) = self._segms
+        s0, s1 = segm_offsets[i], segm_offsets[i + 1]
+        p0, p1 = part_offsets[s0], part_offsets[s1]
+        return roidb_blob_utils.arrays_to_segms(
+            segm_kinds[s0:s1], segm_num_parts[s0:s1], part_kinds[p0:p1],
+            part_lengths[p0:p1], part_sizes[p0:p1], poly_coords, rle_counts,
+            rle_bytes, offsets=kind_offsets[p0]
+        )
+
+
+class RoidbEntry(object):
+    """Dict-like view of one entry of a ColumnarRoidb."""
+
+    __slots__ = ('_roidb', '_index')
+
+    def __init__(self, roidb, index):
+        self._roidb = roidb
+        self._index = index
+
+    @property
+    def roidb(self):
+        """The ColumnarRoidb holding the entry."""
+        return self._roidb
+
+    @property
+    def index(self):
+        """The index of the entry in its ColumnarRoidb."""
+        return self._index
+
+    def __reduce__(self):
+        # An entry is pickled as a dict of its own fields, rather than along
+        # with the whole ColumnarRoidb
+        return (dict, (dict(self.items()), ))
+
+    def __getitem__(self, k):
+        return self._roidb.get_field(self._index, k)
+
+    def __setitem__(self, k, value):
+        self._roidb.set_field(self._index, k, value)
+
+    def __contains__(self, k):
+        return self._roidb.has_field(self._index, k)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._roidb.get_keys(self._index)
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+
+def _get_offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
@@ -42,11 +42,21 @@ from pycocotools.coco import COCO
 from detectron.core.config import cfg
 from detectron.utils.timer import Timer
 import detectron.datasets.dataset_catalog as dataset_catalog
+import detectron.datasets.proposal_store as proposal_store
+import detectron.datasets.roidb_cache as roidb_cache
 import detectron.utils.boxes as box_utils
 import detectron.utils.segms as segm_utils
 
 logger = logging.getLogger(__name__)
 
+# Attributes of JsonDataset that are derived from the annotations and cached
+# along with the roidb
+_METADATA_KEYS = [
+    'category_to_id_map', 'classes', 'num_classes', 'num_images',
+    'json_category_id_to_contiguous_id', 'contiguous_category_id_to_json_id',
+    'keypoints', 'keypoint_flip_map', 'keypoints_to_id_map', 'num_keypoints'
+]
+
 
 class JsonDataset(object):
     """A class representing a COCO json dataset."""
@@ -62,14 +72,30 @@ class JsonDataset(object):
         self.name = name
         self.image_directory = dataset_catalog.get_im_dir(name)
         self.image_prefix = dataset_catalog.get_im_prefix(name)
-        self.COCO = COCO(dataset_catalog.get_ann_fn(name))
+        self._COCO = None
         self.debug_timer = Timer()
+        # Load the dataset metadata from the roidb cache if possible, which
+        # avoids parsing the annotations
+        cache_path = roidb_cache.get_cache_path(
+            'dataset', [
+                name,
+                roidb_cache.get_file_signature(
+                    dataset_catalog.get_ann_fn(name)
+                )
+            ]
+        )
+        metadata = roidb_cache.load_object(cache_path)
+        if metadata is not None:
+            for k, v in metadata.items():
+                setattr(self, k, v)
+            return
         # Set up dataset classes
         category_ids = self.COCO.getCatIds()
         categories = [c['name'] for c in self.COCO.loadCats(category_ids)]
         self.category_to_id_map = dict(zip(categories, category_ids))
         self.classes = ['__background__'] + categories
         self.num_classes = len(self.classes)
+        self.num_images = len(self.COCO.getImgIds())
         self.json_category_id_to_contiguous_id = {
             v: i + 1
             for i, v in enumerate(self.COCO.getCatIds())
@@ -79,6 +105,17 @@ class JsonDataset(object):
             for k, v in self.json_category_id_to_contiguous_id.items()
         }
         self._init_keypoints()
+        roidb_cache.save_object_to_cache(
+            cache_path, {k: getattr(self, k) for k in _METADATA_KEYS}
+        )
+
+    @property
+    def COCO(self):
+        """COCO API object of the dataset, which is only created when first
+        used since parsing the annotations is slow."""
+        if self._COCO is None:
+            self._COCO = COCO(dataset_catalog.get_ann_fn(self.name))
+        return self._COCO
 
     def get_roidb(
         self,
@@ -86,19 +123,47 @@ class JsonDataset(object):
         proposal_file=None,
         min_proposal_size=2,
         proposal_limit=-1,
-        crowd_filter_thresh=0
+        crowd_filter_thresh=0,
+        ind_range=None
     ):
         """Return an roidb corresponding to the json dataset. Optionally:
            - include ground truth boxes in the roidb
            - add proposals specified in a proposals file
            - filter proposals based on a minimum side length
            - filter proposals that intersect with crowd regions
+           - restrict the roidb to a range of image indices given as a pair
+             (start, end), in which case only the required proposals are read
+        The roidb is loaded from the roidb cache (cfg.ROIDB_CACHE_DIR) if
+        possible, in which case its entries are (dict-like) RoidbEntry views.
         """
         assert gt is True or crowd_filter_thresh == 0, \
             'Crowd filter threshold must be 0 if ground-truth annotations ' \
             'are not included.'
+        cache_path = roidb_cache.get_cache_path(
+            'roidb', [
+                self.name,
+                roidb_cache.get_file_signature(
+                    dataset_catalog.get_ann_fn(self.name)
+                ),
+                self.image_directory,
+                self.image_prefix,
+                gt,
+                roidb_cache.get_file_signature(proposal_file),
+                min_proposal_size,
+                proposal_limit,
+                crowd_filter_thresh,
+                cfg.TRAIN.GT_MIN_AREA if gt else None,
+                list(ind_range) if ind_range is not None else None,
+            ]
+        )
+        roidb = roidb_cache.load_roidb(cache_path, lambda name: self)
+        if roidb is not None:
+            return roidb
         image_ids = self.COCO.getImgIds()
         image_ids.sort()
+        if ind_range is not None:
+            start, end = ind_range
+            image_ids = image_ids[start:end]
         roidb = copy.deepcopy(self.COCO.loadImgs(image_ids))
         for entry in roidb:
             self._prep_roidb_entry(entry)
@@ -123,6 +188,7 @@ class JsonDataset(object):
                 format(self.debug_timer.toc(average=False))
             )
         _add_class_assignments(roidb)
+        roidb_cache.save_roidb(cache_path, roidb)
         return roidb
 
     def _prep_roidb_entry(self, entry):
@@ -249,19 +315,45 @@ class JsonDataset(object):
     def _add_proposals_from_file(
         self, roidb, proposal_file, min_proposal_size, top_k, crowd_thresh
     ):
-        """Add proposals from a proposals file to an roidb."""
+        """Add proposals from a proposals file (or a proposal store, see
+        proposal_store.py) to an roidb."""
         logger.info('Loading proposals from: {}'.format(proposal_file))
-        with open(proposal_file, 'r') as f:
-            proposals = pickle.load(f)
-        id_field = 'indexes' if 'indexes' in proposals else 'ids'  # compat fix
-        _sort_proposals(proposals, id_field)
+        if proposal_store.is_proposal_store(proposal_file):
+            # Only the proposals of the images in the roidb are read (and
+            # copied, since the boxes are clipped in place below)
+            store = proposal_store.ProposalStore(proposal_file)
+            proposal_boxes = [
+                np.array(store.get(entry['id'])[0]) for entry in roidb
+            ]
+        else:
+            with open(proposal_file, 'r') as f:
+                proposals = pickle.load(f)
+            # compat fix
+            id_field = 'indexes' if 'indexes' in proposals else 'ids'
+            _sort_proposals(proposals, id_field)
+            proposal_boxes = proposals['boxes']
+            if len(roidb) < len(proposal_boxes):
+                # The roidb is restricted to a range of images
+                ids = np.array(proposals[id_field])
+                roidb_ids = np.array([entry['id'] for entry in roidb])
+                inds = np.searchsorted(ids, roidb_ids)
+                found = inds < len(ids)
+                found[found] = ids[inds[found]] == roidb_ids[found]
+                assert np.all(found), \
+                    'No proposals for image id {} in {}'.format(
+                        roidb_ids[~found][0], proposal_file
+                    )
+                proposal_boxes = [proposal_boxes[i] for i in inds]
+            else:
+                inds = np.arange(len(roidb))
+            for entry, i in zip(roidb, inds):
+                # Sanity check that these boxes are for the correct image id
+                assert entry['id'] == proposals[id_field][i]
         box_list = []
         for i, entry in enumerate(roidb):
             if i % 2500 == 0:
                 logger.info(' {:d}/{:d}'.format(i + 1, len(roidb)))
-            boxes = proposals['boxes'][i]
-            # Sanity check that these boxes are for the correct image id
-            assert entry['id'] == proposals[id_field][i]
+            boxes = proposal_boxes[i]
             # Remove duplicate boxes and very small boxes and then take top k
             boxes = box_utils.clip_boxes_to_image(
                 boxes, entry['height'], entry['width']
@@ -37,8 +37,7 @@ logger = logging.getLogger(__name__)
 
 def evaluate_masks(
     json_dataset,
-    all_boxes,
-    all_segms,
+    detections,
     output_dir,
     use_salt=True,
     cleanup=False
@@ -49,8 +48,7 @@ def evaluate_masks(
     if use_salt:
         res_file += '_{}'.format(str(uuid.uuid4()))
     res_file += '.json'
-    _write_coco_segms_results_file(
-        json_dataset, all_boxes, all_segms, res_file)
+    _write_coco_segms_results_file(json_dataset, detections, res_file)
     # Only do evaluation on non-test sets (annotations are undisclosed on test)
     if json_dataset.name.find('test') == -1:
         coco_eval = _do_segmentation_eval(json_dataset, res_file, output_dir)
@@ -66,9 +64,7 @@ def evaluate_masks(
     return coco_eval
 
 
-def _write_coco_segms_results_file(
-    json_dataset, all_boxes, all_segms, res_file
-):
+def _write_coco_segms_results_file(json_dataset, detections, res_file):
     # [{"image_id": 42,
     #   "category_id": 18,
     #   "segmentation": [...],
@@ -77,11 +73,11 @@ def _write_coco_segms_results_file(
     for cls_ind, cls in enumerate(json_dataset.classes):
         if cls == '__background__':
             continue
-        if cls_ind >= len(all_boxes):
+        if cls_ind >= detections.num_classes:
             break
         cat_id = json_dataset.category_to_id_map[cls]
         results.extend(_coco_segms_results_one_category(
-            json_dataset, all_boxes[cls_ind], all_segms[cls_ind], cat_id))
+            json_dataset, detections, cls_ind, cat_id))
     logger.info(
         'Writing segmentation results json to: {}'.format(
             os.path.abspath(res_file)))
@@ -89,30 +85,21 @@ def _write_coco_segms_results_file(
         json.dump(results, fid)
 
 
-def _coco_segms_results_one_category(json_dataset, boxes, segms, cat_id):
-    results = []
+def _coco_segms_results_one_category(json_dataset, detections, cls_ind, cat_id):
     image_ids = json_dataset.COCO.getImgIds()
     image_ids.sort()
-    assert len(boxes) == len(image_ids)
-    assert len(segms) == len(image_ids)
-    for i, image_id in enumerate(image_ids):
-        dets = boxes[i]
-        rles = segms[i]
-
-        if isinstance(dets, list) and len(dets) == 0:
-            continue
-
-        dets = dets.astype(np.float)
-        scores = dets[:, -1]
-
-        results.extend(
-            [{'image_id': image_id,
-              'category_id': cat_id,
-              'segmentation': rles[k],
-              'score': scores[k]}
-              for k in range(dets.shape[0])])
-
-    return results
+    assert detections.num_images == len(image_ids)
+    # The detections of the class, in image order
+    rows = detections.get_class_rows(cls_ind)
+    image_ids = np.array(image_ids)[detections.det_image_inds[rows]]
+    scores = detections.dets[rows, -1].astype(np.float)
+    rles = detections.get_segms(rows)
+    return [{'image_id': image_id,
+             'category_id': cat_id,
+             'segmentation': rle,
+             'score': score}
+            for image_id, rle, score in zip(
+                image_ids.tolist(), rles, scores.tolist())]
 
 
 def _do_segmentation_eval(json_dataset, res_file, output_dir):
@@ -128,7 +115,7 @@ def _do_segmentation_eval(json_dataset, res_file, output_dir):
 
 
 def evaluate_boxes(
-    json_dataset, all_boxes, output_dir, use_salt=True, cleanup=False
+    json_dataset, detections, output_dir, use_salt=True, cleanup=False
 ):
     res_file = os.path.join(
         output_dir, 'bbox_' + json_dataset.name + '_results'
@@ -136,7 +123,7 @@ def evaluate_boxes(
     if use_salt:
         res_file += '_{}'.format(str(uuid.uuid4()))
     res_file += '.json'
-    _write_coco_bbox_results_file(json_dataset, all_boxes, res_file)
+    _write_coco_bbox_results_file(json_dataset, detections, res_file)
     # Only do evaluation on non-test sets (annotations are undisclosed on test)
     if json_dataset.name.find('test') == -1:
         coco_eval = _do_detection_eval(json_dataset, res_file, output_dir)
@@ -152,7 +139,7 @@ def evaluate_boxes(
     return coco_eval
 
 
-def _write_coco_bbox_results_file(json_dataset, all_boxes, res_file):
+def _write_coco_bbox_results_file(json_dataset, detections, res_file):
     # [{"image_id": 42,
     #   "category_id": 18,
     #   "bbox": [258.15,41.29,348.26,243.78],
@@ -161,39 +148,33 @@ def _write_coco_bbox_results_file(json_dataset, all_boxes, res_file):
     for cls_ind, cls in enumerate(json_dataset.classes):
         if cls == '__background__':
             continue
-        if cls_ind >= len(all_boxes):
+        if cls_ind >= detections.num_classes:
             break
         cat_id = json_dataset.category_to_id_map[cls]
         results.extend(_coco_bbox_results_one_category(
-            json_dataset, all_boxes[cls_ind], cat_id))
+            json_dataset, detections, cls_ind, cat_id))
     logger.info(
         'Writing bbox results json to: {}'.format(os.path.abspath(res_file)))
     with open(res_file, 'w') as fid:
         json.dump(results, fid)
 
 
-def _coco_bbox_results_one_category(json_dataset, boxes, cat_id):
-    results = []
+def _coco_bbox_results_one_category(json_dataset, detections, cls_ind, cat_id):
     image_ids = json_dataset.COCO.getImgIds()
     image_ids.sort()
-    assert len(boxes) == len(image_ids)
-    for i, image_id in enumerate(image_ids):
-        dets = boxes[i]
-        if isinstance(dets, list) and len(dets) == 0:
-            continue
-        dets = dets.astype(np.float)
-        scores = dets[:, -1]
-        xywh_dets = box_utils.xyxy_to_xywh(dets[:, 0:4])
-        xs = xywh_dets[:, 0]
-        ys = xywh_dets[:, 1]
-        ws = xywh_dets[:, 2]
-        hs = xywh_dets[:, 3]
-        results.extend(
-            [{'image_id': image_id,
-              'category_id': cat_id,
-              'bbox': [xs[k], ys[k], ws[k], hs[k]],
-              'score': scores[k]} for k in range(dets.shape[0])])
-    return results
+    assert detections.num_images == len(image_ids)
+    # The detections of the class, in image order
+    rows = detections.get_class_rows(cls_ind)
+    image_ids = np.array(image_ids)[detections.det_image_inds[rows]]
+    dets = detections.dets[rows].astype(np.float)
+    scores = dets[:, -1]
+    xywh_dets = box_utils.xyxy_to_xywh(dets[:, 0:4])
+    return [{'image_id': image_id,
+             'category_id': cat_id,
+             'bbox': bbox,
+             'score': score}
+            for image_id, bbox, score in zip(
+                image_ids.tolist(), xywh_dets.tolist(), scores.tolist())]
 
 
 def _do_detection_eval(json_dataset, res_file, output_dir):
@@ -418,8 +399,7 @@ def evaluate_box_proposals(
 
 def evaluate_keypoints(
     json_dataset,
-    all_boxes,
-    all_keypoints,
+    detections,
     output_dir,
     use_salt=True,
     cleanup=False
@@ -430,8 +410,7 @@ def evaluate_keypoints(
     if use_salt:
         res_file += '_{}'.format(str(uuid.uuid4()))
     res_file += '.json'
-    _write_coco_keypoint_results_file(
-        json_dataset, all_boxes, all_keypoints, res_file)
+    _write_coco_keypoint_results_file(json_dataset, detections, res_file)
     # Only do evaluation on non-test sets (annotations are undisclosed on test)
     if json_dataset.name.find('test') == -1:
         coco_eval = _do_keypoint_eval(json_dataset, res_file, output_dir)
@@ -447,21 +426,19 @@ def evaluate_keypoints(
     return coco_eval
 
 
-def _write_coco_keypoint_results_file(
-    json_dataset, all_boxes, all_keypoints, res_file
-):
+def _write_coco_keypoint_results_file(json_dataset, detections, res_file):
     results = []
     for cls_ind, cls in enumerate(json_dataset.classes):
         if cls == '__background__':
             continue
-        if cls_ind >= len(all_keypoints):
+        if cls_ind >= detections.num_classes:
             break
         logger.info(
             'Collecting {} results ({:d}/{:d})'.format(
-                cls, cls_ind, len(all_keypoints) - 1))
+                cls, cls_ind, detections.num_classes - 1))
         cat_id = json_dataset.category_to_id_map[cls]
         results.extend(_coco_kp_results_one_category(
-            json_dataset, all_boxes[cls_ind], all_keypoints[cls_ind], cat_id))
+            json_dataset, detections, cls_ind, cat_id))
     logger.info(
         'Writing keypoint results json to: {}'.format(
             os.path.abspath(res_file)))
@@ -469,12 +446,11 @@ def _write_coco_keypoint_results_file(
         json.dump(results, fid)
 
 
-def _coco_kp_results_one_category(json_dataset, boxes, kps, cat_id):
+def _coco_kp_results_one_category(json_dataset, detections, cls_ind, cat_id):
     results = []
     image_ids = json_dataset.COCO.getImgIds()
     image_ids.sort()
-    assert len(kps) == len(image_ids)
-    assert len(boxes) == len(image_ids)
+    assert detections.num_images == len(image_ids)
     use_box_score = False
     if cfg.KRCNN.KEYPOINT_CONFIDENCE == 'logit':
         # This is ugly; see utils.keypoints.heatmap_to_keypoints for the magic
@@ -487,11 +463,15 @@ def _coco_kp_results_one_category(json_dataset, boxes, kps, cat_id):
     else:
         raise ValueError(
             'KRCNN.KEYPOINT_CONFIDENCE must be "logit", "prob", or "bbox"')
+    if not detections.has_keyps:
+        return results
+    offsets = detections.get_class_image_offsets(cls_ind)
     for i, image_id in enumerate(image_ids):
-        if len(boxes[i]) == 0:
+        if offsets[i] == offsets[i + 1]:
             continue
-        kps_dets = kps[i]
-        scores = boxes[i][:, -1].astype(np.float)
+        rows = slice(offsets[i], offsets[i + 1])
+        kps_dets = detections.get_keyps(rows)
+        scores = detections.dets[rows, -1].astype(np.float)
         if len(kps_dets) == 0:
             continue
         for j in range(len(kps_dets)):
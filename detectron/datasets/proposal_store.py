@@ -0,0 +1,109 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Indexed, memory mapped storage of precomputed proposals.
+
+A proposal store is a directory that can be used as a proposal file (e.g., in
+TRAIN.PROPOSAL_FILES and TEST.PROPOSAL_FILES). It holds the proposals of all
+images as flat arrays, sorted by image id:
+
+  boxes.npy:   (num_proposals, 4) boxes of all images
+  scores.npy:  (num_proposals, ...) scores of all images
+  ids.npy:     (num_images, ) sorted image ids
+  offsets.npy: (num_images + 1, ) offsets of the proposals of each image
+
+The arrays are memory mapped, so reading the proposals of some of the images
+only reads those rows from disk. Proposal files in the pickle format (a dict
+with 'boxes', 'scores' and 'ids' (or 'indexes') lists) are converted with
+convert_proposal_file() (see tools/build_proposal_store.py).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import numpy as np
+import os
+import shutil
+import uuid
+
+_ARRAYS = ['boxes', 'scores', 'ids', 'offsets']
+
+
+def is_proposal_store(proposal_file):
+    """Whether proposal_file is a proposal store (rather than a pickle)."""
+    return os.path.isdir(proposal_file) and \
+        os.path.exists(os.path.join(proposal_file, 'offsets.npy'))
+
+
+class ProposalStore(object):
+    """Read access to a proposal store."""
+
+    def __init__(self, store_dir):
+        assert is_proposal_store(store_dir), \
+            'Proposal store \'{}\' not found'.format(store_dir)
+        for k in _ARRAYS:
+            setattr(
+                self, '_' + k,
+                np.load(os.path.join(store_dir, k + '.npy'), mmap_mode='r')
+            )
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, image_id):
+        """Return the (boxes, scores) of an image. The arrays are read-only
+        views of the store."""
+        i = np.searchsorted(self._ids, image_id)
+        assert i < len(self._ids) and self._ids[i] == image_id, \
+            'No proposals for image id {}'.format(image_id)
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._boxes[start:end], self._scores[start:end]
+
+
+def convert_proposal_file(proposal_file, store_dir):
+    """Convert a proposal file in the pickle format to a proposal store."""
+    with open(proposal_file, 'rb') as f:
+        proposals = pickle.load(f)
+    id_field = 'indexes' if 'indexes' in proposals else 'ids'  # compat fix
+    ids = np.array(proposals[id_field], dtype=np.int64)
+    order = np.argsort(ids, kind='mergesort')
+    assert len(np.unique(ids)) == len(ids), 'Duplicate image ids'
+    boxes = [proposals['boxes'][i] for i in order]
+    scores = [proposals['scores'][i] for i in order]
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in boxes], out=offsets[1:])
+    arrays = {
+        'boxes': np.concatenate(boxes).reshape((-1, 4)),
+        'scores': np.concatenate(scores),
+        'ids': ids[order],
+        'offsets': offsets,
+    }
+    assert len(arrays['scores']) == offsets[-1], \
+        'Number of scores does not match the number of boxes'
+
+    # Write to a temporary directory first, such that readers never see a
+    # partially written store
+    tmp_dir = '{}.{}.tmp'.format(store_dir.rstrip('/'), uuid.uuid4().hex)
+    os.makedirs(tmp_dir)
+    try:
+        for k in _ARRAYS:
+            np.save(os.path.join(tmp_dir, k + '.npy'), arrays[k])
+        os.rename(tmp_dir, store_dir)
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
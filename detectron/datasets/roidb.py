@@ -25,7 +25,10 @@ import logging
 import numpy as np
 
 from detectron.core.config import cfg
+from detectron.datasets.columnar_roidb import ColumnarRoidb
 from detectron.datasets.json_dataset import JsonDataset
+import detectron.datasets.dataset_catalog as dataset_catalog
+import detectron.datasets.roidb_cache as roidb_cache
 import detectron.utils.boxes as box_utils
 import detectron.utils.keypoints as keypoint_utils
 import detectron.utils.segms as segm_utils
@@ -37,6 +40,10 @@ def combined_roidb_for_training(dataset_names, proposal_files):
     """Load and concatenate roidbs for one or more datasets, along with optional
     object proposals. The roidb entries are then prepared for use in training,
     which involves caching certain types of metadata for each roidb entry.
+
+    The entries are stored in a ColumnarRoidb; the returned roidb is a list of
+    (dict-like) views of them. The roidb is loaded from the roidb cache
+    (cfg.ROIDB_CACHE_DIR) if possible.
     """
     def get_roidb(dataset_name, proposal_file):
         ds = JsonDataset(dataset_name)
@@ -45,9 +52,6 @@ def combined_roidb_for_training(dataset_names, proposal_files):
             proposal_file=proposal_file,
             crowd_filter_thresh=cfg.TRAIN.CROWD_FILTER_THRESH
         )
-        if cfg.TRAIN.USE_FLIPPED:
-            logger.info('Appending horizontally-flipped training examples...')
-            extend_with_flipped_entries(roidb, ds)
         logger.info('Loaded dataset: {:s}'.format(ds.name))
         return roidb
 
@@ -58,27 +62,69 @@ def combined_roidb_for_training(dataset_names, proposal_files):
     if len(proposal_files) == 0:
         proposal_files = (None, ) * len(dataset_names)
     assert len(dataset_names) == len(proposal_files)
+    cache_path = roidb_cache.get_cache_path(
+        'training_roidb', _get_training_roidb_cache_key(
+            dataset_names, proposal_files
+        )
+    )
+    roidb = roidb_cache.load_roidb(cache_path, JsonDataset)
+    if roidb is not None:
+        _compute_and_log_stats(roidb)
+        return roidb
     roidbs = [get_roidb(*args) for args in zip(dataset_names, proposal_files)]
     roidb = roidbs[0]
     for r in roidbs[1:]:
         roidb.extend(r)
+    roidb = ColumnarRoidb(roidb)
+    if cfg.TRAIN.USE_FLIPPED:
+        logger.info('Appending horizontally-flipped training examples...')
+        roidb.extend_with_flipped_entries()
     roidb = filter_for_training(roidb)
 
     logger.info('Computing bounding-box regression targets...')
     add_bbox_regression_targets(roidb)
     logger.info('done')
 
+    roidb_cache.save_roidb(cache_path, roidb)
     _compute_and_log_stats(roidb)
 
     return roidb
 
 
+def _get_training_roidb_cache_key(dataset_names, proposal_files):
+    """Return the key of the training roidb in the roidb cache, which covers
+    the input files and all config options used to prepare the roidb."""
+    return [
+        [
+            name,
+            roidb_cache.get_file_signature(dataset_catalog.get_ann_fn(name)),
+            dataset_catalog.get_im_dir(name),
+            dataset_catalog.get_im_prefix(name),
+            roidb_cache.get_file_signature(proposal_file),
+        ] for name, proposal_file in zip(dataset_names, proposal_files)
+    ] + [
+        cfg.TRAIN.USE_FLIPPED,
+        cfg.TRAIN.CROWD_FILTER_THRESH,
+        cfg.TRAIN.GT_MIN_AREA,
+        cfg.TRAIN.FG_THRESH,
+        cfg.TRAIN.BG_THRESH_HI,
+        cfg.TRAIN.BG_THRESH_LO,
+        cfg.TRAIN.BBOX_THRESH,
+        cfg.MODEL.KEYPOINTS_ON,
+        cfg.MODEL.CLS_AGNOSTIC_BBOX_REG,
+        list(cfg.MODEL.BBOX_REG_WEIGHTS),
+    ]
+
+
 def extend_with_flipped_entries(roidb, dataset):
     """Flip each entry in the given roidb and return a new roidb that is the
     concatenation of the original roidb and the flipped entries.
 
     "Flipping" an entry means that that image and associated metadata (e.g.,
     ground truth boxes and object proposals) are horizontally flipped.
+
+    The flipped entries are materialized; see
+    ColumnarRoidb.extend_with_flipped_entries() for virtual flipped entries.
     """
     flipped_roidb = []
     for entry in roidb:
@@ -0,0 +1,145 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""On-disk cache of prepared roidbs (see cfg.ROIDB_CACHE_DIR).
+
+A cached roidb is a directory holding a saved ColumnarRoidb and the indices of
+the roidb entries in it. Cache entries are named after a hash of a key that
+describes everything the roidb depends on: the input files (see
+get_file_signature) and the relevant config options.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import uuid
+
+from detectron.core.config import cfg
+from detectron.datasets.columnar_roidb import ColumnarRoidb
+from detectron.utils.io import save_object
+
+logger = logging.getLogger(__name__)
+
+# Increment when the format of the cached data changes
+_VERSION = 3
+
+
+def get_cache_path(kind, key):
+    """Return the path of the cache entry of the given kind (e.g., 'roidb')
+    for the given (JSON serializable) key, or None if the cache is disabled.
+    """
+    if not cfg.ROIDB_CACHE_DIR:
+        return None
+    key = json.dumps([_VERSION, key], sort_keys=True)
+    return os.path.join(
+        cfg.ROIDB_CACHE_DIR,
+        '{}_{}'.format(kind, hashlib.sha1(key.encode('utf-8')).hexdigest())
+    )
+
+
+def get_file_signature(file_name):
+    """Return the (absolute path, mtime, size) of a file, or None if
+    file_name is None."""
+    if file_name is None:
+        return None
+    stat = os.stat(file_name)
+    return [os.path.abspath(file_name), stat.st_mtime, stat.st_size]
+
+
+def load_roidb(cache_path, get_dataset):
+    """Load a roidb saved by save_roidb() as a list of RoidbEntry views, or
+    return None if it is not in the cache. Datasets are looked up by name
+    through get_dataset.
+    """
+    if cache_path is None or not os.path.exists(cache_path):
+        return None
+    roidb = ColumnarRoidb.load(cache_path, get_dataset)
+    entry_inds = np.load(os.path.join(cache_path, 'entry_inds.npy'))
+    logger.info('Loaded cached roidb from {}'.format(cache_path))
+    return [roidb[i] for i in entry_inds.tolist()]
+
+
+def save_roidb(cache_path, roidb):
+    """Save a roidb to the cache. The entries of the roidb are either dicts
+    or views of a single ColumnarRoidb (which is saved as a whole).
+    """
+    if cache_path is None or os.path.exists(cache_path):
+        return
+    if len(roidb) > 0 and hasattr(roidb[0], 'roidb') and \
+            all(entry.roidb is roidb[0].roidb for entry in roidb):
+        columnar_roidb = roidb[0].roidb
+        entry_inds = np.array([entry.index for entry in roidb], dtype=np.int64)
+    else:
+        columnar_roidb = ColumnarRoidb(roidb)
+        entry_inds = np.arange(len(roidb), dtype=np.int64)
+
+    def save(directory):
+        columnar_roidb.save(directory)
+        np.save(os.path.join(directory, 'entry_inds.npy'), entry_inds)
+
+    _save_atomically(cache_path, save)
+    logger.info('Saved roidb to {}'.format(cache_path))
+
+
+def load_object(cache_path):
+    """Load a Python object saved by save_object_to_cache(), or return None
+    if it is not in the cache."""
+    if cache_path is None or not os.path.exists(cache_path):
+        return None
+    with open(os.path.join(cache_path, 'object.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def save_object_to_cache(cache_path, obj):
+    """Save a (small) Python object to the cache."""
+    if cache_path is None or os.path.exists(cache_path):
+        return
+
+    def save(directory):
+        save_object(obj, os.path.join(directory, 'object.pkl'))
+
+    _save_atomically(cache_path, save)
+
+
+def _save_atomically(cache_path, save):
+    """Call save(directory) on a temporary directory that is then renamed to
+    cache_path, such that concurrent readers never see a partial entry."""
+    if not os.path.exists(cfg.ROIDB_CACHE_DIR):
+        try:
+            os.makedirs(cfg.ROIDB_CACHE_DIR)
+        except OSError:
+            # Created by another process in the meantime
+            assert os.path.isdir(cfg.ROIDB_CACHE_DIR)
+    tmp_path = '{}.{}.tmp'.format(cache_path, uuid.uuid4().hex)
+    os.mkdir(tmp_path)
+    try:
+        save(tmp_path)
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Saved by another process in the meantime
+        if not os.path.isdir(cache_path):
+            raise
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
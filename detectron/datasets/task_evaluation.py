@@ -50,47 +50,48 @@ import detectron.datasets.voc_dataset_evaluator as voc_dataset_evaluator
 logger = logging.getLogger(__name__)
 
 
-def evaluate_all(
-    dataset, all_boxes, all_segms, all_keyps, output_dir, use_matlab=False
-):
+def evaluate_all(dataset, detections, output_dir, use_matlab=False):
     """Evaluate "all" tasks, where "all" includes box detection, instance
-    segmentation, and keypoint detection.
+    segmentation, and keypoint detection. The detections are given as
+    DetectionResults (see utils/detection_results.py).
     """
     all_results = evaluate_boxes(
-        dataset, all_boxes, output_dir, use_matlab=use_matlab
+        dataset, detections, output_dir, use_matlab=use_matlab
     )
     logger.info('Evaluating bounding boxes is done!')
     if cfg.MODEL.MASK_ON:
-        results = evaluate_masks(dataset, all_boxes, all_segms, output_dir)
+        results = evaluate_masks(dataset, detections, output_dir)
         all_results[dataset.name].update(results[dataset.name])
         logger.info('Evaluating segmentations is done!')
     if cfg.MODEL.KEYPOINTS_ON:
-        results = evaluate_keypoints(dataset, all_boxes, all_keyps, output_dir)
+        results = evaluate_keypoints(dataset, detections, output_dir)
         all_results[dataset.name].update(results[dataset.name])
         logger.info('Evaluating keypoints is done!')
     return all_results
 
 
-def evaluate_boxes(dataset, all_boxes, output_dir, use_matlab=False):
+def evaluate_boxes(dataset, detections, output_dir, use_matlab=False):
     """Evaluate bounding box detection."""
     logger.info('Evaluating detections')
     not_comp = not cfg.TEST.COMPETITION_MODE
     if _use_json_dataset_evaluator(dataset):
         coco_eval = json_dataset_evaluator.evaluate_boxes(
-            dataset, all_boxes, output_dir, use_salt=not_comp, cleanup=not_comp
+            dataset, detections, output_dir, use_salt=not_comp,
+            cleanup=not_comp
         )
         box_results = _coco_eval_to_box_results(coco_eval)
     elif _use_cityscapes_evaluator(dataset):
         logger.warn('Cityscapes bbox evaluated using COCO metrics/conversions')
         coco_eval = json_dataset_evaluator.evaluate_boxes(
-            dataset, all_boxes, output_dir, use_salt=not_comp, cleanup=not_comp
+            dataset, detections, output_dir, use_salt=not_comp,
+            cleanup=not_comp
         )
         box_results = _coco_eval_to_box_results(coco_eval)
     elif _use_voc_evaluator(dataset):
         # For VOC, always use salt and always cleanup because results are
         # written to the shared VOCdevkit results directory
         voc_eval = voc_dataset_evaluator.evaluate_boxes(
-            dataset, all_boxes, output_dir, use_matlab=use_matlab
+            dataset, detections, output_dir, use_matlab=use_matlab
         )
         box_results = _voc_eval_to_box_results(voc_eval)
     else:
@@ -100,15 +101,14 @@ def evaluate_boxes(dataset, all_boxes, output_dir, use_matlab=False):
     return OrderedDict([(dataset.name, box_results)])
 
 
-def evaluate_masks(dataset, all_boxes, all_segms, output_dir):
+def evaluate_masks(dataset, detections, output_dir):
     """Evaluate instance segmentation."""
     logger.info('Evaluating segmentations')
     not_comp = not cfg.TEST.COMPETITION_MODE
     if _use_json_dataset_evaluator(dataset):
         coco_eval = json_dataset_evaluator.evaluate_masks(
             dataset,
-            all_boxes,
-            all_segms,
+            detections,
             output_dir,
             use_salt=not_comp,
             cleanup=not_comp
@@ -117,8 +117,7 @@ def evaluate_masks(dataset, all_boxes, all_segms, output_dir):
     elif _use_cityscapes_evaluator(dataset):
         cs_eval = cs_json_dataset_evaluator.evaluate_masks(
             dataset,
-            all_boxes,
-            all_segms,
+            detections,
             output_dir,
             use_salt=not_comp,
             cleanup=not_comp
@@ -131,7 +130,7 @@ def evaluate_masks(dataset, all_boxes, all_segms, output_dir):
     return OrderedDict([(dataset.name, mask_results)])
 
 
-def evaluate_keypoints(dataset, all_boxes, all_keyps, output_dir):
+def evaluate_keypoints(dataset, detections, output_dir):
     """Evaluate human keypoint detection (i.e., 2D pose estimation)."""
     logger.info('Evaluating detections')
     not_comp = not cfg.TEST.COMPETITION_MODE
@@ -139,8 +138,7 @@ def evaluate_keypoints(dataset, all_boxes, all_keyps, output_dir):
         'Only COCO keypoints are currently supported'
     coco_eval = json_dataset_evaluator.evaluate_keypoints(
         dataset,
-        all_boxes,
-        all_keyps,
+        detections,
         output_dir,
         use_salt=not_comp,
         cleanup=not_comp
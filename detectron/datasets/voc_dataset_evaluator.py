@@ -36,14 +36,14 @@ logger = logging.getLogger(__name__)
 
 def evaluate_boxes(
     json_dataset,
-    all_boxes,
+    detections,
     output_dir,
     use_salt=True,
     cleanup=True,
     use_matlab=False
 ):
     salt = '_{}'.format(str(uuid.uuid4())) if use_salt else ''
-    filenames = _write_voc_results_files(json_dataset, all_boxes, salt)
+    filenames = _write_voc_results_files(json_dataset, detections, salt)
     _do_python_eval(json_dataset, salt, output_dir)
     if use_matlab:
         _do_matlab_eval(json_dataset, salt, output_dir)
@@ -54,7 +54,7 @@ def evaluate_boxes(
     return None
 
 
-def _write_voc_results_files(json_dataset, all_boxes, salt):
+def _write_voc_results_files(json_dataset, detections, salt):
     filenames = []
     image_set_path = voc_info(json_dataset)['image_set_path']
     assert os.path.exists(image_set_path), \
@@ -74,20 +74,17 @@ def _write_voc_results_files(json_dataset, all_boxes, salt):
         filename = _get_voc_results_file_template(json_dataset,
                                                   salt).format(cls)
         filenames.append(filename)
-        assert len(all_boxes[cls_ind]) == len(image_index)
+        assert detections.num_images == len(image_index)
+        # The detections of the class, in image order
+        rows = detections.get_class_rows(cls_ind)
+        dets = detections.dets[rows]
         with open(filename, 'wt') as f:
-            for im_ind, index in enumerate(image_index):
-                dets = all_boxes[cls_ind][im_ind]
-                if type(dets) == list:
-                    assert len(dets) == 0, \
-                        'dets should be numpy.ndarray or empty list'
-                    continue
+            for im_ind, det in zip(detections.det_image_inds[rows], dets):
                 # the VOCdevkit expects 1-based indices
-                for k in range(dets.shape[0]):
-                    f.write('{:s} {:.3f} {:.1f} {:.1f} {:.1f} {:.1f}\n'.
-                            format(index, dets[k, -1],
-                                   dets[k, 0] + 1, dets[k, 1] + 1,
-                                   dets[k, 2] + 1, dets[k, 3] + 1))
+                f.write('{:s} {:.3f} {:.1f} {:.1f} {:.1f} {:.1f}\n'.
+                        format(image_index[im_ind], det[-1],
+                               det[0] + 1, det[1] + 1,
+                               det[2] + 1, det[3] + 1))
     return filenames
 
 
@@ -519,19 +519,46 @@ def add_multilevel_roi_blobs(
     lvl_min: the finest (highest resolution) FPN level (e.g., 2)
     lvl_max: the coarest (lowest resolution) FPN level (e.g., 6)
     """
-    rois_idx_order = np.empty((0, ))
-    rois_stacked = np.zeros((0, 5), dtype=np.float32)  # for assert
-    for lvl in range(lvl_min, lvl_max + 1):
-        idx_lvl = np.where(target_lvls == lvl)[0]
-        blobs[blob_prefix + '_fpn' + str(lvl)] = rois[idx_lvl, :]
-        rois_idx_order = np.concatenate((rois_idx_order, idx_lvl))
-        rois_stacked = np.vstack(
-            [rois_stacked, blobs[blob_prefix + '_fpn' + str(lvl)]]
-        )
-    rois_idx_restore = np.argsort(rois_idx_order).astype(np.int32, copy=False)
+    rois_lvls, rois_idx_restore = distribute_rois_over_fpn_levels(
+        rois, target_lvls, lvl_min, lvl_max
+    )
+    for lvl, rois_lvl in zip(range(lvl_min, lvl_max + 1), rois_lvls):
+        blobs[blob_prefix + '_fpn' + str(lvl)] = rois_lvl
     blobs[blob_prefix + '_idx_restore_int32'] = rois_idx_restore
-    # Sanity check that restore order is correct
-    assert (rois_stacked[rois_idx_restore] == rois).all()
+
+
+def distribute_rois_over_fpn_levels(rois, target_lvls, lvl_min, lvl_max):
+    """Split rois into the RoIs of each FPN level.
+
+    rois: a 2D numpy array of RoIs (one per row)
+    target_lvls: numpy array of shape (N, ) indicating which FPN level (between
+      lvl_min and lvl_max) each roi in rois should be assigned to
+
+    Returns the list of the RoIs of each level (in their original order), and
+    the int32 indices that restore the original order of the RoIs from the
+    concatenation of the RoIs of all levels. The RoIs of the levels are views
+    of a single array of the RoIs sorted by level.
+    """
+    num_lvls = lvl_max - lvl_min + 1
+    lvl_inds = (target_lvls - lvl_min).astype(np.uint8)
+    # A stable sort of (8 bit) integers is a single counting (radix) sort pass
+    order = np.argsort(lvl_inds, kind='mergesort')
+    lvl_offsets = np.zeros(num_lvls + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(lvl_inds, minlength=num_lvls), out=lvl_offsets[1:]
+    )
+    rois_sorted = rois[order]
+    rois_lvls = [
+        rois_sorted[lvl_offsets[i]:lvl_offsets[i + 1]]
+        for i in range(num_lvls)
+    ]
+    # The restore order is the inverse permutation of the sort order
+    rois_idx_restore = np.empty(len(order), dtype=np.int32)
+    rois_idx_restore[order] = np.arange(len(order), dtype=np.int32)
+    if cfg.FPN.CHECK_ROI_DISTRIBUTION:
+        # Sanity check that restore order is correct
+        assert (rois_sorted[rois_idx_restore] == rois).all()
+    return rois_lvls, rois_idx_restore
 
 
 # ---------------------------------------------------------------------------- #
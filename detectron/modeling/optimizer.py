@@ -50,7 +50,7 @@ def build_data_parallel_model(model, single_gpu_build_func):
     else:
         # Test-time network operates on single GPU
         # Test-time parallelism is implemented through multiprocessing
-        with c2_utils.NamedCudaScope(model.target_gpu_id):
+        with c2_utils.NamedDeviceScope(model.target_gpu_id):
             single_gpu_build_func(model)
 
 
@@ -26,6 +26,7 @@ from detectron.datasets import roidb as roidb_utils
 import detectron.modeling.FPN as fpn
 import detectron.roi_data.fast_rcnn as fast_rcnn_roi_data
 import detectron.utils.blob as blob_utils
+import detectron.utils.roidb_blob as roidb_blob_utils
 
 
 class CollectAndDistributeFpnRpnProposalsOp(object):
@@ -48,7 +49,7 @@ class CollectAndDistributeFpnRpnProposalsOp(object):
             # im_info: [[im_height, im_width, im_scale], ...]
             im_info = inputs[-1].data
             im_scales = im_info[:, 2]
-            roidb = blob_utils.deserialize(inputs[-2].data)
+            roidb = roidb_blob_utils.deserialize(inputs[-2].data)
             # For historical consistency with the original Faster R-CNN
             # implementation we are *not* filtering crowd proposals.
             # This choice should be investigated in the future (it likely does
@@ -83,7 +84,16 @@ def collect(inputs, is_training):
     # Combine predictions across all levels and retain the top scoring
     rois = np.concatenate([blob.data for blob in roi_inputs])
     scores = np.concatenate([blob.data for blob in score_inputs]).squeeze()
-    inds = np.argsort(-scores)[:post_nms_topN]
+    if is_training:
+        inds = np.argsort(-scores)[:post_nms_topN]
+    else:
+        # Retain the top scoring rois of each image of a (batched) inference
+        # minibatch, grouped by image
+        inds = np.argsort(-scores)
+        inds = inds[np.argsort(rois[inds, 0], kind='mergesort')]
+        batch_inds = rois[inds, 0]
+        im_starts = np.searchsorted(batch_inds, batch_inds)
+        inds = inds[np.arange(len(inds)) - im_starts < post_nms_topN]
     rois = rois[inds, :]
     return rois
 
@@ -100,14 +110,10 @@ def distribute(rois, label_blobs, outputs, train):
     outputs[0].data[...] = rois
 
     # Create new roi blobs for each FPN level
-    # (See: modeling.FPN.add_multilevel_roi_blobs which is similar but annoying
-    # to generalize to support this particular case.)
-    rois_idx_order = np.empty((0, ))
-    for output_idx, lvl in enumerate(range(lvl_min, lvl_max + 1)):
-        idx_lvl = np.where(lvls == lvl)[0]
-        blob_roi_level = rois[idx_lvl, :]
+    rois_lvls, rois_idx_restore = fpn.distribute_rois_over_fpn_levels(
+        rois, lvls, lvl_min, lvl_max
+    )
+    for output_idx, blob_roi_level in enumerate(rois_lvls):
         outputs[output_idx + 1].reshape(blob_roi_level.shape)
         outputs[output_idx + 1].data[...] = blob_roi_level
-        rois_idx_order = np.concatenate((rois_idx_order, idx_lvl))
-    rois_idx_restore = np.argsort(rois_idx_order)
-    blob_utils.py_op_copy_blob(rois_idx_restore.astype(np.int32), outputs[-1])
+    blob_utils.py_op_copy_blob(rois_idx_restore, outputs[-1])
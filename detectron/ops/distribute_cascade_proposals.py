@@ -18,13 +18,11 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import numpy as np
-
 from detectron.core.config import cfg
-from detectron.datasets import json_dataset
 import detectron.modeling.FPN as fpn
 import detectron.roi_data.cascade_rcnn as cascade_rcnn_roi_data
 import detectron.utils.blob as blob_utils
+import detectron.utils.roidb_blob as roidb_blob_utils
 
 
 class DistributeCascadeProposalsOp(object):
@@ -42,15 +40,26 @@ class DistributeCascadeProposalsOp(object):
             # During training we reuse the data loader code. We populate roidb
             # entries on the fly using the rois generated by RPN.
             # im_info: [[im_height, im_width, im_scale], ...]
-            roidb = blob_utils.deserialize(inputs[1].data)
+            roidb = roidb_blob_utils.deserialize(inputs[1].data)
             im_info = inputs[2].data
             im_scales = im_info[:, 2]
 
+            # The ground truth of the minibatch is the same for all stages, so
+            # its tables are built once and only the new proposals of each
+            # stage are labeled against them.
             # For historical consistency with the original Faster R-CNN
             # implementation we are *not* filtering crowd proposals.
             # This choice should be investigated in the future (it likely does
             # not matter).
-            json_dataset.add_proposals(roidb, rois, im_scales, crowd_thresh=0)
+            state = roidb_blob_utils.get_minibatch_state(inputs[1].data)
+            if 'gt_tables' not in state:
+                state['gt_tables'] = [
+                    cascade_rcnn_roi_data.get_gt_table(entry)
+                    for entry in roidb
+                ]
+            cascade_rcnn_roi_data.add_proposals(
+                roidb, state['gt_tables'], rois, im_scales
+            )
             # Compute training labels for the RPN proposals; also handles
             # distributing the proposals over FPN levels
             output_blob_names = cascade_rcnn_roi_data.get_cascade_rcnn_blob_names(
@@ -80,14 +89,10 @@ def distribute(rois, label_blobs, outputs, train):
     outputs[0].data[...] = rois
 
     # Create new roi blobs for each FPN level
-    # (See: modeling.FPN.add_multilevel_roi_blobs which is similar but annoying
-    # to generalize to support this particular case.)
-    rois_idx_order = np.empty((0,))
-    for output_idx, lvl in enumerate(range(lvl_min, lvl_max + 1)):
-        idx_lvl = np.where(lvls == lvl)[0]
-        blob_roi_level = rois[idx_lvl, :]
+    rois_lvls, rois_idx_restore = fpn.distribute_rois_over_fpn_levels(
+        rois, lvls, lvl_min, lvl_max
+    )
+    for output_idx, blob_roi_level in enumerate(rois_lvls):
         outputs[output_idx + 1].reshape(blob_roi_level.shape)
         outputs[output_idx + 1].data[...] = blob_roi_level
-        rois_idx_order = np.concatenate((rois_idx_order, idx_lvl))
-    rois_idx_restore = np.argsort(rois_idx_order)
-    blob_utils.py_op_copy_blob(rois_idx_restore.astype(np.int32), outputs[-1])
+    blob_utils.py_op_copy_blob(rois_idx_restore, outputs[-1])
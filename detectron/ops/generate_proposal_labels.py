@@ -23,6 +23,7 @@ import logging
 from detectron.datasets import json_dataset
 from detectron.datasets import roidb as roidb_utils
 from detectron.utils import blob as blob_utils
+from detectron.utils import roidb_blob as roidb_blob_utils
 import detectron.roi_data.fast_rcnn as fast_rcnn_roi_data
 
 logger = logging.getLogger(__name__)
@@ -38,7 +39,7 @@ class GenerateProposalLabelsOp(object):
         # entries on the fly using the rois generated by RPN.
         # im_info: [[im_height, im_width, im_scale], ...]
         rois = inputs[0].data
-        roidb = blob_utils.deserialize(inputs[1].data)
+        roidb = roidb_blob_utils.deserialize(inputs[1].data)
         im_info = inputs[2].data
         im_scales = im_info[:, 2]
         output_blob_names = fast_rcnn_roi_data.get_fast_rcnn_blob_names()
@@ -41,6 +41,8 @@ class GenerateProposalsOp(object):
         self._feat_stride = 1. / spatial_scale
         self._train = train
         self._reg_weights = reg_weights
+        # Shifted anchors (see _get_all_anchors) by feature map (H, W)
+        self._all_anchors_cache = {}
 
     def forward(self, inputs, outputs):
         """See modeling.detector.GenerateProposals for inputs/outputs
@@ -56,6 +58,7 @@ class GenerateProposalsOp(object):
         # 6. apply NMS with a loose threshold (0.7) to the remaining proposals
         # 7. take after_nms_topN proposals after NMS
         # 8. return the top proposals
+        # All steps but NMS are applied to all images of the batch at once
 
         # predicted probability of fg object for each RPN anchor
         scores = inputs[0].data
@@ -64,134 +67,150 @@ class GenerateProposalsOp(object):
         # input image (height, width, scale), in which scale is the scale factor
         # applied to the original dataset image to get the network input image
         im_info = inputs[2].data
-        # 1. Generate proposals from bbox deltas and shifted anchors
-        height, width = scores.shape[-2:]
-        # Enumerate all shifted positions on the (H, W) grid
-        shift_x = np.arange(0, width) * self._feat_stride
-        shift_y = np.arange(0, height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y, copy=False)
-        # Convert to (K, 4), K=H*W, where the columns are (dx, dy, dx, dy)
-        # shift pointing to each grid location
-        shifts = np.vstack((shift_x.ravel(), shift_y.ravel(),
-                            shift_x.ravel(), shift_y.ravel())).transpose()
-
-        # Broacast anchors over shifts to enumerate all anchors at all positions
-        # in the (H, W) grid:
-        #   - add A anchors of shape (1, A, 4) to
-        #   - K shifts of shape (K, 1, 4) to get
-        #   - all shifted anchors of shape (K, A, 4)
-        #   - reshape to (K*A, 4) shifted anchors
-        num_images = inputs[0].shape[0]
-        A = self._num_anchors
-        K = shifts.shape[0]
-        all_anchors = self._anchors[np.newaxis, :, :] + shifts[:, np.newaxis, :]
-        all_anchors = all_anchors.reshape((K * A, 4))
-
-        rois = np.empty((0, 5), dtype=np.float32)
-        roi_probs = np.empty((0, 1), dtype=np.float32)
-        for im_i in range(num_images):
-            im_i_boxes, im_i_probs = self.proposals_for_one_image(
-                im_info[im_i, :], all_anchors, bbox_deltas[im_i, :, :, :],
-                scores[im_i, :, :, :]
-            )
-            batch_inds = im_i * np.ones(
-                (im_i_boxes.shape[0], 1), dtype=np.float32
-            )
-            im_i_rois = np.hstack((batch_inds, im_i_boxes))
-            rois = np.append(rois, im_i_rois, axis=0)
-            roi_probs = np.append(roi_probs, im_i_probs, axis=0)
-
-        outputs[0].reshape(rois.shape)
-        outputs[0].data[...] = rois
-        if len(outputs) > 1:
-            outputs[1].reshape(roi_probs.shape)
-            outputs[1].data[...] = roi_probs
-
-    def proposals_for_one_image(
-        self, im_info, all_anchors, bbox_deltas, scores
-    ):
         # Get mode-dependent configuration
         cfg_key = 'TRAIN' if self._train else 'TEST'
         pre_nms_topN = cfg[cfg_key].RPN_PRE_NMS_TOP_N
         post_nms_topN = cfg[cfg_key].RPN_POST_NMS_TOP_N
         nms_thresh = cfg[cfg_key].RPN_NMS_THRESH
         min_size = cfg[cfg_key].RPN_MIN_SIZE
-        # Transpose and reshape predicted bbox transformations to get them
-        # into the same order as the anchors:
-        #   - bbox deltas will be (4 * A, H, W) format from conv output
-        #   - transpose to (H, W, 4 * A)
-        #   - reshape to (H * W * A, 4) where rows are ordered by (H, W, A)
+        # 1. Generate proposals from bbox deltas and shifted anchors
+        num_images = scores.shape[0]
+        height, width = scores.shape[-2:]
+        all_anchors = self._get_all_anchors(height, width)
+        # Transpose and reshape predicted bbox transformations and scores to
+        # get them into the same order as the anchors:
+        #   - bbox deltas will be (N, 4 * A, H, W) format from conv output
+        #   - transpose to (N, H, W, 4 * A)
+        #   - reshape to (N, H * W * A, 4) where rows are ordered by (H, W, A)
         #     in slowest to fastest order to match the enumerated anchors
-        bbox_deltas = bbox_deltas.transpose((1, 2, 0)).reshape((-1, 4))
-
-        # Same story for the scores:
-        #   - scores are (A, H, W) format from conv output
-        #   - transpose to (H, W, A)
-        #   - reshape to (H * W * A, 1) where rows are ordered by (H, W, A)
-        #     to match the order of anchors and bbox_deltas
-        scores = scores.transpose((1, 2, 0)).reshape((-1, 1))
+        # Same story for the scores, which are reshaped to (N, H * W * A)
+        bbox_deltas = bbox_deltas.transpose((0, 2, 3, 1)).reshape(
+            (num_images, -1, 4)
+        )
+        scores = scores.transpose((0, 2, 3, 1)).reshape((num_images, -1))
 
         # 4. sort all (proposal, score) pairs by score from highest to lowest
         # 5. take top pre_nms_topN (e.g. 6000)
-        if pre_nms_topN <= 0 or pre_nms_topN >= len(scores):
-            order = np.argsort(-scores.squeeze())
+        image_inds = np.arange(num_images)[:, np.newaxis]
+        if pre_nms_topN <= 0 or pre_nms_topN >= scores.shape[1]:
+            order = np.argsort(-scores, axis=1)
         else:
             # Avoid sorting possibly large arrays; First partition to get top K
             # unsorted and then sort just those (~20x faster for 200k scores)
             inds = np.argpartition(
-                -scores.squeeze(), pre_nms_topN
-            )[:pre_nms_topN]
-            order = np.argsort(-scores[inds].squeeze())
-            order = inds[order]
-        bbox_deltas = bbox_deltas[order, :]
-        all_anchors = all_anchors[order, :]
-        scores = scores[order]
+                -scores, pre_nms_topN, axis=1
+            )[:, :pre_nms_topN]
+            order = np.argsort(-scores[image_inds, inds], axis=1)
+            order = inds[image_inds, order]
+        bbox_deltas = bbox_deltas[image_inds, order]
+        scores = scores[image_inds, order]
 
         # Transform anchors into proposals via bbox transformations
-        proposals = box_utils.bbox_transform(all_anchors, bbox_deltas, self._reg_weights)
+        proposals = box_utils.bbox_transform(
+            all_anchors[order].reshape((-1, 4)), bbox_deltas.reshape((-1, 4)),
+            self._reg_weights
+        ).reshape(bbox_deltas.shape)
 
         # 2. clip proposals to image (may result in proposals with zero area
         # that will be removed in the next step)
-        proposals = box_utils.clip_tiled_boxes(proposals, im_info[:2])
+        _clip_boxes_batch(proposals, im_info)
 
         # 3. remove predicted boxes with either height or width < min_size
-        keep = _filter_boxes(proposals, min_size, im_info)
-        proposals = proposals[keep, :]
-        scores = scores[keep]
+        is_valid = _get_valid_boxes_batch(proposals, min_size, im_info)
 
-        # 6. apply loose nms (e.g. threshold = 0.7)
+        # 6. apply loose nms (e.g. threshold = 0.7), to all images in parallel
         # 7. take after_nms_topN (e.g. 300)
-        # 8. return the top proposals (-> RoIs top)
+        keeps = [np.where(is_valid[im_i])[0] for im_i in range(num_images)]
         if nms_thresh > 0:
-            keep = box_utils.nms(np.hstack((proposals, scores)), nms_thresh)
-            if post_nms_topN > 0:
-                keep = keep[:post_nms_topN]
-            proposals = proposals[keep, :]
-            scores = scores[keep]
-        return proposals, scores
+            dets = np.hstack(
+                (proposals[is_valid], scores[is_valid][:, np.newaxis])
+            )
+            set_offsets = np.cumsum([0] + [len(keep) for keep in keeps])
+            # The proposals are sorted by score, so NMS can stop once
+            # post_nms_topN proposals are kept
+            nms_keeps = box_utils.nms_per_set(
+                dets, set_offsets, nms_thresh, max_keep=post_nms_topN
+            )
+            for im_i, nms_keep in enumerate(nms_keeps):
+                keeps[im_i] = keeps[im_i][nms_keep]
+
+        # 8. return the top proposals (-> RoIs top), written directly into the
+        # output blobs
+        num_rois = sum(len(keep) for keep in keeps)
+        outputs[0].reshape((num_rois, 5))
+        rois = outputs[0].data
+        if len(outputs) > 1:
+            outputs[1].reshape((num_rois, 1))
+            roi_probs = outputs[1].data
+        start = 0
+        for im_i, keep in enumerate(keeps):
+            end = start + len(keep)
+            rois[start:end, 0] = im_i
+            rois[start:end, 1:] = proposals[im_i, keep]
+            if len(outputs) > 1:
+                roi_probs[start:end, 0] = scores[im_i, keep]
+            start = end
+
+    def _get_all_anchors(self, height, width):
+        """Return the anchors at all positions of a (height, width) grid as a
+        (K * A, 4) array, where K = height * width."""
+        all_anchors = self._all_anchors_cache.get((height, width))
+        if all_anchors is not None:
+            return all_anchors
+        # Enumerate all shifted positions on the (H, W) grid
+        shift_x = np.arange(0, width) * self._feat_stride
+        shift_y = np.arange(0, height) * self._feat_stride
+        shift_x, shift_y = np.meshgrid(shift_x, shift_y, copy=False)
+        # Convert to (K, 4), K=H*W, where the columns are (dx, dy, dx, dy)
+        # shift pointing to each grid location
+        shifts = np.vstack((shift_x.ravel(), shift_y.ravel(),
+                            shift_x.ravel(), shift_y.ravel())).transpose()
+
+        # Broacast anchors over shifts to enumerate all anchors at all positions
+        # in the (H, W) grid:
+        #   - add A anchors of shape (1, A, 4) to
+        #   - K shifts of shape (K, 1, 4) to get
+        #   - all shifted anchors of shape (K, A, 4)
+        #   - reshape to (K*A, 4) shifted anchors
+        A = self._num_anchors
+        K = shifts.shape[0]
+        all_anchors = self._anchors[np.newaxis, :, :] + shifts[:, np.newaxis, :]
+        all_anchors = all_anchors.reshape((K * A, 4))
+        all_anchors.setflags(write=False)
+        self._all_anchors_cache[(height, width)] = all_anchors
+        return all_anchors
+
+
+def _clip_boxes_batch(boxes, im_info):
+    """Clip (N, K, 4) boxes of N images in place to the image boundaries given
+    by the (N, 3) im_info."""
+    heights = im_info[:, 0, np.newaxis]
+    widths = im_info[:, 1, np.newaxis]
+    for i, size in enumerate([widths, heights, widths, heights]):
+        boxes[:, :, i] = np.maximum(np.minimum(boxes[:, :, i], size - 1), 0)
 
 
-def _filter_boxes(boxes, min_size, im_info):
-    """Only keep boxes with both sides >= min_size and center within the image.
+def _get_valid_boxes_batch(boxes, min_size, im_info):
+    """Return a mask of the (N, K, 4) boxes of N images that have both sides
+    >= min_size and their center within the image given by the (N, 3) im_info.
     """
-    # Compute the width and height of the proposal boxes as measured in the original
-    # image coordinate system (this is required to avoid "Negative Areas Found"
-    # assertions in other parts of the code that measure).
-    im_scale = im_info[2]
-    ws_orig_scale = (boxes[:, 2] - boxes[:, 0]) / im_scale + 1
-    hs_orig_scale = (boxes[:, 3] - boxes[:, 1]) / im_scale + 1
-    # To avoid numerical issues we require the min_size to be at least 1 pixel in the
-    # original image
+    # Compute the width and height of the proposal boxes as measured in the
+    # original image coordinate system (this is required to avoid "Negative
+    # Areas Found" assertions in other parts of the code that measure).
+    im_scales = im_info[:, 2, np.newaxis]
+    ws_orig_scale = (boxes[:, :, 2] - boxes[:, :, 0]) / im_scales + 1
+    hs_orig_scale = (boxes[:, :, 3] - boxes[:, :, 1]) / im_scales + 1
+    # To avoid numerical issues we require the min_size to be at least 1 pixel
+    # in the original image
     min_size = np.maximum(min_size, 1)
     # Proposal center is computed relative to the scaled input image
-    ws = boxes[:, 2] - boxes[:, 0] + 1
-    hs = boxes[:, 3] - boxes[:, 1] + 1
-    x_ctr = boxes[:, 0] + ws / 2.
-    y_ctr = boxes[:, 1] + hs / 2.
-    keep = np.where(
+    ws = boxes[:, :, 2] - boxes[:, :, 0] + 1
+    hs = boxes[:, :, 3] - boxes[:, :, 1] + 1
+    x_ctr = boxes[:, :, 0] + ws / 2.
+    y_ctr = boxes[:, :, 1] + hs / 2.
+    return (
         (ws_orig_scale >= min_size)
         & (hs_orig_scale >= min_size)
-        & (x_ctr < im_info[1])
-        & (y_ctr < im_info[0])
-    )[0]
-    return keep
+        & (x_ctr < im_info[:, 1, np.newaxis])
+        & (y_ctr < im_info[:, 0, np.newaxis])
+    )
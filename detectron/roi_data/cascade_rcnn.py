@@ -22,6 +22,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import logging
 import numpy as np
 
@@ -124,6 +125,84 @@ def add_cascade_rcnn_blobs(blobs, im_scales, roidb, stage):
     return valid
 
 
+# Ground truth of an image, used to label the proposals of each cascade stage:
+#   gt_inds: indices of the gt boxes in the roidb entry
+#   gt_boxes: (float32) gt boxes
+#   gt_classes: classes of the gt boxes
+#   max_overlaps, max_classes: class assignments of the boxes of the entry
+#     (as computed by json_dataset.add_proposals)
+GtTable = collections.namedtuple(
+    'GtTable',
+    ['gt_inds', 'gt_boxes', 'gt_classes', 'max_overlaps', 'max_classes']
+)
+
+
+def get_gt_table(entry):
+    """Return the GtTable of an roidb entry (which has no proposals yet)."""
+    gt_inds = np.where(entry['gt_classes'] > 0)[0]
+    gt_overlaps = entry['gt_overlaps'].toarray()
+    return GtTable(
+        gt_inds=gt_inds,
+        gt_boxes=entry['boxes'][gt_inds, :].astype(np.float32, copy=False),
+        gt_classes=entry['gt_classes'][gt_inds],
+        max_overlaps=gt_overlaps.max(axis=1),
+        max_classes=gt_overlaps.argmax(axis=1)
+    )
+
+
+def add_proposals(roidb, gt_tables, rois, scales):
+    """Add the proposal boxes (rois) of a cascade stage to the roidb entries,
+    which have ground-truth annotations but no proposals. Gives the same
+    'boxes', 'gt_classes', 'seg_areas', 'is_crowd', 'box_to_gt_ind_map',
+    'max_overlaps' and 'max_classes' as json_dataset.add_proposals (with
+    crowd_thresh=0), but the proposals are labeled directly against the
+    ground truth tables of the entries (see get_gt_table), without building
+    gt_overlaps, which is removed from the entries.
+    """
+    for i, entry in enumerate(roidb):
+        gt_table = gt_tables[i]
+        inv_im_scale = 1. / scales[i]
+        idx = np.where(rois[:, 0] == i)[0]
+        boxes = rois[idx, 1:] * inv_im_scale
+        num_boxes = boxes.shape[0]
+        max_overlaps = np.zeros(
+            (num_boxes), dtype=gt_table.max_overlaps.dtype
+        )
+        max_classes = np.zeros(
+            (num_boxes), dtype=gt_table.max_classes.dtype
+        )
+        box_to_gt_ind_map = -np.ones(
+            (num_boxes), dtype=entry['box_to_gt_ind_map'].dtype
+        )
+        if len(gt_table.gt_inds) > 0:
+            proposal_to_gt_overlaps = box_utils.bbox_overlaps(
+                boxes.astype(dtype=np.float32, copy=False), gt_table.gt_boxes
+            )
+            argmaxes = proposal_to_gt_overlaps.argmax(axis=1)
+            maxes = proposal_to_gt_overlaps.max(axis=1)
+            # Proposals with non-zero overlap with gt boxes are assigned the
+            # class of the gt box they overlap most with
+            I = np.where(maxes > 0)[0]
+            max_overlaps[I] = maxes[I]
+            max_classes[I] = gt_table.gt_classes[argmaxes[I]]
+            box_to_gt_ind_map[I] = gt_table.gt_inds[argmaxes[I]]
+        entry['boxes'] = np.append(
+            entry['boxes'],
+            boxes.astype(entry['boxes'].dtype, copy=False),
+            axis=0
+        )
+        for k in ['gt_classes', 'seg_areas', 'is_crowd']:
+            entry[k] = np.append(
+                entry[k], np.zeros((num_boxes), dtype=entry[k].dtype)
+            )
+        entry['box_to_gt_ind_map'] = np.append(
+            entry['box_to_gt_ind_map'], box_to_gt_ind_map
+        )
+        entry['max_overlaps'] = np.append(gt_table.max_overlaps, max_overlaps)
+        entry['max_classes'] = np.append(gt_table.max_classes, max_classes)
+        entry.pop('gt_overlaps', None)
+
+
 def _sample_rois(roidb, im_scale, batch_idx, stage):
     """Generate a random sample of RoIs comprising foreground and background
     examples.
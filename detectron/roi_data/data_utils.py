@@ -29,6 +29,7 @@ import threading
 from detectron.core.config import cfg
 from detectron.modeling.generate_anchors import generate_anchors
 import detectron.utils.boxes as box_utils
+import detectron.utils.cython_bbox as cython_bbox
 
 logger = logging.getLogger(__name__)
 
@@ -43,21 +44,59 @@ FieldOfAnchors = namedtuple(
     ]
 )
 
-# Cache for memoizing _get_field_of_anchors
-_threadlocal_foa = threading.local()
+# Process-wide cache of fields of anchors (see get_fields_of_anchors). The
+# cached anchors are read-only, so they are shared by all loader threads (and by
+# the loader processes if the cache is populated before they are forked)
+_foa_cache = {}
+_foa_cache_lock = threading.Lock()
 
 
 def get_field_of_anchors(
     stride, anchor_sizes, anchor_aspect_ratios, octave=None, aspect=None
 ):
-    global _threadlocal_foa
-    if not hasattr(_threadlocal_foa, 'cache'):
-        _threadlocal_foa.cache = {}
+    foas, _ = get_fields_of_anchors(
+        [(stride, anchor_sizes, anchor_aspect_ratios, octave, aspect)]
+    )
+    return foas[0]
+
 
-    cache_key = str(stride) + str(anchor_sizes) + str(anchor_aspect_ratios)
-    if cache_key in _threadlocal_foa.cache:
-        return _threadlocal_foa.cache[cache_key]
+def get_fields_of_anchors(foa_params):
+    """Return the fields of anchors for a list of (stride, anchor_sizes,
+    anchor_aspect_ratios, octave, aspect) tuples and all of their anchors
+    concatenated in order. The field_of_anchors of each returned field is a
+    (read-only) view of the concatenated anchors.
+    """
+    fpn_max_size = cfg.FPN.COARSEST_STRIDE * np.ceil(
+        cfg.TRAIN.MAX_SIZE / float(cfg.FPN.COARSEST_STRIDE)
+    )
+    cache_key = (fpn_max_size, ) + tuple(
+        (float(stride), tuple(anchor_sizes), tuple(anchor_aspect_ratios),
+         octave, aspect)
+        for stride, anchor_sizes, anchor_aspect_ratios, octave, aspect
+        in foa_params
+    )
+    with _foa_cache_lock:
+        if cache_key not in _foa_cache:
+            foas = [
+                _make_field_of_anchors(fpn_max_size, *params)
+                for params in foa_params
+            ]
+            all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+            all_anchors.setflags(write=False)
+            start_idx = 0
+            for i, foa in enumerate(foas):
+                end_idx = start_idx + foa.field_of_anchors.shape[0]
+                foas[i] = foa._replace(
+                    field_of_anchors=all_anchors[start_idx:end_idx]
+                )
+                start_idx = end_idx
+            _foa_cache[cache_key] = (foas, all_anchors)
+        return _foa_cache[cache_key]
 
+
+def _make_field_of_anchors(
+    fpn_max_size, stride, anchor_sizes, anchor_aspect_ratios, octave, aspect
+):
     # Anchors at a single feature cell
     cell_anchors = generate_anchors(
         stride=stride, sizes=anchor_sizes, aspect_ratios=anchor_aspect_ratios
@@ -66,9 +105,6 @@ def get_field_of_anchors(
 
     # Generate canonical proposals from shifted anchors
     # Enumerate all shifted positions on the (H, W) grid
-    fpn_max_size = cfg.FPN.COARSEST_STRIDE * np.ceil(
-        cfg.TRAIN.MAX_SIZE / float(cfg.FPN.COARSEST_STRIDE)
-    )
     field_size = int(np.ceil(fpn_max_size / float(stride)))
     shifts = np.arange(0, field_size) * stride
     shift_x, shift_y = np.meshgrid(shifts, shifts)
@@ -89,7 +125,7 @@ def get_field_of_anchors(
         shifts.reshape((1, K, 4)).transpose((1, 0, 2))
     )
     field_of_anchors = field_of_anchors.reshape((K * A, 4))
-    foa = FieldOfAnchors(
+    return FieldOfAnchors(
         field_of_anchors=field_of_anchors.astype(np.float32),
         num_cell_anchors=num_cell_anchors,
         stride=stride,
@@ -97,8 +133,37 @@ def get_field_of_anchors(
         octave=octave,
         aspect=aspect
     )
-    _threadlocal_foa.cache[cache_key] = foa
-    return foa
+
+
+def get_inds_inside(foas, im_height, im_width, straddle_thresh):
+    """Return the (sorted) indices of the anchors of the fields of anchors foas
+    (concatenated in order) that are inside an image of size (im_height,
+    im_width) by a margin of straddle_thresh. Equivalent to testing all
+    anchors, but the x (resp. y) coordinates of the anchors of a field only
+    depend on their column (resp. row), so only one row and one column of
+    each field is tested.
+    """
+    inds_inside = []
+    start_idx = 0
+    for foa in foas:
+        A = foa.num_cell_anchors
+        F = foa.field_size
+        field = foa.field_of_anchors.reshape((F, F, A, 4))
+        # (F, A) anchors of the first row and of the first column
+        row = field[0, :, :, :]
+        col = field[:, 0, :, :]
+        x_inside = (
+            (row[:, :, 0] >= -straddle_thresh) &
+            (row[:, :, 2] < im_width + straddle_thresh)
+        )
+        y_inside = (
+            (col[:, :, 1] >= -straddle_thresh) &
+            (col[:, :, 3] < im_height + straddle_thresh)
+        )
+        inside = y_inside[:, np.newaxis, :] & x_inside[np.newaxis, :, :]
+        inds_inside.append(np.flatnonzero(inside) + start_idx)
+        start_idx += foa.field_of_anchors.shape[0]
+    return np.concatenate(inds_inside)
 
 
 def unmap(data, count, inds, fill=0):
@@ -123,3 +188,84 @@ def compute_targets(ex_rois, gt_rois, weights=(1.0, 1.0, 1.0, 1.0)):
     return box_utils.bbox_transform_inv(ex_rois, gt_rois, weights).astype(
         np.float32, copy=False
     )
+
+
+def match_anchors_to_gt_boxes(foas, gt_boxes, inds_inside=None):
+    """Match the anchors of the fields of anchors foas (concatenated in order)
+    to the gt boxes. Equivalent to computing the dense overlaps
+    bbox_overlaps(anchors, gt_boxes) (with anchors = all_anchors[inds_inside])
+    and returning
+
+      anchor_to_gt_argmax: overlaps.argmax(axis=1)
+      anchor_to_gt_max: overlaps.max(axis=1)
+      anchors_with_max_overlap: the (sorted, unique) anchors that have the
+        highest overlap with some gt box, including ties
+
+    but only the overlaps of the anchors near each gt box are computed: the
+    anchors of a field lie on a regular grid, so for each gt box and cell
+    anchor the range of grid cells of the anchors that can overlap the gt box
+    is known. No (anchors x gt boxes) array is allocated.
+    """
+    num_gt = gt_boxes.shape[0]
+    gt_boxes = gt_boxes.astype(np.float32, copy=False)
+    total_anchors = sum(foa.field_of_anchors.shape[0] for foa in foas)
+    if inds_inside is None:
+        num_inside = total_anchors
+        anchor_pos = np.arange(total_anchors, dtype=np.int64)
+    else:
+        num_inside = len(inds_inside)
+        # Map from anchor index to its position in inds_inside (or -1)
+        anchor_pos = np.full((total_anchors, ), -1, dtype=np.int64)
+        anchor_pos[inds_inside] = np.arange(num_inside)
+
+    fields = []
+    start_idx = 0
+    for foa in foas:
+        A = foa.num_cell_anchors
+        F = foa.field_size
+        cell_anchors = foa.field_of_anchors[:A, :]
+        # An anchor overlaps a gt box only if ax1 <= gx2 and ax2 >= gx1 (with
+        # the +1 convention). The (G, A) cell ranges are padded by one cell to
+        # be safe against rounding; the exact overlaps are computed for all
+        # anchors in the ranges.
+        cell_ranges = np.empty((num_gt, A, 4), dtype=np.int64)
+        for i, (gt_lo, gt_hi) in enumerate([(0, 2), (1, 3)]):
+            lo = np.floor(
+                (gt_boxes[:, gt_lo:gt_lo + 1] - cell_anchors[:, gt_hi] - 1) /
+                foa.stride
+            ) - 1
+            hi = np.ceil(
+                (gt_boxes[:, gt_hi:gt_hi + 1] - cell_anchors[:, gt_lo] + 1) /
+                foa.stride
+            ) + 1
+            cell_ranges[:, :, 2 * i] = np.maximum(lo, 0)
+            cell_ranges[:, :, 2 * i + 1] = np.minimum(hi, F - 1)
+        end_idx = start_idx + foa.field_of_anchors.shape[0]
+        fields.append((foa, cell_ranges, anchor_pos[start_idx:end_idx]))
+        start_idx = end_idx
+
+    # Per anchor: highest overlap, first gt box among ties
+    anchor_to_gt_argmax = np.zeros((num_inside, ), dtype=np.int64)
+    anchor_to_gt_max = np.zeros((num_inside, ), dtype=np.float32)
+    # Per gt box: highest overlap
+    gt_to_anchor_max = np.zeros((num_gt, ), dtype=np.float32)
+    for foa, cell_ranges, field_anchor_pos in fields:
+        cython_bbox.grid_bbox_overlaps_max(
+            foa.field_of_anchors, gt_boxes, cell_ranges, foa.field_size,
+            field_anchor_pos, anchor_to_gt_max, anchor_to_gt_argmax,
+            gt_to_anchor_max
+        )
+
+    if (gt_to_anchor_max == 0).any():
+        # A gt box that overlaps no anchor ties with all anchors (at 0)
+        anchors_with_max_overlap = np.arange(num_inside)
+    else:
+        anchor_is_max = np.zeros((num_inside, ), dtype=np.uint8)
+        for foa, cell_ranges, field_anchor_pos in fields:
+            cython_bbox.grid_bbox_overlaps_max(
+                foa.field_of_anchors, gt_boxes, cell_ranges, foa.field_size,
+                field_anchor_pos, anchor_to_gt_max, anchor_to_gt_argmax,
+                gt_to_anchor_max, anchor_is_max
+            )
+        anchors_with_max_overlap = np.where(anchor_is_max)[0]
+    return anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap
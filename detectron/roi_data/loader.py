@@ -33,6 +33,16 @@ minibatch queue, feeds the minibatch blobs into the workspace, and then runs
 an EnqueueBlobsOp to place the minibatch blobs into the GPU's blobs queue.
 During each fprop the first thing the network does is run a DequeueBlobsOp
 in order to populate the workspace with the blobs from a queued minibatch.
+
+When cfg.DATA_LOADER.USE_PROCESSES is set, the loader threads are replaced by
+loader processes. A single thread in the main process draws the roidb indices
+for each minibatch (so that all loaders share one permutation) and puts them
+onto an indices queue. The loader processes pull from that queue, construct
+the minibatches and put them onto a multiprocessing minibatch queue that is
+consumed by the enqueue threads as above. Unless disabled, the minibatch blobs
+are written into a slot of a preallocated shared memory pool and only the slot
+metadata goes through the minibatch queue; the enqueue thread feeds views of
+the slot to the workspace and then returns the slot to the pool.
 """
 
 from __future__ import absolute_import
@@ -41,8 +51,10 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from collections import deque
+from collections import namedtuple
 from collections import OrderedDict
 import logging
+import multiprocessing
 import numpy as np
 import Queue
 import signal
@@ -53,15 +65,22 @@ import uuid
 from caffe2.python import core, workspace
 
 from detectron.core.config import cfg
+from detectron.roi_data.minibatch import cache_fields_of_anchors
+from detectron.roi_data.minibatch import get_max_image_blob_bytes
 from detectron.roi_data.minibatch import get_minibatch
 from detectron.roi_data.minibatch import get_minibatch_blob_names
 from detectron.utils.coordinator import coordinated_get
 from detectron.utils.coordinator import coordinated_put
 from detectron.utils.coordinator import Coordinator
+from detectron.utils.shared_memory import SharedMemorySlotPool
+from detectron.utils.shared_memory import SlotWriter
 import detectron.utils.c2 as c2_utils
 
 logger = logging.getLogger(__name__)
 
+# A minibatch whose blobs are stored in a slot of the shared memory pool
+SlotBlobs = namedtuple('SlotBlobs', ['slot', 'metadata'])
+
 
 class RoIDataLoader(object):
     def __init__(
@@ -69,7 +88,10 @@ class RoIDataLoader(object):
         roidb,
         num_loaders=4,
         minibatch_queue_size=64,
-        blobs_queue_capacity=8
+        blobs_queue_capacity=8,
+        use_processes=False,
+        shared_memory_slots=0,
+        shared_memory_slot_mb=0
     ):
         self._roidb = roidb
         self._lock = threading.Lock()
@@ -79,7 +101,31 @@ class RoIDataLoader(object):
         # When training with N > 1 GPUs, each element in the minibatch queue
         # is actually a partial minibatch which contributes 1 / N of the
         # examples to the overall minibatch
-        self._minibatch_queue = Queue.Queue(maxsize=minibatch_queue_size)
+        self._minibatch_queue_size = minibatch_queue_size
+        self._use_processes = use_processes
+        if self._use_processes:
+            self._minibatch_queue = multiprocessing.Queue(
+                maxsize=minibatch_queue_size
+            )
+            # The indices queue feeds roidb indices drawn by the main process
+            # to the loader processes
+            self._inds_queue = multiprocessing.Queue(maxsize=num_loaders)
+            self.coordinator = Coordinator(multiprocessing.Event())
+        else:
+            self._minibatch_queue = Queue.Queue(maxsize=minibatch_queue_size)
+            self.coordinator = Coordinator()
+        # Shared memory slots holding the blobs of the minibatches built by
+        # the loader processes (must be allocated before they are forked)
+        self._slot_pool = None
+        if self._use_processes and shared_memory_slots > 0:
+            if shared_memory_slot_mb > 0:
+                slot_bytes = shared_memory_slot_mb * 1024 * 1024
+            else:
+                # Leave as much room for the other blobs as for the data blob
+                slot_bytes = 2 * get_max_image_blob_bytes()
+            self._slot_pool = SharedMemorySlotPool(
+                shared_memory_slots, slot_bytes
+            )
         self._blobs_queue_capacity = blobs_queue_capacity
         # Random queue name in case one instantiates multple RoIDataLoaders
         self._loader_id = uuid.uuid4()
@@ -88,7 +134,6 @@ class RoIDataLoader(object):
         # minibatch queue
         self._num_loaders = num_loaders
         self._num_gpus = cfg.NUM_GPUS
-        self.coordinator = Coordinator()
 
         self._output_names = get_minibatch_blob_names()
         self._shuffle_roidb_inds()
@@ -99,19 +144,75 @@ class RoIDataLoader(object):
         with self.coordinator.stop_on_exception():
             while not self.coordinator.should_stop():
                 blobs = self.get_next_minibatch()
-                # Blobs must be queued in the order specified by
-                # self.get_output_names
-                ordered_blobs = OrderedDict()
-                for key in self.get_output_names():
-                    assert blobs[key].dtype in (np.int32, np.float32), \
-                        'Blob {} of dtype {} must have dtype of ' \
-                        'np.int32 or np.float32'.format(key, blobs[key].dtype)
-                    ordered_blobs[key] = blobs[key]
                 coordinated_put(
-                    self.coordinator, self._minibatch_queue, ordered_blobs
+                    self.coordinator, self._minibatch_queue,
+                    self.get_ordered_blobs(blobs)
                 )
         logger.info('Stopping mini-batch loading thread')
 
+    def minibatch_inds_thread(self):
+        """Draw roidb indices and put them onto the indices queue that feeds
+        the loader processes."""
+        with self.coordinator.stop_on_exception():
+            while not self.coordinator.should_stop():
+                coordinated_put(
+                    self.coordinator, self._inds_queue,
+                    self._get_next_minibatch_inds()
+                )
+        logger.info('Stopping mini-batch indices thread')
+
+    def minibatch_loader_process(self, loader_id):
+        """Load mini-batches for the roidb indices on the indices queue and
+        put them onto the (multiprocessing) mini-batch queue."""
+        # The main process is responsible for handling SIGINT
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Forked processes inherit the RNG state of the main process; reseed so
+        # that each loader samples different scales and RoIs
+        np.random.seed(cfg.RNG_SEED + loader_id + 1)
+
+        def get_inds():
+            return coordinated_get(self.coordinator, self._inds_queue)
+
+        with self.coordinator.stop_on_exception():
+            while not self.coordinator.should_stop():
+                if self._slot_pool is None:
+                    blobs = self.get_ordered_blobs(
+                        self._get_minibatch(get_inds)
+                    )
+                else:
+                    blobs = self._get_minibatch_in_slot(get_inds)
+                coordinated_put(self.coordinator, self._minibatch_queue, blobs)
+        logger.info('Stopping mini-batch loading process')
+        # Don't block process exit on flushing mini-batches that will never be
+        # consumed
+        self._minibatch_queue.cancel_join_thread()
+
+    def _get_minibatch_in_slot(self, get_inds):
+        """Build the next minibatch in a free shared memory slot and return the
+        SlotBlobs describing it. The data blob is written directly into the
+        slot and the (much smaller) other blobs are copied after it. The blobs
+        are returned as an OrderedDict if they do not fit into a slot."""
+        slot = coordinated_get(self.coordinator, self._slot_pool.free_slots)
+        writer = SlotWriter(self._slot_pool, slot)
+        blobs = self.get_ordered_blobs(
+            self._get_minibatch(get_inds, slot_writer=writer)
+        )
+        arrays = blobs.values()
+        if writer.fits(arrays):
+            return SlotBlobs(slot, writer.write(arrays))
+        logger.warning(
+            'Mini-batch of {:.1f} MB does not fit into a shared memory slot '
+            'of {:.1f} MB (see DATA_LOADER.SHARED_MEMORY_SLOT_MB)'.format(
+                sum(a.nbytes for a in arrays) / 1024**2,
+                self._slot_pool.slot_bytes / 1024**2
+            )
+        )
+        # The blobs are pickled by the queue's feeder thread after the slot has
+        # been released, so they must not be views of the slot
+        blobs = OrderedDict((k, v.copy()) for k, v in blobs.items())
+        self._slot_pool.release(slot)
+        return blobs
+
     def enqueue_blobs_thread(self, gpu_id, blob_names):
         """Transfer mini-batches from a mini-batch queue to a BlobsQueue."""
         with self.coordinator.stop_on_exception():
@@ -119,7 +220,16 @@ class RoIDataLoader(object):
                 if self._minibatch_queue.qsize == 0:
                     logger.warning('Mini-batch queue is empty')
                 blobs = coordinated_get(self.coordinator, self._minibatch_queue)
-                self.enqueue_blobs(gpu_id, blob_names, blobs.values())
+                if isinstance(blobs, SlotBlobs):
+                    self.enqueue_blobs(
+                        gpu_id, blob_names,
+                        self._slot_pool.read(blobs.metadata)
+                    )
+                    # The blobs have been copied into the workspace, so the
+                    # slot can be reused
+                    self._slot_pool.release(blobs.slot)
+                else:
+                    self.enqueue_blobs(gpu_id, blob_names, blobs.values())
                 logger.debug(
                     'batch queue size {}'.format(self._minibatch_queue.qsize())
                 )
@@ -127,13 +237,37 @@ class RoIDataLoader(object):
 
     def get_next_minibatch(self):
         """Return the blobs to be used for the next minibatch. Thread safe."""
+        return self._get_minibatch(self._get_next_minibatch_inds)
+
+    def _get_minibatch(self, get_inds, slot_writer=None):
+        """Return the blobs for the first valid minibatch constructed from the
+        roidb indices returned by get_inds(). If a SlotWriter is given, the
+        data blob is allocated in its shared memory slot."""
         valid = False
         while not valid:
-            db_inds = self._get_next_minibatch_inds()
+            db_inds = get_inds()
             minibatch_db = [self._roidb[i] for i in db_inds]
-            blobs, valid = get_minibatch(minibatch_db)
+            if slot_writer is None:
+                blobs, valid = get_minibatch(minibatch_db)
+            else:
+                # Reuse the space of the blobs of an invalid minibatch
+                slot_writer.reset()
+                blobs, valid = get_minibatch(
+                    minibatch_db, zeros=slot_writer.zeros
+                )
         return blobs
 
+    def get_ordered_blobs(self, blobs):
+        """Return the minibatch blobs as an OrderedDict in the order specified
+        by self.get_output_names."""
+        ordered_blobs = OrderedDict()
+        for key in self.get_output_names():
+            assert blobs[key].dtype in (np.int32, np.float32), \
+                'Blob {} of dtype {} must have dtype of ' \
+                'np.int32 or np.float32'.format(key, blobs[key].dtype)
+            ordered_blobs[key] = blobs[key]
+        return ordered_blobs
+
     def _shuffle_roidb_inds(self):
         """Randomly permute the training roidb. Not thread safe."""
         if cfg.TRAIN.ASPECT_GROUPING:
@@ -203,12 +337,27 @@ class RoIDataLoader(object):
         )
 
     def create_threads(self):
-        # Create mini-batch loader threads, each of which builds mini-batches
-        # and places them into a queue in CPU memory
-        self._workers = [
-            threading.Thread(target=self.minibatch_loader_thread)
-            for _ in range(self._num_loaders)
-        ]
+        if self._use_processes:
+            # Create one thread that draws roidb indices and mini-batch loader
+            # processes, each of which builds mini-batches for those indices
+            # and places them into a queue in CPU memory
+            # The anchors are cached before forking, such that all processes
+            # share them
+            cache_fields_of_anchors()
+            self._workers = [
+                threading.Thread(target=self.minibatch_inds_thread)
+            ] + [
+                multiprocessing.Process(
+                    target=self.minibatch_loader_process, args=(loader_id, )
+                ) for loader_id in range(self._num_loaders)
+            ]
+        else:
+            # Create mini-batch loader threads, each of which builds
+            # mini-batches and places them into a queue in CPU memory
+            self._workers = [
+                threading.Thread(target=self.minibatch_loader_thread)
+                for _ in range(self._num_loaders)
+            ]
 
         # Create one BlobsQueue per GPU
         # (enqueue_blob_names are unscoped)
@@ -224,7 +373,7 @@ class RoIDataLoader(object):
 
     def start(self, prefill=False):
         for w in self._workers + self._enqueuers:
-            w.setDaemon(True)
+            w.daemon = True
             w.start()
         if prefill:
             logger.info('Pre-filling mini-batch queue...')
@@ -232,7 +381,7 @@ class RoIDataLoader(object):
                 logger.info(
                     '  [{:d}/{:d}]'.format(
                         self._minibatch_queue.qsize(),
-                        self._minibatch_queue.maxsize
+                        self._minibatch_queue_size
                     )
                 )
                 time.sleep(0.1)
@@ -248,6 +397,11 @@ class RoIDataLoader(object):
         self.coordinator.request_stop()
         self.coordinator.wait_for_stop()
         self.close_blobs_queues()
+        if self._use_processes:
+            # Don't block exit on flushing indices that will never be consumed
+            self._inds_queue.cancel_join_thread()
+            if self._slot_pool is not None:
+                self._slot_pool.free_slots.cancel_join_thread()
         for w in self._workers + self._enqueuers:
             w.join()
 
@@ -37,6 +37,7 @@ import detectron.roi_data.fast_rcnn as fast_rcnn_roi_data
 import detectron.roi_data.retinanet as retinanet_roi_data
 import detectron.roi_data.rpn as rpn_roi_data
 import detectron.utils.blob as blob_utils
+import detectron.utils.image_cache as image_cache
 
 logger = logging.getLogger(__name__)
 
@@ -61,13 +62,38 @@ def get_minibatch_blob_names(is_training=True):
     return blob_names
 
 
-def get_minibatch(roidb):
-    """Given a roidb, construct a minibatch sampled from it."""
+def get_max_image_blob_bytes():
+    """Return an upper bound on the size (in bytes) of the data blob of a
+    training minibatch: both sides of a resized image are at most
+    TRAIN.MAX_SIZE (before padding to FPN.COARSEST_STRIDE).
+    """
+    max_shape = blob_utils.get_max_shape(
+        [(cfg.TRAIN.MAX_SIZE, cfg.TRAIN.MAX_SIZE)]
+    )
+    return (
+        cfg.TRAIN.IMS_PER_BATCH * 3 * int(max_shape[0]) * int(max_shape[1]) *
+        np.dtype(np.float32).itemsize
+    )
+
+
+def cache_fields_of_anchors():
+    """Populate the process-wide cache of the anchors used for the training
+    targets (if any). When called before forking the loader processes, they
+    share the (read-only) cached anchors instead of each building a copy."""
+    if cfg.RPN.RPN_ON:
+        rpn_roi_data.get_rpn_fields_of_anchors()
+    elif cfg.RETINANET.RETINANET_ON:
+        retinanet_roi_data.get_retinanet_fields_of_anchors()
+
+
+def get_minibatch(roidb, zeros=np.zeros):
+    """Given a roidb, construct a minibatch sampled from it. The data blob is
+    allocated with zeros(shape, dtype) (see blob_utils.prep_ims_for_blob)."""
     # We collect blobs from each image onto a list and then concat them into a
     # single tensor, hence we initialize each blob to an empty list
     blobs = {k: [] for k in get_minibatch_blob_names()}
     # Get the input image blob, formatted for caffe2
-    im_blob, im_scales = _get_image_blob(roidb)
+    im_blob, im_scales = _get_image_blob(roidb, zeros)
     blobs['data'] = im_blob
     if cfg.RPN.RPN_ON:
         # RPN-only or end-to-end Faster/Mask R-CNN
@@ -86,7 +112,7 @@ def get_minibatch(roidb):
     return blobs, valid
 
 
-def _get_image_blob(roidb):
+def _get_image_blob(roidb, zeros):
     """Builds an input blob from the images in the roidb at the specified
     scales.
     """
@@ -95,22 +121,35 @@ def _get_image_blob(roidb):
     scale_inds = np.random.randint(
         0, high=len(cfg.TRAIN.SCALES), size=num_images
     )
-    processed_ims = []
+    ims = []
     im_scales = []
+    resize_scales = []
     for i in range(num_images):
-        im = cv2.imread(roidb[i]['image'])
-        assert im is not None, \
-            'Failed to read image \'{}\''.format(roidb[i]['image'])
+        target_size = cfg.TRAIN.SCALES[scale_inds[i]]
+        if cfg.TRAIN.IMAGE_CACHE_DIR:
+            # The cached image is already resized
+            im, im_scale = image_cache.get_resized_image(
+                cfg.TRAIN.IMAGE_CACHE_DIR, roidb[i]['image'],
+                (roidb[i]['height'], roidb[i]['width']), target_size,
+                cfg.TRAIN.MAX_SIZE
+            )
+            resize_scales.append(1.0)
+        else:
+            im = cv2.imread(roidb[i]['image'])
+            assert im is not None, \
+                'Failed to read image \'{}\''.format(roidb[i]['image'])
+            im_scale = blob_utils.get_im_scale(
+                im.shape, target_size, cfg.TRAIN.MAX_SIZE
+            )
+            resize_scales.append(im_scale)
         if roidb[i]['flipped']:
             im = im[:, ::-1, :]
-        target_size = cfg.TRAIN.SCALES[scale_inds[i]]
-        im, im_scale = blob_utils.prep_im_for_blob(
-            im, cfg.PIXEL_MEANS, target_size, cfg.TRAIN.MAX_SIZE
-        )
+        ims.append(im)
         im_scales.append(im_scale)
-        processed_ims.append(im)
 
     # Create a blob to hold the input images
-    blob = blob_utils.im_list_to_blob(processed_ims)
+    blob = blob_utils.prep_ims_for_blob(
+        ims, cfg.PIXEL_MEANS, resize_scales, zeros=zeros
+    )
 
     return blob, im_scales
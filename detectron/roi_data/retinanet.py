@@ -23,7 +23,6 @@ from __future__ import unicode_literals
 import numpy as np
 import logging
 
-import detectron.utils.boxes as box_utils
 import detectron.roi_data.data_utils as data_utils
 from detectron.core.config import cfg
 
@@ -75,8 +74,9 @@ def get_retinanet_blob_names(is_training=True):
     return blob_names
 
 
-def add_retinanet_blobs(blobs, im_scales, roidb, image_width, image_height):
-    """Add RetinaNet blobs."""
+def get_retinanet_fields_of_anchors():
+    """Return the (cached) fields of anchors used for the RetinaNet targets and
+    all of their anchors concatenated."""
     # RetinaNet is applied to many feature levels, as in the FPN paper
     k_max, k_min = cfg.FPN.RPN_MAX_LEVEL, cfg.FPN.RPN_MIN_LEVEL
     scales_per_octave = cfg.RETINANET.SCALES_PER_OCTAVE
@@ -85,7 +85,7 @@ def add_retinanet_blobs(blobs, im_scales, roidb, image_width, image_height):
     anchor_scale = cfg.RETINANET.ANCHOR_SCALE
 
     # get anchors from all levels for all scales/aspect ratios
-    foas = []
+    foa_params = []
     for lvl in range(k_min, k_max + 1):
         stride = 2. ** lvl
         for octave in range(scales_per_octave):
@@ -93,10 +93,15 @@ def add_retinanet_blobs(blobs, im_scales, roidb, image_width, image_height):
             for idx in range(num_aspect_ratios):
                 anchor_sizes = (stride * octave_scale * anchor_scale, )
                 anchor_aspect_ratios = (aspect_ratios[idx], )
-                foa = data_utils.get_field_of_anchors(
-                    stride, anchor_sizes, anchor_aspect_ratios, octave, idx)
-                foas.append(foa)
-    all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+                foa_params.append(
+                    (stride, anchor_sizes, anchor_aspect_ratios, octave, idx))
+    return data_utils.get_fields_of_anchors(foa_params)
+
+
+def add_retinanet_blobs(blobs, im_scales, roidb, image_width, image_height):
+    """Add RetinaNet blobs."""
+    num_aspect_ratios = len(cfg.RETINANET.ASPECT_RATIOS)
+    foas, all_anchors = get_retinanet_fields_of_anchors()
 
     blobs['retnet_fg_num'], blobs['retnet_bg_num'] = 0.0, 0.0
     for im_i, entry in enumerate(roidb):
@@ -198,23 +203,14 @@ def _get_retinanet_blobs(
     labels = np.empty((num_inside, ), dtype=np.float32)
     labels.fill(-1)
     if len(gt_boxes) > 0:
-        # Compute overlaps between the anchors and the gt boxes overlaps
-        anchor_by_gt_overlap = box_utils.bbox_overlaps(anchors, gt_boxes)
-        # Map from anchor to gt box that has highest overlap
-        anchor_to_gt_argmax = anchor_by_gt_overlap.argmax(axis=1)
-        # For each anchor, amount of overlap with most overlapping gt box
-        anchor_to_gt_max = anchor_by_gt_overlap[
-            np.arange(num_inside), anchor_to_gt_argmax]
-
-        # Map from gt box to an anchor that has highest overlap
-        gt_to_anchor_argmax = anchor_by_gt_overlap.argmax(axis=0)
-        # For each gt box, amount of overlap with most overlapping anchor
-        gt_to_anchor_max = anchor_by_gt_overlap[
-            gt_to_anchor_argmax, np.arange(anchor_by_gt_overlap.shape[1])]
-        # Find all anchors that share the max overlap amount
-        # (this includes many ties)
-        anchors_with_max_overlap = np.where(
-            anchor_by_gt_overlap == gt_to_anchor_max)[0]
+        # Match the anchors to the gt boxes, only computing the overlaps of the
+        # anchors near each gt box (equivalent to the dense overlaps):
+        #   - map from anchor to gt box that has highest overlap
+        #   - for each anchor, amount of overlap with most overlapping gt box
+        #   - all anchors that share the max overlap amount of some gt box
+        #     (this includes many ties)
+        anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap = \
+            data_utils.match_anchors_to_gt_boxes(foas, gt_boxes)
 
         # Fg label: for each gt use anchors with highest overlap
         # (including ties)
@@ -26,8 +26,7 @@ import numpy.random as npr
 
 from detectron.core.config import cfg
 import detectron.roi_data.data_utils as data_utils
-import detectron.utils.blob as blob_utils
-import detectron.utils.boxes as box_utils
+import detectron.utils.roidb_blob as roidb_blob_utils
 
 logger = logging.getLogger(__name__)
 
@@ -59,27 +58,31 @@ def get_rpn_blob_names(is_training=True):
     return blob_names
 
 
-def add_rpn_blobs(blobs, im_scales, roidb):
-    """Add blobs needed training RPN-only and end-to-end Faster R-CNN models."""
+def get_rpn_fields_of_anchors():
+    """Return the (cached) fields of anchors used for the RPN targets and all
+    of their anchors concatenated."""
     if cfg.FPN.FPN_ON and cfg.FPN.MULTILEVEL_RPN:
         # RPN applied to many feature levels, as in the FPN paper
         k_max = cfg.FPN.RPN_MAX_LEVEL
         k_min = cfg.FPN.RPN_MIN_LEVEL
-        foas = []
+        foa_params = []
         for lvl in range(k_min, k_max + 1):
             field_stride = 2.**lvl
             anchor_sizes = (cfg.FPN.RPN_ANCHOR_START_SIZE * 2.**(lvl - k_min), )
             anchor_aspect_ratios = cfg.FPN.RPN_ASPECT_RATIOS
-            foa = data_utils.get_field_of_anchors(
-                field_stride, anchor_sizes, anchor_aspect_ratios
+            foa_params.append(
+                (field_stride, anchor_sizes, anchor_aspect_ratios, None, None)
             )
-            foas.append(foa)
-        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
     else:
-        foa = data_utils.get_field_of_anchors(
-            cfg.RPN.STRIDE, cfg.RPN.SIZES, cfg.RPN.ASPECT_RATIOS
-        )
-        all_anchors = foa.field_of_anchors
+        foa_params = [
+            (cfg.RPN.STRIDE, cfg.RPN.SIZES, cfg.RPN.ASPECT_RATIOS, None, None)
+        ]
+    return data_utils.get_fields_of_anchors(foa_params)
+
+
+def add_rpn_blobs(blobs, im_scales, roidb):
+    """Add blobs needed training RPN-only and end-to-end Faster R-CNN models."""
+    foas, all_anchors = get_rpn_fields_of_anchors()
 
     for im_i, entry in enumerate(roidb):
         scale = im_scales[im_i]
@@ -98,13 +101,15 @@ def add_rpn_blobs(blobs, im_scales, roidb):
             rpn_blobs = _get_rpn_blobs(
                 im_height, im_width, foas, all_anchors, gt_rois
             )
-            for i, lvl in enumerate(range(k_min, k_max + 1)):
+            for i, lvl in enumerate(
+                range(cfg.FPN.RPN_MIN_LEVEL, cfg.FPN.RPN_MAX_LEVEL + 1)
+            ):
                 for k, v in rpn_blobs[i].items():
                     blobs[k + '_fpn' + str(lvl)].append(v)
         else:
             # Classical RPN, applied to a single feature level
             rpn_blobs = _get_rpn_blobs(
-                im_height, im_width, [foa], all_anchors, gt_rois
+                im_height, im_width, foas, all_anchors, gt_rois
             )
             for k, v in rpn_blobs.items():
                 blobs[k].append(v)
@@ -122,7 +127,7 @@ def add_rpn_blobs(blobs, im_scales, roidb):
         for k in valid_keys:
             if k in e:
                 minimal_roidb[i][k] = e[k]
-    blobs['roidb'] = blob_utils.serialize(minimal_roidb)
+    blobs['roidb'] = roidb_blob_utils.serialize(minimal_roidb)
 
     # Always return valid=True, since RPN minibatches are valid by design
     return True
@@ -136,48 +141,29 @@ def _get_rpn_blobs(im_height, im_width, foas, all_anchors, gt_boxes):
         # Only keep anchors inside the image by a margin of straddle_thresh
         # Set TRAIN.RPN_STRADDLE_THRESH to -1 (or a large value) to keep all
         # anchors
-        inds_inside = np.where(
-            (all_anchors[:, 0] >= -straddle_thresh) &
-            (all_anchors[:, 1] >= -straddle_thresh) &
-            (all_anchors[:, 2] < im_width + straddle_thresh) &
-            (all_anchors[:, 3] < im_height + straddle_thresh)
-        )[0]
-        # keep only inside anchors
-        anchors = all_anchors[inds_inside, :]
+        inds_inside = data_utils.get_inds_inside(
+            foas, im_height, im_width, straddle_thresh
+        )
     else:
         inds_inside = np.arange(all_anchors.shape[0])
-        anchors = all_anchors
     num_inside = len(inds_inside)
 
     logger.debug('total_anchors: {}'.format(total_anchors))
     logger.debug('inds_inside: {}'.format(num_inside))
-    logger.debug('anchors.shape: {}'.format(anchors.shape))
 
     # Compute anchor labels:
     # label=1 is positive, 0 is negative, -1 is don't care (ignore)
     labels = np.empty((num_inside, ), dtype=np.int32)
     labels.fill(-1)
     if len(gt_boxes) > 0:
-        # Compute overlaps between the anchors and the gt boxes overlaps
-        anchor_by_gt_overlap = box_utils.bbox_overlaps(anchors, gt_boxes)
-        # Map from anchor to gt box that has highest overlap
-        anchor_to_gt_argmax = anchor_by_gt_overlap.argmax(axis=1)
-        # For each anchor, amount of overlap with most overlapping gt box
-        anchor_to_gt_max = anchor_by_gt_overlap[np.arange(num_inside),
-                                                anchor_to_gt_argmax]
-
-        # Map from gt box to an anchor that has highest overlap
-        gt_to_anchor_argmax = anchor_by_gt_overlap.argmax(axis=0)
-        # For each gt box, amount of overlap with most overlapping anchor
-        gt_to_anchor_max = anchor_by_gt_overlap[
-            gt_to_anchor_argmax,
-            np.arange(anchor_by_gt_overlap.shape[1])
-        ]
-        # Find all anchors that share the max overlap amount
-        # (this includes many ties)
-        anchors_with_max_overlap = np.where(
-            anchor_by_gt_overlap == gt_to_anchor_max
-        )[0]
+        # Match the anchors to the gt boxes, only computing the overlaps of the
+        # anchors near each gt box (equivalent to the dense overlaps):
+        #   - map from anchor to gt box that has highest overlap
+        #   - for each anchor, amount of overlap with most overlapping gt box
+        #   - all anchors that share the max overlap amount of some gt box
+        #     (this includes many ties)
+        anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap = \
+            data_utils.match_anchors_to_gt_boxes(foas, gt_boxes, inds_inside)
 
         # Fg label: for each gt use anchors with highest overlap
         # (including ties)
@@ -210,7 +196,8 @@ def _get_rpn_blobs(im_height, im_width, foas, all_anchors, gt_boxes):
 
     bbox_targets = np.zeros((num_inside, 4), dtype=np.float32)
     bbox_targets[fg_inds, :] = data_utils.compute_targets(
-        anchors[fg_inds, :], gt_boxes[anchor_to_gt_argmax[fg_inds], :]
+        all_anchors[inds_inside[fg_inds], :],
+        gt_boxes[anchor_to_gt_argmax[fg_inds], :]
     )
 
     # Bbox regression loss has the form:
@@ -97,7 +97,10 @@ def main(opts):
         roidb,
         num_loaders=cfg.DATA_LOADER.NUM_THREADS,
         minibatch_queue_size=cfg.DATA_LOADER.MINIBATCH_QUEUE_SIZE,
-        blobs_queue_capacity=cfg.DATA_LOADER.BLOBS_QUEUE_CAPACITY
+        blobs_queue_capacity=cfg.DATA_LOADER.BLOBS_QUEUE_CAPACITY,
+        use_processes=cfg.DATA_LOADER.USE_PROCESSES,
+        shared_memory_slots=cfg.DATA_LOADER.SHARED_MEMORY_SLOTS,
+        shared_memory_slot_mb=cfg.DATA_LOADER.SHARED_MEMORY_SLOT_MB
     )
     blob_names = roi_data_loader.get_output_names()
 
@@ -0,0 +1,175 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import threading
+import unittest
+
+from detectron.core.config import cfg
+import detectron.roi_data.data_utils as data_utils
+import detectron.utils.boxes as box_utils
+
+
+def reference_match(anchors, gt_boxes):
+    """The original dense matching of _get_rpn_blobs and
+    _get_retinanet_blobs."""
+    anchor_by_gt_overlap = box_utils.bbox_overlaps(anchors, gt_boxes)
+    anchor_to_gt_argmax = anchor_by_gt_overlap.argmax(axis=1)
+    anchor_to_gt_max = anchor_by_gt_overlap[
+        np.arange(len(anchors)), anchor_to_gt_argmax]
+    gt_to_anchor_argmax = anchor_by_gt_overlap.argmax(axis=0)
+    gt_to_anchor_max = anchor_by_gt_overlap[
+        gt_to_anchor_argmax, np.arange(anchor_by_gt_overlap.shape[1])]
+    anchors_with_max_overlap = np.where(
+        anchor_by_gt_overlap == gt_to_anchor_max)[0]
+    return anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap
+
+
+def random_gt_boxes(rng, num_boxes, size):
+    xy = rng.rand(num_boxes, 2) * size
+    wh = rng.rand(num_boxes, 2) * size / 2 + 1
+    boxes = np.hstack((xy, xy + wh))
+    # Boxes aligned with the anchor grid produce exact ties
+    boxes[::4] = np.round(boxes[::4] / 16) * 16
+    boxes[::4, 2:] += 15
+    return boxes.astype(np.float32)
+
+
+class TestAnchorMatching(unittest.TestCase):
+    def setUp(self):
+        self._old_max_size = cfg.TRAIN.MAX_SIZE
+        cfg.TRAIN.MAX_SIZE = 256
+
+    def tearDown(self):
+        cfg.TRAIN.MAX_SIZE = self._old_max_size
+
+    def _test_equivalence(self, foas, gt_boxes, inds_inside=None):
+        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+        anchors = all_anchors
+        if inds_inside is not None:
+            anchors = all_anchors[inds_inside]
+        argmax, max_overlap, with_max_overlap = \
+            data_utils.match_anchors_to_gt_boxes(foas, gt_boxes, inds_inside)
+        ref_argmax, ref_max_overlap, ref_with_max_overlap = reference_match(
+            anchors, gt_boxes
+        )
+        np.testing.assert_array_equal(argmax, ref_argmax)
+        np.testing.assert_array_equal(max_overlap, ref_max_overlap)
+        np.testing.assert_array_equal(
+            with_max_overlap, np.unique(ref_with_max_overlap)
+        )
+
+    def test_single_level(self):
+        rng = np.random.RandomState(0)
+        foas = [
+            data_utils.get_field_of_anchors(
+                16, (32, 64, 128, 256, 512), (0.5, 1, 2)
+            )
+        ]
+        self._test_equivalence(foas, random_gt_boxes(rng, 20, 256))
+
+    def test_fpn_levels_inside(self):
+        rng = np.random.RandomState(1)
+        foas = [
+            data_utils.get_field_of_anchors(2.**lvl, (32 * 2**i, ), (0.5, 1, 2))
+            for i, lvl in enumerate(range(2, 7))
+        ]
+        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+        inds_inside = np.where(
+            (all_anchors[:, 0] >= 0) & (all_anchors[:, 1] >= 0) &
+            (all_anchors[:, 2] < 200) & (all_anchors[:, 3] < 180)
+        )[0]
+        gt_boxes = random_gt_boxes(rng, 10, 180)
+        self._test_equivalence(foas, gt_boxes, inds_inside)
+
+    def test_gt_box_without_overlap(self):
+        rng = np.random.RandomState(2)
+        foas = [data_utils.get_field_of_anchors(16, (32, ), (1, ))]
+        gt_boxes = random_gt_boxes(rng, 5, 200)
+        # A gt box outside of the field of anchors
+        gt_boxes[2] = [1000, 1000, 1010, 1010]
+        self._test_equivalence(foas, gt_boxes)
+
+
+class TestFieldsOfAnchors(unittest.TestCase):
+    def setUp(self):
+        self._old_max_size = cfg.TRAIN.MAX_SIZE
+        cfg.TRAIN.MAX_SIZE = 256
+
+    def tearDown(self):
+        cfg.TRAIN.MAX_SIZE = self._old_max_size
+
+    def _fpn_params(self):
+        return [
+            (2.**lvl, (32 * 2**i, ), (0.5, 1, 2), None, None)
+            for i, lvl in enumerate(range(2, 7))
+        ]
+
+    def test_shared_cache(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    data_utils.get_fields_of_anchors(self._fpn_params())
+                )
+            ) for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        foas, all_anchors = results[0]
+        for other_foas, other_all_anchors in results[1:]:
+            self.assertIs(other_all_anchors, all_anchors)
+        self.assertFalse(all_anchors.flags.writeable)
+        start_idx = 0
+        for foa, params in zip(foas, self._fpn_params()):
+            np.testing.assert_array_equal(
+                foa.field_of_anchors,
+                all_anchors[start_idx:start_idx + len(foa.field_of_anchors)]
+            )
+            # Same anchors as a separately built field
+            np.testing.assert_array_equal(
+                foa.field_of_anchors,
+                data_utils.get_field_of_anchors(*params).field_of_anchors
+            )
+            start_idx += len(foa.field_of_anchors)
+        self.assertEqual(start_idx, len(all_anchors))
+
+    def test_inds_inside(self):
+        foas, all_anchors = data_utils.get_fields_of_anchors(self._fpn_params())
+        for im_height, im_width, straddle_thresh in [
+            (256, 256, 0), (180, 200, 0), (100, 255, 10), (1, 1, 0)
+        ]:
+            inds_inside = data_utils.get_inds_inside(
+                foas, im_height, im_width, straddle_thresh
+            )
+            ref_inds_inside = np.where(
+                (all_anchors[:, 0] >= -straddle_thresh) &
+                (all_anchors[:, 1] >= -straddle_thresh) &
+                (all_anchors[:, 2] < im_width + straddle_thresh) &
+                (all_anchors[:, 3] < im_height + straddle_thresh)
+            )[0]
+            np.testing.assert_array_equal(inds_inside, ref_inds_inside)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+from detectron.core.test_engine import _get_inference_batches
+from detectron.ops.collect_and_distribute_fpn_rpn_proposals import collect
+import detectron.utils.blob as blob_utils
+
+
+class Blob(object):
+    def __init__(self, data):
+        self.data = data
+
+
+class TestBatchedInference(unittest.TestCase):
+    def test_image_batch_blob(self):
+        rng = np.random.RandomState(0)
+        ims = [
+            rng.randint(0, 256, size=shape).astype(np.uint8)
+            for shape in [(480, 640, 3), (427, 640, 3), (500, 333, 3)]
+        ]
+        blob, im_scales, im_info = blob_utils.get_image_batch_blob(
+            ims, 600, 1000
+        )
+        self.assertEqual(blob.shape[0], len(ims))
+        for i, im in enumerate(ims):
+            im_blob, im_scale, im_im_info = blob_utils.get_image_blob(
+                im, 600, 1000
+            )
+            self.assertEqual(im_scales[i], im_scale)
+            np.testing.assert_array_equal(im_info[i:i + 1], im_im_info)
+            h, w = im_blob.shape[2:]
+            np.testing.assert_array_equal(blob[i, :, :h, :w], im_blob[0])
+
+    def test_image_batch_blob_padding(self):
+        # The im_info of each image holds the size of its own padded blob,
+        # which RetinaNet crops the outputs of a batch to
+        old_fpn_cfg = (cfg.FPN.FPN_ON, cfg.FPN.COARSEST_STRIDE)
+        cfg.FPN.FPN_ON = True
+        cfg.FPN.COARSEST_STRIDE = 128
+        try:
+            ims = [
+                np.zeros((800, 1200, 3), dtype=np.uint8),
+                np.zeros((1200, 800, 3), dtype=np.uint8),
+            ]
+            blob, _, im_info = blob_utils.get_image_batch_blob(ims, 800, 1333)
+        finally:
+            cfg.FPN.FPN_ON, cfg.FPN.COARSEST_STRIDE = old_fpn_cfg
+        np.testing.assert_array_equal(
+            im_info[:, :2], [[896, 1280], [1280, 896]]
+        )
+        self.assertEqual(blob.shape[2:], (1280, 1280))
+
+    def test_collect_top_n_per_image(self):
+        rng = np.random.RandomState(0)
+        num_lvls = cfg.FPN.RPN_MAX_LEVEL - cfg.FPN.RPN_MIN_LEVEL + 1
+        roi_inputs, score_inputs = [], []
+        for _ in range(num_lvls):
+            n = rng.randint(20, 50)
+            rois = np.zeros((n, 5), dtype=np.float32)
+            rois[:, 0] = rng.randint(0, 3, size=n)
+            rois[:, 1:] = rng.rand(n, 4) * 100
+            roi_inputs.append(Blob(rois))
+            score_inputs.append(Blob(rng.rand(n, 1).astype(np.float32)))
+        all_rois = np.concatenate([b.data for b in roi_inputs])
+        all_scores = np.concatenate([b.data for b in score_inputs])[:, 0]
+        old_post_nms_top_n = cfg.TEST.RPN_POST_NMS_TOP_N
+        cfg.TEST.RPN_POST_NMS_TOP_N = 15
+        try:
+            rois = collect(roi_inputs + score_inputs, False)
+        finally:
+            cfg.TEST.RPN_POST_NMS_TOP_N = old_post_nms_top_n
+        # Grouped by image
+        np.testing.assert_array_equal(rois[:, 0], np.sort(rois[:, 0]))
+        for i in range(3):
+            im_inds = np.where(all_rois[:, 0] == i)[0]
+            im_inds = im_inds[np.argsort(-all_scores[im_inds])][:15]
+            np.testing.assert_array_equal(
+                rois[rois[:, 0] == i], all_rois[im_inds]
+            )
+
+    def test_inference_batches(self):
+        roidb = [
+            {'width': w, 'height': h}
+            for w, h in [(640, 480), (333, 500), (640, 427), (500, 500)]
+        ]
+        self.assertEqual(
+            _get_inference_batches(roidb, 1, range(4)), [[0], [1], [2], [3]]
+        )
+        self.assertEqual(
+            _get_inference_batches(roidb, 3, range(4)), [[1, 3, 0], [2]]
+        )
+        self.assertEqual(
+            _get_inference_batches(roidb, 2, [2, 3, 1]), [[1, 3], [2]]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
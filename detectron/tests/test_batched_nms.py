@@ -0,0 +1,226 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+from detectron.core.test import box_results_with_nms_and_limit
+import detectron.utils.boxes as box_utils
+import detectron.utils.cython_nms as cython_nms
+
+
+def random_boxes(rng, num_boxes, num_classes):
+    xy = rng.rand(num_boxes, 2 * num_classes) * 200
+    wh = rng.rand(num_boxes, 2 * num_classes) * 100
+    boxes = np.empty((num_boxes, 4 * num_classes), dtype=np.float32)
+    boxes[:, 0::4] = xy[:, 0::2]
+    boxes[:, 1::4] = xy[:, 1::2]
+    boxes[:, 2::4] = xy[:, 0::2] + wh[:, 0::2]
+    boxes[:, 3::4] = xy[:, 1::2] + wh[:, 1::2]
+    return boxes
+
+
+def reference_box_results_with_nms_and_limit(scores, boxes):
+    """The original implementation of box_results_with_nms_and_limit, which
+    processes one class at a time."""
+    num_classes = cfg.MODEL.NUM_CLASSES
+    cls_boxes = [[] for _ in range(num_classes)]
+    for j in range(1, num_classes):
+        inds = np.where(scores[:, j] > cfg.TEST.SCORE_THRESH)[0]
+        scores_j = scores[inds, j]
+        boxes_j = boxes[inds, j * 4:(j + 1) * 4]
+        dets_j = np.hstack((boxes_j, scores_j[:, np.newaxis])).astype(
+            np.float32, copy=False
+        )
+        if cfg.TEST.SOFT_NMS.ENABLED:
+            nms_dets, _ = box_utils.soft_nms(
+                dets_j,
+                sigma=cfg.TEST.SOFT_NMS.SIGMA,
+                overlap_thresh=cfg.TEST.NMS,
+                score_thresh=0.0001,
+                method=cfg.TEST.SOFT_NMS.METHOD
+            )
+        else:
+            keep = box_utils.nms(dets_j, cfg.TEST.NMS)
+            nms_dets = dets_j[keep, :]
+        if cfg.TEST.BBOX_VOTE.ENABLED:
+            nms_dets = box_utils.box_voting(
+                nms_dets,
+                dets_j,
+                cfg.TEST.BBOX_VOTE.VOTE_TH,
+                scoring_method=cfg.TEST.BBOX_VOTE.SCORING_METHOD
+            )
+        cls_boxes[j] = nms_dets
+    if cfg.TEST.DETECTIONS_PER_IM > 0:
+        image_scores = np.hstack(
+            [cls_boxes[j][:, -1] for j in range(1, num_classes)]
+        )
+        if len(image_scores) > cfg.TEST.DETECTIONS_PER_IM:
+            image_thresh = np.sort(image_scores)[-cfg.TEST.DETECTIONS_PER_IM]
+            for j in range(1, num_classes):
+                keep = np.where(cls_boxes[j][:, -1] >= image_thresh)[0]
+                cls_boxes[j] = cls_boxes[j][keep, :]
+    im_results = np.vstack([cls_boxes[j] for j in range(1, num_classes)])
+    boxes = im_results[:, :-1]
+    scores = im_results[:, -1]
+    return scores, boxes, cls_boxes
+
+
+class TestBatchedNMS(unittest.TestCase):
+    def test_batched_nms(self):
+        rng = np.random.RandomState(0)
+        set_sizes = [0, 1, 30, 0, 200, 7]
+        boxes = random_boxes(rng, sum(set_sizes), 1)
+        dets = np.hstack(
+            (boxes, rng.rand(len(boxes), 1).astype(np.float32))
+        )
+        set_offsets = np.cumsum([0] + set_sizes)
+        ref_keeps = [
+            np.array(box_utils.nms(dets[start:end], 0.5), dtype=np.int64)
+            for start, end in zip(set_offsets[:-1], set_offsets[1:])
+        ]
+        keep = box_utils.batched_nms(dets, set_offsets, 0.5)
+        ref_keep = np.hstack(
+            [k + start for k, start in zip(ref_keeps, set_offsets)]
+        )
+        np.testing.assert_array_equal(keep, ref_keep)
+        for num_threads in [1, 4]:
+            keep = cython_nms.batched_nms(
+                dets, set_offsets.astype(np.int64), 0.5, num_threads
+            )
+            np.testing.assert_array_equal(keep, ref_keep)
+        keeps = box_utils.nms_per_set(dets, set_offsets, 0.5)
+        self.assertEqual(len(keeps), len(set_sizes))
+        for keep, ref_keep in zip(keeps, ref_keeps):
+            np.testing.assert_array_equal(keep, ref_keep)
+        self.assertEqual(len(box_utils.batched_nms(dets[:0], [0, 0], 0.5)), 0)
+
+    def test_batched_nms_tied_scores(self):
+        rng = np.random.RandomState(0)
+        set_sizes = [40, 0, 300, 1, 129]
+        set_offsets = np.cumsum([0] + set_sizes).astype(np.int64)
+        boxes = random_boxes(rng, sum(set_sizes), 1)
+        # Saturated scores, and scores with few distinct values
+        for scores in [
+            np.ones(len(boxes), dtype=np.float32),
+            rng.choice([0.25, 0.5, 1.0], size=len(boxes)),
+            np.round(rng.rand(len(boxes)), 1),
+        ]:
+            dets = np.hstack(
+                (boxes, scores[:, np.newaxis].astype(np.float32))
+            )
+            ref_keep = np.hstack([
+                np.array(box_utils.nms(dets[start:end], 0.5), dtype=np.int64)
+                + start
+                for start, end in zip(set_offsets[:-1], set_offsets[1:])
+            ])
+            for bitmask in [False, True]:
+                keep = cython_nms.batched_nms(
+                    dets, set_offsets, 0.5, bitmask=bitmask
+                )
+                np.testing.assert_array_equal(keep, ref_keep)
+
+    def test_bitmask_nms(self):
+        rng = np.random.RandomState(0)
+        # Sets spanning several 64 box tiles, with many overlapping boxes
+        set_sizes = [300, 0, 64, 65, 1, 1000]
+        boxes = random_boxes(rng, sum(set_sizes), 1)
+        dets = np.hstack(
+            (boxes, rng.rand(len(boxes), 1).astype(np.float32))
+        )
+        set_offsets = np.cumsum([0] + set_sizes).astype(np.int64)
+        for max_keep in [-1, 1, 50, 2000]:
+            ref_keep = cython_nms.batched_nms(
+                dets, set_offsets, 0.3, max_keep=max_keep
+            )
+            keep = cython_nms.batched_nms(
+                dets, set_offsets, 0.3, max_keep=max_keep, bitmask=True
+            )
+            np.testing.assert_array_equal(keep, ref_keep)
+        # max_keep keeps the highest scoring boxes kept by NMS
+        start, end = set_offsets[-2:]
+        order = np.argsort(-dets[start:end, 4])
+        sorted_dets = dets[start:end][order]
+        ref_keep = box_utils.nms(sorted_dets, 0.3)[:50]
+        for kernel in ['greedy', 'bitmask']:
+            old_kernel = cfg.NMS_KERNEL
+            cfg.NMS_KERNEL = kernel
+            try:
+                np.testing.assert_array_equal(
+                    box_utils.nms(sorted_dets, 0.3)[:50], ref_keep
+                )
+                keep = box_utils.nms_per_set(
+                    sorted_dets, [0, len(sorted_dets)], 0.3, max_keep=50
+                )[0]
+            finally:
+                cfg.NMS_KERNEL = old_kernel
+            np.testing.assert_array_equal(keep, ref_keep)
+
+    def _test_box_results(self, soft_nms=False, bbox_vote=False, **test_cfg):
+        rng = np.random.RandomState(0)
+        num_boxes, num_classes = 300, 21
+        scores = rng.rand(num_boxes, num_classes).astype(np.float32) ** 4
+        boxes = random_boxes(rng, num_boxes, num_classes)
+        old_num_classes = cfg.MODEL.NUM_CLASSES
+        old_test_cfg = {k: cfg.TEST[k] for k in test_cfg}
+        old_soft_nms_cfg = dict(cfg.TEST.SOFT_NMS)
+        old_bbox_vote_cfg = dict(cfg.TEST.BBOX_VOTE)
+        cfg.MODEL.NUM_CLASSES = num_classes
+        cfg.TEST.update(test_cfg)
+        cfg.TEST.SOFT_NMS.update(ENABLED=soft_nms, METHOD='linear')
+        cfg.TEST.BBOX_VOTE.update(ENABLED=bbox_vote, SCORING_METHOD='ID')
+        try:
+            ref_scores, ref_boxes, ref_cls_boxes = \
+                reference_box_results_with_nms_and_limit(scores, boxes)
+            scores, boxes, cls_boxes = box_results_with_nms_and_limit(
+                scores, boxes
+            )
+        finally:
+            cfg.MODEL.NUM_CLASSES = old_num_classes
+            cfg.TEST.update(old_test_cfg)
+            cfg.TEST.SOFT_NMS.update(old_soft_nms_cfg)
+            cfg.TEST.BBOX_VOTE.update(old_bbox_vote_cfg)
+        np.testing.assert_array_equal(scores, ref_scores)
+        np.testing.assert_array_equal(boxes, ref_boxes)
+        self.assertEqual(len(cls_boxes), len(ref_cls_boxes))
+        self.assertEqual(cls_boxes[0], [])
+        for j in range(1, num_classes):
+            self.assertEqual(cls_boxes[j].dtype, ref_cls_boxes[j].dtype)
+            np.testing.assert_array_equal(cls_boxes[j], ref_cls_boxes[j])
+
+    def test_box_results(self):
+        self._test_box_results(DETECTIONS_PER_IM=100)
+
+    def test_box_results_no_limit(self):
+        self._test_box_results(DETECTIONS_PER_IM=0)
+
+    def test_box_results_nothing_above_thresh(self):
+        self._test_box_results(SCORE_THRESH=1.0)
+
+    def test_box_results_soft_nms(self):
+        self._test_box_results(soft_nms=True, DETECTIONS_PER_IM=100)
+
+    def test_box_results_bbox_vote(self):
+        self._test_box_results(bbox_vote=True, DETECTIONS_PER_IM=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+import detectron.utils.boxes as box_utils
+
+
+def reference_box_voting(
+    top_dets, all_dets, thresh, scoring_method='ID', beta=1.0
+):
+    """The original box_voting, which votes for one top det at a time."""
+    top_dets_out = top_dets.copy()
+    top_boxes = top_dets[:, :4]
+    all_boxes = all_dets[:, :4]
+    all_scores = all_dets[:, 4]
+    top_to_all_overlaps = box_utils.bbox_overlaps(top_boxes, all_boxes)
+    for k in range(top_dets_out.shape[0]):
+        inds_to_vote = np.where(top_to_all_overlaps[k] >= thresh)[0]
+        boxes_to_vote = all_boxes[inds_to_vote, :]
+        ws = all_scores[inds_to_vote]
+        top_dets_out[k, :4] = np.average(boxes_to_vote, axis=0, weights=ws)
+        if scoring_method == 'TEMP_AVG':
+            P = np.vstack((ws, 1.0 - ws))
+            P_max = np.max(P, axis=0)
+            X = np.log(P / P_max)
+            X_exp = np.exp(X / beta)
+            P_temp = X_exp / np.sum(X_exp, axis=0)
+            top_dets_out[k, 4] = P_temp[0].mean()
+        elif scoring_method == 'AVG':
+            top_dets_out[k, 4] = ws.mean()
+        elif scoring_method == 'IOU_AVG':
+            P = ws
+            ws = top_to_all_overlaps[k, inds_to_vote]
+            top_dets_out[k, 4] = np.average(P, weights=ws)
+        elif scoring_method == 'GENERALIZED_AVG':
+            top_dets_out[k, 4] = np.mean(ws**beta)**(1.0 / beta)
+        elif scoring_method == 'QUASI_SUM':
+            top_dets_out[k, 4] = ws.sum() / float(len(ws))**beta
+    return top_dets_out
+
+
+def random_dets(rng, num_dets, num_clusters):
+    centers = rng.rand(num_clusters, 2) * 500
+    sizes = rng.rand(num_clusters, 2) * 100 + 10
+    inds = rng.randint(num_clusters, size=num_dets)
+    xy = centers[inds] + rng.randn(num_dets, 2) * 5
+    wh = sizes[inds] * (1 + rng.randn(num_dets, 2) * 0.1)
+    dets = np.hstack((xy, xy + wh, rng.rand(num_dets, 1) * 0.99 + 0.01))
+    return dets.astype(np.float32)
+
+
+class TestBoxVoting(unittest.TestCase):
+    def test_equivalence(self):
+        rng = np.random.RandomState(0)
+        all_dets = random_dets(rng, 500, 20)
+        top_dets = all_dets[rng.choice(len(all_dets), 40, replace=False)]
+        for scoring_method in [
+            'ID', 'TEMP_AVG', 'AVG', 'IOU_AVG', 'GENERALIZED_AVG', 'QUASI_SUM'
+        ]:
+            for beta in [1.0, 2.0]:
+                dets = box_utils.box_voting(
+                    top_dets, all_dets, 0.8, scoring_method, beta
+                )
+                ref_dets = reference_box_voting(
+                    top_dets, all_dets, 0.8, scoring_method, beta
+                )
+                self.assertEqual(dets.dtype, ref_dets.dtype)
+                np.testing.assert_allclose(dets, ref_dets, rtol=1e-5)
+
+    def test_unknown_scoring_method(self):
+        dets = random_dets(np.random.RandomState(0), 10, 2)
+        with self.assertRaises(NotImplementedError):
+            box_utils.box_voting(dets, dets, 0.8, 'UNKNOWN')
+
+
+if __name__ == '__main__':
+    unittest.main()
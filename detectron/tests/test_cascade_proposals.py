@@ -0,0 +1,98 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import scipy.sparse
+import unittest
+
+from detectron.datasets import json_dataset
+import detectron.roi_data.cascade_rcnn as cascade_rcnn_roi_data
+import detectron.utils.roidb_blob as roidb_blob_utils
+
+
+def random_gt_entry(rng, num_gt, num_classes=81):
+    xy = rng.rand(num_gt, 2) * 300
+    boxes = np.hstack((xy, xy + rng.rand(num_gt, 2) * 200)).astype(np.float32)
+    gt_classes = rng.randint(1, num_classes, size=num_gt).astype(np.int32)
+    is_crowd = np.zeros(num_gt, dtype=np.bool_)
+    gt_overlaps = np.zeros((num_gt, num_classes), dtype=np.float32)
+    gt_overlaps[np.arange(num_gt), gt_classes] = 1.0
+    if num_gt > 1:
+        # A crowd region
+        is_crowd[-1] = True
+        gt_overlaps[-1, :] = -1.0
+    return {
+        'boxes': boxes,
+        'segms': [[[0., 0., 1., 0., 1., 1.]] for _ in range(num_gt)],
+        'gt_classes': gt_classes,
+        'seg_areas': rng.rand(num_gt).astype(np.float32),
+        'gt_overlaps': scipy.sparse.csr_matrix(gt_overlaps),
+        'is_crowd': is_crowd,
+        'box_to_gt_ind_map': np.arange(num_gt, dtype=np.int32),
+    }
+
+
+def random_rois(rng, num_images, num_rois, im_scales):
+    im_inds = np.sort(rng.randint(num_images, size=num_rois))
+    xy = rng.rand(num_rois, 2) * 300
+    wh = rng.rand(num_rois, 2) * 200
+    rois = np.hstack((im_inds[:, np.newaxis], xy, xy + wh))
+    rois[:, 1:] *= im_scales[im_inds, np.newaxis]
+    return rois.astype(np.float32)
+
+
+class TestCascadeProposals(unittest.TestCase):
+    def test_add_proposals(self):
+        rng = np.random.RandomState(0)
+        im_scales = np.array([0.8, 1.5, 1.0], dtype=np.float32)
+        blob = roidb_blob_utils.serialize(
+            [random_gt_entry(rng, n) for n in [5, 0, 1]]
+        )
+        keys = [
+            'boxes', 'gt_classes', 'seg_areas', 'is_crowd',
+            'box_to_gt_ind_map', 'max_overlaps', 'max_classes'
+        ]
+        # The proposals of several stages of the same minibatch
+        for num_rois in [500, 300]:
+            rois = random_rois(rng, len(im_scales), num_rois, im_scales)
+            ref_roidb = roidb_blob_utils.deserialize(blob)
+            json_dataset.add_proposals(
+                ref_roidb, rois, im_scales, crowd_thresh=0
+            )
+            roidb = roidb_blob_utils.deserialize(blob)
+            state = roidb_blob_utils.get_minibatch_state(blob)
+            if 'gt_tables' not in state:
+                state['gt_tables'] = [
+                    cascade_rcnn_roi_data.get_gt_table(entry)
+                    for entry in roidb
+                ]
+            cascade_rcnn_roi_data.add_proposals(
+                roidb, state['gt_tables'], rois, im_scales
+            )
+            for entry, ref_entry in zip(roidb, ref_roidb):
+                self.assertNotIn('gt_overlaps', entry)
+                for k in keys:
+                    self.assertEqual(entry[k].dtype, ref_entry[k].dtype)
+                    np.testing.assert_array_equal(entry[k], ref_entry[k])
+                self.assertIs(entry['segms'], ref_entry['segms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
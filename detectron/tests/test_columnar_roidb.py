@@ -0,0 +1,218 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import numpy as np
+import pickle
+import scipy.sparse
+import shutil
+import tempfile
+import unittest
+
+from detectron.datasets.columnar_roidb import ColumnarRoidb
+import detectron.utils.segms as segm_utils
+
+
+class FakeDataset(object):
+    classes = ['__background__', 'person']
+
+
+def random_entry(rng, dataset, num_gt, num_proposals, num_classes=81):
+    num_boxes = num_gt + num_proposals
+    gt_classes = np.zeros(num_boxes, dtype=np.int32)
+    gt_classes[:num_gt] = rng.randint(1, num_classes, size=num_gt)
+    gt_overlaps = np.zeros((num_boxes, num_classes), dtype=np.float32)
+    gt_overlaps[np.arange(num_gt), gt_classes[:num_gt]] = 1.0
+    gt_overlaps[num_gt:, 1] = rng.rand(num_proposals)
+    segms = [
+        [(rng.rand(2 * rng.randint(3, 10)) * 100).tolist()]
+        for _ in range(num_gt - 1)
+    ]
+    # Crowd regions are uncompressed RLEs
+    segms.append({'size': [20, 30], 'counts': [5, 10, 585]})
+    return {
+        'dataset': dataset,
+        'image': 'image_{}.jpg'.format(rng.randint(1000)),
+        'id': rng.randint(1000),
+        'height': 480,
+        'width': 640,
+        'flipped': bool(rng.randint(2)),
+        'has_visible_keypoints': False,
+        'boxes': (rng.rand(num_boxes, 4) * 100).astype(np.float32),
+        'segms': segms,
+        'gt_classes': gt_classes,
+        'seg_areas': rng.rand(num_boxes).astype(np.float32),
+        'gt_overlaps': scipy.sparse.csr_matrix(gt_overlaps),
+        'is_crowd': np.zeros(num_boxes, dtype=np.bool_),
+        'box_to_gt_ind_map': np.arange(num_boxes, dtype=np.int32),
+        'max_overlaps': gt_overlaps.max(axis=1),
+        'max_classes': gt_overlaps.argmax(axis=1),
+    }
+
+
+def random_roidb(seed=0):
+    rng = np.random.RandomState(seed)
+    datasets = [FakeDataset(), FakeDataset()]
+    return [
+        random_entry(rng, datasets[i % 2], rng.randint(1, 5), n)
+        for i, n in enumerate([0, 3, 10, 1])
+    ]
+
+
+class TestColumnarRoidb(unittest.TestCase):
+    def assert_entries_equal(self, entry, ref_entry):
+        self.assertEqual(set(entry.keys()), set(ref_entry.keys()))
+        for k, v in ref_entry.items():
+            if isinstance(v, np.ndarray):
+                self.assertEqual(entry[k].dtype, v.dtype)
+                np.testing.assert_array_equal(entry[k], v)
+            elif scipy.sparse.issparse(v):
+                np.testing.assert_array_equal(
+                    entry[k].toarray(), v.toarray()
+                )
+            elif k == 'dataset':
+                self.assertIs(entry[k], v)
+            else:
+                self.assertEqual(type(entry[k]), type(v))
+                self.assertEqual(entry[k], v)
+
+    def test_entries(self):
+        roidb = random_roidb()
+        columnar_roidb = ColumnarRoidb(copy.copy(roidb))
+        self.assertEqual(len(columnar_roidb), len(roidb))
+        for entry, ref_entry in zip(columnar_roidb, roidb):
+            self.assert_entries_equal(entry, ref_entry)
+
+    def test_contains(self):
+        roidb = random_roidb()
+        columnar_roidb = ColumnarRoidb(roidb)
+        columnar_roidb[0]['bbox_targets'] = np.zeros(
+            (len(roidb[0]['boxes']), 5), dtype=np.float32
+        )
+        columnar_roidb[1]['extra'] = 'extra'
+        columnar_roidb.extend_with_flipped_entries()
+        columnar_roidb[len(roidb) + 2]['bbox_targets'] = np.zeros(
+            (len(roidb[2]['boxes']), 5), dtype=np.float32
+        )
+        for entry in columnar_roidb:
+            keys = set(entry.keys())
+            for k in keys | set(['extra', 'bbox_targets', 'missing']):
+                self.assertEqual(k in entry, k in keys)
+        self.assertIn('extra', columnar_roidb[len(roidb) + 1])
+        self.assertNotIn('bbox_targets', columnar_roidb[len(roidb)])
+
+    def test_set_fields(self):
+        roidb = random_roidb()
+        columnar_roidb = ColumnarRoidb(roidb)
+        entries = list(columnar_roidb)
+        for i, entry in enumerate(entries[:2]):
+            entry['bbox_targets'] = np.full(
+                (len(roidb[i]['boxes']), 5), i, dtype=np.float32
+            )
+        entries[2]['extra'] = 'extra'
+        entries[3]['boxes'] = np.zeros((0, 4), dtype=np.float32)
+        for i, entry in enumerate(entries[:2]):
+            np.testing.assert_array_equal(entry['bbox_targets'], i)
+        self.assertNotIn('bbox_targets', entries[2])
+        self.assertIsNone(entries[3].get('bbox_targets'))
+        self.assertEqual(entries[2]['extra'], 'extra')
+        self.assertNotIn('extra', entries[1])
+        self.assertEqual(entries[3]['boxes'].shape, (0, 4))
+
+    def test_pickle(self):
+        roidb = random_roidb()
+        entries = list(ColumnarRoidb(roidb))[1:]
+        entries = pickle.loads(pickle.dumps(entries, pickle.HIGHEST_PROTOCOL))
+        # The entries are pickled as dicts of their own fields
+        for entry, ref_entry in zip(entries, roidb[1:]):
+            self.assertIsInstance(entry, dict)
+            self.assertEqual(set(entry.keys()), set(ref_entry.keys()))
+            self.assertEqual(entry['image'], ref_entry['image'])
+            self.assertEqual(entry['segms'], ref_entry['segms'])
+            np.testing.assert_array_equal(entry['boxes'], ref_entry['boxes'])
+
+    def test_flipped_entries(self):
+        roidb = random_roidb()
+        columnar_roidb = ColumnarRoidb(roidb)
+        columnar_roidb.extend_with_flipped_entries()
+        self.assertEqual(len(columnar_roidb), 2 * len(roidb))
+        for i, ref_entry in enumerate(roidb):
+            entry = columnar_roidb[len(roidb) + i]
+            self.assertEqual(entry['flipped'], not ref_entry['flipped'])
+            width = ref_entry['width']
+            boxes = entry['boxes']
+            ref_boxes = ref_entry['boxes']
+            np.testing.assert_array_equal(
+                boxes[:, 0], width - ref_boxes[:, 2] - 1
+            )
+            np.testing.assert_array_equal(
+                boxes[:, 2], width - ref_boxes[:, 0] - 1
+            )
+            np.testing.assert_array_equal(boxes[:, 1::2], ref_boxes[:, 1::2])
+            self.assertEqual(
+                entry['segms'],
+                segm_utils.flip_segms(
+                    ref_entry['segms'], ref_entry['height'], width
+                )
+            )
+            self.assertEqual(entry['image'], ref_entry['image'])
+            # Fields set on flipped entries do not affect the stored entries
+            entry['bbox_targets'] = np.full(
+                (len(ref_boxes), 5), -1, dtype=np.float32
+            )
+            columnar_roidb[i]['bbox_targets'] = np.full(
+                (len(ref_boxes), 5), i, dtype=np.float32
+            )
+            np.testing.assert_array_equal(entry['bbox_targets'], -1)
+        np.testing.assert_array_equal(columnar_roidb[1]['bbox_targets'], 1)
+        # The flipped segms follow the segms of the stored entry
+        segms = [[[0., 0., 10., 0., 10., 10.]]]
+        columnar_roidb[1]['segms'] = segms
+        self.assertEqual(
+            columnar_roidb[len(roidb) + 1]['segms'],
+            segm_utils.flip_segms(
+                segms, roidb[1]['height'], roidb[1]['width']
+            )
+        )
+
+    def test_save_load(self):
+        roidb = random_roidb()
+        columnar_roidb = ColumnarRoidb(roidb)
+        columnar_roidb.extend_with_flipped_entries()
+        columnar_roidb[1]['bbox_targets'] = np.ones(
+            (len(roidb[1]['boxes']), 5), dtype=np.float32
+        )
+        datasets = {}
+        for entry in roidb:
+            entry['dataset'].name = 'dataset_{}'.format(id(entry['dataset']))
+            datasets[entry['dataset'].name] = entry['dataset']
+        directory = tempfile.mkdtemp()
+        try:
+            columnar_roidb.save(directory)
+            loaded_roidb = ColumnarRoidb.load(directory, datasets.get)
+            self.assertEqual(len(loaded_roidb), len(columnar_roidb))
+            for entry, ref_entry in zip(loaded_roidb, columnar_roidb):
+                self.assert_entries_equal(entry, ref_entry)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
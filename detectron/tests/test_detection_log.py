@@ -0,0 +1,210 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from detectron.utils.detection_log import DetectionLogWriter
+from detectron.utils.detection_log import load_detection_log
+from detectron.utils.detection_results import DetectionResultsBuilder
+
+NUM_CLASSES = 4
+NUM_KEYPOINTS = 3
+PERSON_IDX = 1
+
+
+def random_image_results(rng, with_masks, with_keypoints):
+    """Random (cls_boxes, cls_segms, cls_keyps) of an image, as returned by
+    im_detect_all."""
+    cls_boxes = [[]]
+    cls_segms = [[]] if with_masks else None
+    cls_keyps = [[]] if with_keypoints else None
+    for j in range(1, NUM_CLASSES):
+        n = rng.randint(0, 4)
+        cls_boxes.append((rng.rand(n, 5) * 100).astype(np.float32))
+        if with_masks:
+            cls_segms.append([
+                {
+                    'size': [480, 640],
+                    'counts': rng.randint(
+                        48, 112, size=rng.randint(20)
+                    ).astype(np.uint8).tobytes()
+                } for _ in range(n)
+            ])
+        if with_keypoints:
+            cls_keyps.append(
+                [
+                    rng.rand(4, NUM_KEYPOINTS).astype(np.float32)
+                    for _ in range(n)
+                ] if j == PERSON_IDX else []
+            )
+    return cls_boxes, cls_segms, cls_keyps
+
+
+class TestDetectionLog(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = os.path.join(tempfile.mkdtemp(), 'detections_log')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.log_dir))
+
+    def assert_results_equal(self, detections, image_results, num_images):
+        all_boxes = detections.all_boxes
+        all_segms = detections.all_segms
+        all_keyps = detections.all_keyps
+        for all_res in [all_boxes, all_segms, all_keyps]:
+            self.assertEqual(len(all_res), NUM_CLASSES)
+            self.assertEqual(len(all_res[0]), num_images)
+        for j in range(NUM_CLASSES):
+            for i in range(num_images):
+                if i not in image_results or j == 0:
+                    self.assertEqual(all_boxes[j][i], [])
+                    self.assertEqual(all_segms[j][i], [])
+                    self.assertEqual(all_keyps[j][i], [])
+                    continue
+                cls_boxes_i, cls_segms_i, cls_keyps_i = image_results[i]
+                self.assertEqual(all_boxes[j][i].dtype, cls_boxes_i[j].dtype)
+                np.testing.assert_array_equal(all_boxes[j][i], cls_boxes_i[j])
+                if cls_segms_i is None:
+                    self.assertEqual(all_segms[j][i], [])
+                else:
+                    self.assertEqual(all_segms[j][i], cls_segms_i[j])
+                if cls_keyps_i is None:
+                    self.assertEqual(all_keyps[j][i], [])
+                else:
+                    self.assertEqual(len(all_keyps[j][i]), len(cls_keyps_i[j]))
+                    for keyps, ref_keyps in zip(
+                        all_keyps[j][i], cls_keyps_i[j]
+                    ):
+                        np.testing.assert_array_equal(keyps, ref_keyps)
+
+    def _test_results(self, with_masks, with_keypoints):
+        rng = np.random.RandomState(0)
+        num_images = 11
+        # Out of order, and without the images that would have been skipped
+        inds = [3, 0, 1, 10, 7, 2, 9, 5, 4]
+        image_results = {
+            i: random_image_results(rng, with_masks, with_keypoints)
+            for i in inds
+        }
+        writer = DetectionLogWriter(
+            self.log_dir, num_images, NUM_CLASSES, has_segms=with_masks,
+            has_keyps=with_keypoints, ims_per_chunk=4
+        )
+        for i in inds:
+            writer.append(i, *image_results[i])
+        writer.close()
+        detections, _ = load_detection_log(self.log_dir)
+        self.assertEqual(detections.image_inds.tolist(), sorted(inds))
+        self.assert_results_equal(detections, image_results, num_images)
+
+    def test_boxes(self):
+        self._test_results(False, False)
+
+    def test_masks(self):
+        self._test_results(True, False)
+
+    def test_keypoints(self):
+        self._test_results(False, True)
+
+    def test_masks_and_keypoints(self):
+        self._test_results(True, True)
+
+    def test_resume(self):
+        rng = np.random.RandomState(0)
+        num_images = 10
+        image_results = {
+            i: random_image_results(rng, True, False)
+            for i in range(num_images)
+        }
+        writer = DetectionLogWriter(
+            self.log_dir, num_images, NUM_CLASSES, has_segms=True,
+            ims_per_chunk=3
+        )
+        for i in range(7):
+            writer.append(i, *image_results[i])
+        # The run crashes: the buffered images (6) and a partially written
+        # chunk are lost
+        with open(os.path.join(self.log_dir, 'chunk_000002.npz.0.tmp'), 'w'):
+            pass
+        writer = DetectionLogWriter(
+            self.log_dir, num_images, NUM_CLASSES, has_segms=True,
+            resume=True, ims_per_chunk=3
+        )
+        self.assertEqual(sorted(writer.done_inds), list(range(6)))
+        for i in range(num_images):
+            if i not in writer.done_inds:
+                writer.append(i, *image_results[i])
+        writer.close()
+        self.assertFalse(
+            any(f.endswith('.tmp') for f in os.listdir(self.log_dir))
+        )
+        self.assert_results_equal(
+            load_detection_log(self.log_dir)[0], image_results, num_images
+        )
+
+        # Without resuming, the log is started over
+        writer = DetectionLogWriter(
+            self.log_dir, num_images, NUM_CLASSES, has_segms=True
+        )
+        self.assertEqual(len(writer.done_inds), 0)
+        writer.append(0, *image_results[0])
+        writer.close()
+        detections, _ = load_detection_log(self.log_dir)
+        self.assertEqual(detections.image_inds.tolist(), [0])
+
+    def test_append_chunk(self):
+        rng = np.random.RandomState(0)
+        num_images = 9
+        image_results = {
+            i: random_image_results(rng, True, True)
+            for i in range(num_images)
+        }
+        writer = DetectionLogWriter(
+            self.log_dir, num_images, NUM_CLASSES, has_segms=True,
+            has_keyps=True, ims_per_chunk=4
+        )
+        # Chunks of images, as returned by the inference workers
+        for inds in [[0, 3, 6], [1, 4, 7], [2, 5, 8]]:
+            builder = DetectionResultsBuilder(
+                num_images, NUM_CLASSES, has_segms=True, has_keyps=True
+            )
+            for i in inds:
+                builder.append(i, *image_results[i])
+            writer.append_chunk(builder.pop_chunk())
+        with self.assertRaises(AssertionError):
+            writer.append(4, *image_results[4])
+        writer.close()
+        self.assert_results_equal(
+            load_detection_log(self.log_dir)[0], image_results, num_images
+        )
+
+    def test_resume_mismatch(self):
+        writer = DetectionLogWriter(self.log_dir, 10, NUM_CLASSES)
+        writer.close()
+        with self.assertRaises(AssertionError):
+            DetectionLogWriter(self.log_dir, 12, NUM_CLASSES, resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
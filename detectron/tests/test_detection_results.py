@@ -0,0 +1,264 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import numpy as np
+import unittest
+
+from detectron.utils.detection_results import DetectionResults
+from detectron.utils.detection_results import DetectionResultsBuilder
+
+NUM_CLASSES = 5
+NUM_KEYPOINTS = 3
+PERSON_IDX = 1
+
+
+def random_image_results(rng, with_masks, with_keypoints):
+    """Random (cls_boxes, cls_segms, cls_keyps) of an image, as returned by
+    im_detect_all."""
+    cls_boxes = [[]]
+    cls_segms = [[]] if with_masks else None
+    cls_keyps = [[]] if with_keypoints else None
+    for j in range(1, NUM_CLASSES):
+        n = rng.randint(0, 4)
+        cls_boxes.append((rng.rand(n, 5) * 100).astype(np.float32))
+        if with_masks:
+            cls_segms.append([
+                {
+                    'size': [480, 640],
+                    'counts': rng.randint(
+                        48, 112, size=rng.randint(20)
+                    ).astype(np.uint8).tobytes()
+                } for _ in range(n)
+            ])
+        if with_keypoints:
+            cls_keyps.append(
+                [
+                    rng.rand(4, NUM_KEYPOINTS).astype(np.float32)
+                    for _ in range(n)
+                ] if j == PERSON_IDX else []
+            )
+    return cls_boxes, cls_segms, cls_keyps
+
+
+def reference_all_results(image_results, num_images):
+    """The all_boxes, all_segms and all_keyps lists that test_net built before
+    DetectionResults."""
+    all_res = [
+        [[[] for _ in range(num_images)] for _ in range(NUM_CLASSES)]
+        for _ in range(3)
+    ]
+    for i, results in image_results.items():
+        for all_r, cls_r in zip(all_res, results):
+            if cls_r is None:
+                continue
+            for j in range(1, NUM_CLASSES):
+                all_r[j][i] = cls_r[j]
+    return all_res
+
+
+class TestDetectionResults(unittest.TestCase):
+    def assert_results_equal(self, detections, image_results, num_images):
+        all_res = [
+            detections.all_boxes, detections.all_segms, detections.all_keyps
+        ]
+        ref_all_res = reference_all_results(image_results, num_images)
+        for all_r, ref_all_r in zip(all_res, ref_all_res):
+            self.assertEqual(len(all_r), NUM_CLASSES)
+            for j in range(NUM_CLASSES):
+                for i in range(num_images):
+                    self.assert_image_results_equal(
+                        all_r[j][i], ref_all_r[j][i]
+                    )
+
+    def assert_image_results_equal(self, results, ref_results):
+        self.assertEqual(len(results), len(ref_results))
+        if isinstance(ref_results, np.ndarray):
+            self.assertEqual(results.dtype, ref_results.dtype)
+            np.testing.assert_array_equal(results, ref_results)
+            return
+        for r, ref_r in zip(results, ref_results):
+            if isinstance(ref_r, np.ndarray):
+                np.testing.assert_array_equal(r, ref_r)
+            else:
+                self.assertEqual(r, ref_r)
+
+    def _test_results(self, with_masks, with_keypoints):
+        rng = np.random.RandomState(0)
+        num_images = 13
+        # Out of order, and without the images that would have been skipped
+        inds = [3, 0, 1, 12, 7, 2, 9, 5, 4, 11]
+        image_results = {
+            i: random_image_results(rng, with_masks, with_keypoints)
+            for i in inds
+        }
+        builder = DetectionResultsBuilder(
+            num_images, NUM_CLASSES, has_segms=with_masks,
+            has_keyps=with_keypoints
+        )
+        for i in inds:
+            builder.append(i, *image_results[i])
+        detections = builder.build()
+        self.assertEqual(detections.image_inds.tolist(), sorted(inds))
+        self.assertEqual(detections.has_segms, with_masks)
+        self.assertEqual(detections.has_keyps, with_keypoints)
+        self.assert_results_equal(detections, image_results, num_images)
+
+        # Per image access
+        for i in range(num_images):
+            cls_results = detections.get_image_results(i)
+            ref_cls_results = image_results.get(
+                i, tuple([[]] * NUM_CLASSES for _ in range(3))
+            )
+            for cls_r, ref_cls_r in zip(cls_results, ref_cls_results):
+                if ref_cls_r is None:
+                    self.assertIsNone(cls_r)
+                    continue
+                for r, ref_r in zip(cls_r, ref_cls_r):
+                    self.assert_image_results_equal(r, ref_r)
+
+        # The detections of each class are in image order
+        for j in range(1, NUM_CLASSES):
+            rows = detections.get_class_rows(j)
+            self.assertTrue((detections.det_classes[rows] == j).all())
+            ref_dets = [
+                image_results[i][0][j] for i in sorted(inds)
+                if len(image_results[i][0][j]) > 0
+            ]
+            np.testing.assert_array_equal(
+                detections.dets[rows], np.vstack(ref_dets)
+            )
+
+        # Conversion from the all_boxes[cls][image] lists
+        all_boxes, all_segms, all_keyps = reference_all_results(
+            image_results, num_images
+        )
+        self.assert_results_equal(
+            DetectionResults.from_all_results(all_boxes, all_segms, all_keyps),
+            image_results, num_images
+        )
+
+        # Conversion to the all_boxes[cls][image] lists (detections.pkl)
+        all_res = detections.to_all_results()
+        for all_r, ref_all_r in zip(
+            all_res, [all_boxes, all_segms, all_keyps]
+        ):
+            self.assertIsInstance(all_r, list)
+            self.assertEqual(len(all_r), NUM_CLASSES)
+            for j in range(NUM_CLASSES):
+                self.assertIsInstance(all_r[j], list)
+                for i in range(num_images):
+                    self.assert_image_results_equal(
+                        all_r[j][i], ref_all_r[j][i]
+                    )
+        all_res = pickle.loads(pickle.dumps(all_res, pickle.HIGHEST_PROTOCOL))
+        self.assert_results_equal(
+            DetectionResults.from_all_results(*all_res), image_results,
+            num_images
+        )
+
+    def test_boxes(self):
+        self._test_results(False, False)
+
+    def test_masks(self):
+        self._test_results(True, False)
+
+    def test_keypoints(self):
+        self._test_results(False, True)
+
+    def test_masks_and_keypoints(self):
+        self._test_results(True, True)
+
+    def test_chunks(self):
+        rng = np.random.RandomState(0)
+        num_images = 10
+        image_results = {
+            i: random_image_results(rng, True, True)
+            for i in range(num_images)
+        }
+        # The chunks of the inference workers, merged out of order
+        chunks = []
+        for inds in [[0, 5], [8, 1, 2], [9], [3, 4, 6, 7]]:
+            builder = DetectionResultsBuilder(
+                num_images, NUM_CLASSES, has_segms=True, has_keyps=True
+            )
+            for i in inds:
+                builder.append(i, *image_results[i])
+            chunks.append(builder.pop_chunk())
+            self.assertIsNone(builder.pop_chunk())
+        builder = DetectionResultsBuilder(
+            num_images, NUM_CLASSES, has_segms=True, has_keyps=True
+        )
+        for chunk in chunks[::-1]:
+            builder.append_chunk(chunk)
+        self.assertEqual(builder.num_pending_images, num_images)
+        self.assert_results_equal(builder.build(), image_results, num_images)
+
+    def test_chunks_without_detections(self):
+        rng = np.random.RandomState(0)
+        num_images = 3
+        image_results = {
+            0: random_image_results(rng, True, True),
+            # im_detect_all returns no masks and keypoints for the images
+            # without detections
+            1: ([[]] + [np.zeros((0, 5), dtype=np.float32)] *
+                (NUM_CLASSES - 1), None, None),
+            2: random_image_results(rng, True, True),
+        }
+        chunks = []
+        for i in range(num_images):
+            builder = DetectionResultsBuilder(
+                num_images, NUM_CLASSES, has_segms=True, has_keyps=True
+            )
+            builder.append(i, *image_results[i])
+            chunks.append(builder.pop_chunk())
+        self.assertEqual(len(chunks[1]['segm_counts']), 0)
+        self.assertEqual(len(chunks[1]['keyp_inds']), 0)
+        builder = DetectionResultsBuilder(
+            num_images, NUM_CLASSES, has_segms=True, has_keyps=True
+        )
+        for chunk in chunks:
+            builder.append_chunk(chunk)
+        detections = builder.build()
+        self.assertTrue(detections.has_segms)
+        self.assertTrue(detections.has_keyps)
+        cls_boxes, cls_segms, cls_keyps = detections.get_image_results(1)
+        for j in range(1, NUM_CLASSES):
+            self.assertEqual(len(cls_boxes[j]), 0)
+            self.assertEqual(cls_segms[j], [])
+            self.assertEqual(cls_keyps[j], [])
+        for i in [0, 2]:
+            cls_boxes, cls_segms, _ = detections.get_image_results(i)
+            for j in range(1, NUM_CLASSES):
+                np.testing.assert_array_equal(
+                    cls_boxes[j], image_results[i][0][j]
+                )
+                self.assertEqual(cls_segms[j], image_results[i][1][j])
+
+    def test_empty(self):
+        detections = DetectionResultsBuilder(4, NUM_CLASSES).build()
+        self.assertEqual(len(detections), 0)
+        for j in range(NUM_CLASSES):
+            self.assertEqual(detections.all_boxes[j], [[]] * 4)
+            self.assertEqual(detections.get_class_rows(j), slice(0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
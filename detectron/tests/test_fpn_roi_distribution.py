@@ -0,0 +1,83 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.modeling.FPN as fpn
+
+
+def reference_add_multilevel_roi_blobs(
+    blobs, blob_prefix, rois, target_lvls, lvl_min, lvl_max
+):
+    """The original implementation of add_multilevel_roi_blobs."""
+    rois_idx_order = np.empty((0, ))
+    for lvl in range(lvl_min, lvl_max + 1):
+        idx_lvl = np.where(target_lvls == lvl)[0]
+        blobs[blob_prefix + '_fpn' + str(lvl)] = rois[idx_lvl, :]
+        rois_idx_order = np.concatenate((rois_idx_order, idx_lvl))
+    rois_idx_restore = np.argsort(rois_idx_order).astype(np.int32, copy=False)
+    blobs[blob_prefix + '_idx_restore_int32'] = rois_idx_restore
+
+
+class TestFpnRoiDistribution(unittest.TestCase):
+    def _test_add_multilevel_roi_blobs(self, num_rois):
+        rng = np.random.RandomState(0)
+        xy = rng.rand(num_rois, 2) * 500
+        wh = np.exp(rng.rand(num_rois, 2) * 6)
+        rois = np.hstack((
+            rng.randint(2, size=(num_rois, 1)), xy, xy + wh
+        )).astype(np.float32)
+        lvl_min, lvl_max = cfg.FPN.ROI_MIN_LEVEL, cfg.FPN.ROI_MAX_LEVEL
+        target_lvls = fpn.map_rois_to_fpn_levels(rois[:, 1:5], lvl_min, lvl_max)
+        blobs = {}
+        ref_blobs = {}
+        old_check = cfg.FPN.CHECK_ROI_DISTRIBUTION
+        cfg.FPN.CHECK_ROI_DISTRIBUTION = True
+        try:
+            fpn.add_multilevel_roi_blobs(
+                blobs, 'rois', rois, target_lvls, lvl_min, lvl_max
+            )
+        finally:
+            cfg.FPN.CHECK_ROI_DISTRIBUTION = old_check
+        reference_add_multilevel_roi_blobs(
+            ref_blobs, 'rois', rois, target_lvls, lvl_min, lvl_max
+        )
+        self.assertEqual(set(blobs.keys()), set(ref_blobs.keys()))
+        for k, v in ref_blobs.items():
+            self.assertEqual(blobs[k].dtype, v.dtype)
+            np.testing.assert_array_equal(blobs[k], v)
+        np.testing.assert_array_equal(
+            np.vstack([
+                blobs['rois_fpn' + str(lvl)]
+                for lvl in range(lvl_min, lvl_max + 1)
+            ])[blobs['rois_idx_restore_int32']], rois
+        )
+
+    def test_add_multilevel_roi_blobs(self):
+        self._test_add_multilevel_roi_blobs(1000)
+
+    def test_add_multilevel_roi_blobs_no_rois(self):
+        self._test_add_multilevel_roi_blobs(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+from detectron.modeling.generate_anchors import generate_anchors
+from detectron.ops.generate_proposals import GenerateProposalsOp
+import detectron.utils.boxes as box_utils
+
+
+class Blob(object):
+    """Minimal stand-in for the blobs passed to Python ops."""
+
+    def __init__(self, data=None):
+        self.data = data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def reshape(self, shape):
+        self.data = np.zeros(shape, dtype=np.float32)
+
+
+def reference_proposals_for_one_image(
+    op, im_info, all_anchors, bbox_deltas, scores
+):
+    """The original GenerateProposalsOp.proposals_for_one_image, which
+    generates the proposals of a single image."""
+    cfg_key = 'TRAIN' if op._train else 'TEST'
+    pre_nms_topN = cfg[cfg_key].RPN_PRE_NMS_TOP_N
+    post_nms_topN = cfg[cfg_key].RPN_POST_NMS_TOP_N
+    nms_thresh = cfg[cfg_key].RPN_NMS_THRESH
+    min_size = cfg[cfg_key].RPN_MIN_SIZE
+    bbox_deltas = bbox_deltas.transpose((1, 2, 0)).reshape((-1, 4))
+    scores = scores.transpose((1, 2, 0)).reshape((-1, 1))
+    if pre_nms_topN <= 0 or pre_nms_topN >= len(scores):
+        order = np.argsort(-scores.squeeze())
+    else:
+        inds = np.argpartition(
+            -scores.squeeze(), pre_nms_topN
+        )[:pre_nms_topN]
+        order = np.argsort(-scores[inds].squeeze())
+        order = inds[order]
+    bbox_deltas = bbox_deltas[order, :]
+    all_anchors = all_anchors[order, :]
+    scores = scores[order]
+    proposals = box_utils.bbox_transform(
+        all_anchors, bbox_deltas, op._reg_weights
+    )
+    proposals = box_utils.clip_tiled_boxes(proposals, im_info[:2])
+    # Only keep boxes with both sides >= min_size and center within the image
+    im_scale = im_info[2]
+    ws_orig_scale = (proposals[:, 2] - proposals[:, 0]) / im_scale + 1
+    hs_orig_scale = (proposals[:, 3] - proposals[:, 1]) / im_scale + 1
+    min_size = np.maximum(min_size, 1)
+    ws = proposals[:, 2] - proposals[:, 0] + 1
+    hs = proposals[:, 3] - proposals[:, 1] + 1
+    x_ctr = proposals[:, 0] + ws / 2.
+    y_ctr = proposals[:, 1] + hs / 2.
+    keep = np.where(
+        (ws_orig_scale >= min_size)
+        & (hs_orig_scale >= min_size)
+        & (x_ctr < im_info[1])
+        & (y_ctr < im_info[0])
+    )[0]
+    proposals = proposals[keep, :]
+    scores = scores[keep]
+    if nms_thresh > 0:
+        keep = box_utils.nms(np.hstack((proposals, scores)), nms_thresh)
+        if post_nms_topN > 0:
+            keep = keep[:post_nms_topN]
+        proposals = proposals[keep, :]
+        scores = scores[keep]
+    return proposals, scores
+
+
+def reference_forward(op, scores, bbox_deltas, im_info):
+    """The original implementation of GenerateProposalsOp.forward, which
+    processes one image at a time."""
+    height, width = scores.shape[-2:]
+    shift_x = np.arange(0, width) * op._feat_stride
+    shift_y = np.arange(0, height) * op._feat_stride
+    shift_x, shift_y = np.meshgrid(shift_x, shift_y, copy=False)
+    shifts = np.vstack((shift_x.ravel(), shift_y.ravel(),
+                        shift_x.ravel(), shift_y.ravel())).transpose()
+    all_anchors = op._anchors[np.newaxis, :, :] + shifts[:, np.newaxis, :]
+    all_anchors = all_anchors.reshape((-1, 4))
+    rois = np.empty((0, 5), dtype=np.float32)
+    roi_probs = np.empty((0, 1), dtype=np.float32)
+    for im_i in range(scores.shape[0]):
+        im_i_boxes, im_i_probs = reference_proposals_for_one_image(
+            op, im_info[im_i, :], all_anchors, bbox_deltas[im_i, :, :, :],
+            scores[im_i, :, :, :]
+        )
+        batch_inds = im_i * np.ones((im_i_boxes.shape[0], 1), dtype=np.float32)
+        rois = np.append(rois, np.hstack((batch_inds, im_i_boxes)), axis=0)
+        roi_probs = np.append(roi_probs, im_i_probs, axis=0)
+    return rois, roi_probs
+
+
+class TestGenerateProposalsOp(unittest.TestCase):
+    def _test_equivalence(self, train, pre_nms_top_n, nms_thresh):
+        rng = np.random.RandomState(0)
+        anchors = generate_anchors(
+            stride=16, sizes=(32, 64, 128), aspect_ratios=(0.5, 1, 2)
+        )
+        num_images, A, H, W = 3, anchors.shape[0], 20, 30
+        scores = rng.rand(num_images, A, H, W).astype(np.float32)
+        bbox_deltas = (rng.randn(num_images, 4 * A, H, W) * 0.3).astype(
+            np.float32
+        )
+        im_info = np.array(
+            [[320, 480, 1.0], [300, 420, 0.8], [200, 470, 1.5]],
+            dtype=np.float32
+        )
+        cfg_key = 'TRAIN' if train else 'TEST'
+        old_cfg = dict(cfg[cfg_key])
+        cfg[cfg_key].RPN_PRE_NMS_TOP_N = pre_nms_top_n
+        cfg[cfg_key].RPN_POST_NMS_TOP_N = 100
+        cfg[cfg_key].RPN_NMS_THRESH = nms_thresh
+        try:
+            op = GenerateProposalsOp(anchors, 1. / 16, train)
+            ref_rois, ref_roi_probs = reference_forward(
+                op, scores, bbox_deltas, im_info
+            )
+            outputs = [Blob(), Blob()]
+            # Twice, to use the cached anchors
+            for _ in range(2):
+                op.forward(
+                    [Blob(scores), Blob(bbox_deltas), Blob(im_info)], outputs
+                )
+                np.testing.assert_array_equal(outputs[0].data, ref_rois)
+                np.testing.assert_array_equal(outputs[1].data, ref_roi_probs)
+        finally:
+            cfg[cfg_key].update(old_cfg)
+
+    def test_equivalence_train(self):
+        self._test_equivalence(True, 1000, 0.7)
+
+    def test_equivalence_test(self):
+        self._test_equivalence(False, 500, 0.7)
+
+    def test_equivalence_no_pre_nms_top_n(self):
+        self._test_equivalence(False, -1, 0.7)
+
+    def test_equivalence_no_nms(self):
+        self._test_equivalence(True, 300, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
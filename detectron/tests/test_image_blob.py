@@ -0,0 +1,89 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.utils.blob as blob_utils
+
+
+def random_images(shapes, seed=0):
+    rng = np.random.RandomState(seed)
+    ims = [rng.randint(0, 256, size=shape).astype(np.uint8) for shape in shapes]
+    # Flipped images are non-contiguous views
+    ims[-1] = ims[-1][:, ::-1, :]
+    return ims
+
+
+def reference_blob(ims, target_size, max_size):
+    processed_ims = []
+    im_scales = []
+    for im in ims:
+        im, im_scale = blob_utils.prep_im_for_blob(
+            im, cfg.PIXEL_MEANS, target_size, max_size
+        )
+        processed_ims.append(im)
+        im_scales.append(im_scale)
+    return blob_utils.im_list_to_blob(processed_ims), im_scales
+
+
+class TestPrepImsForBlob(unittest.TestCase):
+    def _test_equivalence(self, fpn_on):
+        shapes = [(480, 640, 3), (375, 500, 3), (600, 401, 3)]
+        target_size, max_size = 800, 1333
+        old_fpn_on = cfg.FPN.FPN_ON
+        cfg.FPN.FPN_ON = fpn_on
+        try:
+            ims = random_images(shapes)
+            ref_blob, ref_scales = reference_blob(ims, target_size, max_size)
+            im_scales = [
+                blob_utils.get_im_scale(im.shape, target_size, max_size)
+                for im in ims
+            ]
+            blob = blob_utils.prep_ims_for_blob(
+                ims, cfg.PIXEL_MEANS, im_scales
+            )
+        finally:
+            cfg.FPN.FPN_ON = old_fpn_on
+        self.assertEqual(im_scales, ref_scales)
+        self.assertEqual(blob.shape, ref_blob.shape)
+        self.assertEqual(blob.dtype, np.float32)
+        self.assertTrue(blob.flags.c_contiguous)
+        # Resizing in uint8 rounds the resized pixel values
+        np.testing.assert_allclose(blob, ref_blob, rtol=0, atol=1.0)
+
+    def test_equivalence(self):
+        self._test_equivalence(fpn_on=False)
+
+    def test_equivalence_fpn(self):
+        self._test_equivalence(fpn_on=True)
+
+    def test_no_resize(self):
+        ims = random_images([(100, 120, 3), (90, 130, 3)])
+        blob = blob_utils.prep_ims_for_blob(ims, cfg.PIXEL_MEANS, [1.0, 1.0])
+        ref_blob = blob_utils.im_list_to_blob(
+            [im.astype(np.float32) - cfg.PIXEL_MEANS for im in ims]
+        )
+        np.testing.assert_array_equal(blob, ref_blob)
+
+
+if __name__ == '__main__':
+    unittest.main()
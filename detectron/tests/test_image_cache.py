@@ -0,0 +1,132 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cv2
+import errno
+import mock
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from detectron.core.config import cfg
+import detectron.roi_data.minibatch as minibatch
+import detectron.utils.blob as blob_utils
+import detectron.utils.image_cache as image_cache
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.im_path = os.path.join(self.tmp_dir, 'image.png')
+        rng = np.random.RandomState(0)
+        self.im = rng.randint(0, 256, size=(75, 100, 3)).astype(np.uint8)
+        cv2.imwrite(self.im_path, self.im)
+        self.im_size = self.im.shape[:2]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_resized_image(self, target_size=60, max_size=1000):
+        return image_cache.get_resized_image(
+            self.cache_dir, self.im_path, self.im_size, target_size, max_size
+        )
+
+    def get_cache_files(self):
+        return [
+            os.path.join(d, f) for d, _, files in os.walk(self.cache_dir)
+            for f in files
+        ]
+
+    def test_miss_writes_entry(self):
+        self.get_resized_image()
+        cache_file = image_cache.get_cache_file(
+            self.cache_dir, self.im_path, self.im_size, 60, 1000
+        )
+        self.assertEqual(self.get_cache_files(), [cache_file])
+        # Entries of other scales and image sizes are distinct
+        self.assertNotEqual(
+            image_cache.get_cache_file(
+                self.cache_dir, self.im_path, self.im_size, 80, 1000
+            ), cache_file
+        )
+        self.assertNotEqual(
+            image_cache.get_cache_file(
+                self.cache_dir, self.im_path, (100, 75), 60, 1000
+            ), cache_file
+        )
+
+    def test_hit_matches_uncached_image(self):
+        im = cv2.imread(self.im_path)
+        ref_scale = blob_utils.get_im_scale(im.shape, 60, 1000)
+        ref_im = cv2.resize(
+            im, None, None, fx=ref_scale, fy=ref_scale,
+            interpolation=cv2.INTER_LINEAR
+        )
+        self.get_resized_image()
+        with mock.patch('cv2.imread') as imread:
+            cached_im, im_scale = self.get_resized_image()
+        self.assertFalse(imread.called)
+        self.assertEqual(im_scale, ref_scale)
+        np.testing.assert_array_equal(cached_im, ref_im)
+
+    def test_shape_mismatch_is_rejected(self):
+        self.get_resized_image()
+        cache_file, = self.get_cache_files()
+        np.save(cache_file, np.zeros((10, 10, 3), dtype=np.uint8))
+        with self.assertRaises(AssertionError):
+            self.get_resized_image()
+
+    def test_makedirs_error_is_raised(self):
+        error = OSError(errno.EACCES, 'Permission denied')
+        with mock.patch('os.makedirs', side_effect=error):
+            with self.assertRaises(OSError) as e:
+                self.get_resized_image()
+        self.assertEqual(e.exception.errno, errno.EACCES)
+
+    def test_flipped_entry_reads_unflipped_file(self):
+        roidb = [
+            {
+                'image': self.im_path,
+                'height': self.im_size[0],
+                'width': self.im_size[1],
+                'flipped': flipped
+            } for flipped in [False, True]
+        ]
+        old_cache_dir = cfg.TRAIN.IMAGE_CACHE_DIR
+        old_scales = cfg.TRAIN.SCALES
+        cfg.TRAIN.IMAGE_CACHE_DIR = self.cache_dir
+        cfg.TRAIN.SCALES = (60, )
+        try:
+            with mock.patch('cv2.imread', wraps=cv2.imread) as imread:
+                blob, im_scales = minibatch._get_image_blob(roidb, np.zeros)
+        finally:
+            cfg.TRAIN.IMAGE_CACHE_DIR = old_cache_dir
+            cfg.TRAIN.SCALES = old_scales
+        self.assertEqual(imread.call_count, 1)
+        self.assertEqual(len(self.get_cache_files()), 1)
+        self.assertEqual(im_scales[0], im_scales[1])
+        np.testing.assert_array_equal(blob[1], blob[0][:, :, ::-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,9 +34,11 @@ from detectron.roi_data.loader import RoIDataLoader
 import detectron.utils.logging as logging_utils
 
 
-def get_roidb_blobs(roidb):
+def get_roidb_blobs(roidb, zeros=np.zeros):
     blobs = {}
-    blobs['data'] = np.stack([entry['data'] for entry in roidb])
+    data = np.stack([entry['data'] for entry in roidb])
+    blobs['data'] = zeros(data.shape, data.dtype)
+    blobs['data'][...] = data
     return blobs, True
 
 
@@ -65,9 +67,17 @@ def get_roidb_sample_data(sample_data):
     return roidb
 
 
-def create_loader_and_network(sample_data, name):
+def create_loader_and_network(
+    sample_data, name, use_processes=False, shared_memory_slots=0,
+    shared_memory_slot_mb=0
+):
     roidb = get_roidb_sample_data(sample_data)
-    loader = RoIDataLoader(roidb)
+    loader = RoIDataLoader(
+        roidb,
+        use_processes=use_processes,
+        shared_memory_slots=shared_memory_slots,
+        shared_memory_slot_mb=shared_memory_slot_mb
+    )
     net = get_net(loader, 'dequeue_net_train')
     loader.register_sigint_handler()
     loader.start(prefill=False)
@@ -108,6 +118,30 @@ class TestRoIDataLoader(unittest.TestCase):
         test_loader.shutdown()
         train_loader.shutdown()
 
+    @mock.patch(
+        'detectron.roi_data.loader.get_minibatch_blob_names',
+        return_value=[u'data']
+    )
+    @mock.patch(
+        'detectron.roi_data.loader.get_minibatch',
+        side_effect=get_roidb_blobs
+    )
+    def test_two_parallel_process_loaders(self, _1, _2):
+        train_data = np.random.rand(2, 3, 3).astype(np.float32)
+        train_loader, train_net = create_loader_and_network(
+            train_data, 'dequeue_net_train', use_processes=True,
+            shared_memory_slots=2, shared_memory_slot_mb=1)
+        test_data = np.random.rand(2, 4, 4).astype(np.float32)
+        test_loader, test_net = create_loader_and_network(
+            test_data, 'dequeue_net_test', use_processes=True)
+        for _ in range(5):
+            data = run_net(train_net)
+            self.assertEqual(data[0].tolist(), train_data.tolist())
+            data = run_net(test_net)
+            self.assertEqual(data[0].tolist(), test_data.tolist())
+        test_loader.shutdown()
+        train_loader.shutdown()
+
 
 if __name__ == '__main__':
     workspace.GlobalInit(['caffe2', '--caffe2_log_level=0'])
@@ -0,0 +1,105 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+import unittest
+
+from detectron.utils.pipeline import OrderedThreadPool
+from detectron.utils.timer import Timer
+
+
+def sleep_and_return(x):
+    # Later items complete first
+    time.sleep(0.002 * (10 - x))
+    return x
+
+
+class TestOrderedThreadPool(unittest.TestCase):
+    def _test_imap(self, num_threads, max_pending):
+        timer = Timer()
+        pool = OrderedThreadPool(num_threads, timer=timer)
+        lock = threading.Lock()
+        in_flight = [0, 0]  # current, max
+
+        def fn(x):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            result = sleep_and_return(x)
+            with lock:
+                in_flight[0] -= 1
+            return result
+
+        try:
+            results = []
+            for x in pool.imap(fn, range(10), max_pending):
+                results.append(x)
+                self.assertLessEqual(len(pool), max_pending - 1)
+            self.assertEqual(results, list(range(10)))
+            self.assertEqual(timer.calls, 10)
+            self.assertLessEqual(
+                in_flight[1], max(1, min(num_threads, max_pending))
+            )
+        finally:
+            pool.close()
+
+    def test_imap_serial(self):
+        self._test_imap(0, 3)
+
+    def test_imap_threads(self):
+        self._test_imap(4, 3)
+
+    def test_imap_threads_no_prefetch(self):
+        self._test_imap(4, 1)
+
+    def test_submit(self):
+        for num_threads in [0, 3]:
+            pool = OrderedThreadPool(num_threads)
+            try:
+                for x in range(10):
+                    pool.submit(sleep_and_return, x)
+                self.assertEqual(len(pool), 10)
+                self.assertEqual(
+                    [pool.get() for _ in range(10)], list(range(10))
+                )
+                self.assertEqual(len(pool), 0)
+            finally:
+                pool.close()
+
+    def test_exception(self):
+        def fail(x):
+            raise ValueError(x)
+
+        for num_threads in [0, 2]:
+            pool = OrderedThreadPool(num_threads)
+            try:
+                if num_threads == 0:
+                    # Serial pools run the function in submit()
+                    self.assertRaises(ValueError, pool.submit, fail, 1)
+                else:
+                    pool.submit(fail, 1)
+                    self.assertRaises(ValueError, pool.get)
+            finally:
+                pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from detectron.utils.io import save_object
+import detectron.datasets.proposal_store as proposal_store
+
+
+class TestProposalStore(unittest.TestCase):
+    def test_convert(self):
+        rng = np.random.RandomState(0)
+        ids = [7, 3, 5, 1]
+        boxes = [
+            (rng.rand(n, 4) * 100).astype(np.float32) for n in [4, 0, 10, 1]
+        ]
+        scores = [rng.rand(len(b)).astype(np.float32) for b in boxes]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            proposal_file = os.path.join(tmp_dir, 'proposals.pkl')
+            store_dir = os.path.join(tmp_dir, 'proposals')
+            save_object(
+                dict(boxes=boxes, scores=scores, ids=ids), proposal_file
+            )
+            self.assertFalse(proposal_store.is_proposal_store(proposal_file))
+            proposal_store.convert_proposal_file(proposal_file, store_dir)
+            self.assertTrue(proposal_store.is_proposal_store(store_dir))
+            store = proposal_store.ProposalStore(store_dir)
+            self.assertEqual(len(store), len(ids))
+            for image_id, image_boxes, image_scores in zip(
+                ids, boxes, scores
+            ):
+                store_boxes, store_scores = store.get(image_id)
+                np.testing.assert_array_equal(store_boxes, image_boxes)
+                np.testing.assert_array_equal(store_scores, image_scores)
+            with self.assertRaises(AssertionError):
+                store.get(2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.core.test_retinanet as test_retinanet
+import detectron.utils.boxes as box_utils
+
+
+def reference_box_results(cls_probs, box_preds, im_scale, im_shape):
+    """The original per candidate / per class post-processing of
+    im_detect_bbox (with the channels of the class specific box deltas laid
+    out as in roi_data/retinanet.py)."""
+    anchors = test_retinanet._create_cell_anchors()
+    k_max, k_min = cfg.FPN.RPN_MAX_LEVEL, cfg.FPN.RPN_MIN_LEVEL
+    A = cfg.RETINANET.SCALES_PER_OCTAVE * len(cfg.RETINANET.ASPECT_RATIOS)
+    boxes_all = defaultdict(list)
+    for cnt, lvl in enumerate(range(k_min, k_max + 1)):
+        stride = 2. ** lvl
+        cell_anchors = anchors[lvl]
+        cls_prob = cls_probs[cnt]
+        box_pred = box_preds[cnt]
+        cls_prob = cls_prob.reshape((
+            cls_prob.shape[0], A, int(cls_prob.shape[1] / A),
+            cls_prob.shape[2], cls_prob.shape[3]))
+        cls_prob_ravel = cls_prob.ravel()
+        th = cfg.RETINANET.INFERENCE_TH if lvl < k_max else 0.0
+        candidate_inds = np.where(cls_prob_ravel > th)[0]
+        if (len(candidate_inds) == 0):
+            continue
+        pre_nms_topn = min(cfg.RETINANET.PRE_NMS_TOP_N, len(candidate_inds))
+        inds = np.argpartition(
+            cls_prob_ravel[candidate_inds], -pre_nms_topn)[-pre_nms_topn:]
+        inds = candidate_inds[inds]
+        inds_5d = np.array(np.unravel_index(inds, cls_prob.shape)).transpose()
+        classes = inds_5d[:, 2]
+        anchor_ids, y, x = inds_5d[:, 1], inds_5d[:, 3], inds_5d[:, 4]
+        scores = cls_prob[:, anchor_ids, classes, y, x]
+        boxes = np.column_stack((x, y, x, y)).astype(dtype=np.float32)
+        boxes *= stride
+        boxes += cell_anchors[anchor_ids, :]
+        if not cfg.RETINANET.CLASS_SPECIFIC_BBOX:
+            box_pred = box_pred.reshape((
+                box_pred.shape[0], A, 4, box_pred.shape[2],
+                box_pred.shape[3]))
+            box_deltas = box_pred[0, anchor_ids, :, y, x]
+        else:
+            box_cls_inds = (
+                anchor_ids * (cfg.MODEL.NUM_CLASSES - 1) + classes) * 4
+            box_deltas = np.vstack(
+                [box_pred[0, ind:ind + 4, yi, xi]
+                 for ind, yi, xi in zip(box_cls_inds, y, x)]
+            )
+        pred_boxes = box_utils.bbox_transform(boxes, box_deltas)
+        pred_boxes /= im_scale
+        pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im_shape)
+        box_scores = np.zeros((pred_boxes.shape[0], 5))
+        box_scores[:, 0:4] = pred_boxes
+        box_scores[:, 4] = scores
+        for cls in range(1, cfg.MODEL.NUM_CLASSES):
+            inds = np.where(classes == cls - 1)[0]
+            if len(inds) > 0:
+                boxes_all[cls].extend(box_scores[inds, :])
+
+    detections = []
+    for cls, boxes in boxes_all.items():
+        cls_dets = np.vstack(boxes).astype(dtype=np.float32)
+        keep = box_utils.nms(cls_dets, cfg.TEST.NMS)
+        cls_dets = cls_dets[keep, :]
+        out = np.zeros((len(keep), 6))
+        out[:, 0:5] = cls_dets
+        out[:, 5].fill(cls)
+        detections.append(out)
+    detections = np.vstack(detections)
+    inds = np.argsort(-detections[:, 4])
+    detections = detections[inds[0:cfg.TEST.DETECTIONS_PER_IM], :]
+    cls_boxes = [[] for _ in range(cfg.MODEL.NUM_CLASSES)]
+    for c in range(1, cfg.MODEL.NUM_CLASSES):
+        inds = np.where(detections[:, 5] == c)[0]
+        cls_boxes[c] = detections[inds, :5]
+    return cls_boxes
+
+
+class TestRetinaNetInference(unittest.TestCase):
+    def _test_equivalence(self, class_specific_bbox, detections_per_im):
+        rng = np.random.RandomState(0)
+        old_cfg = (
+            cfg.MODEL.NUM_CLASSES, cfg.RETINANET.CLASS_SPECIFIC_BBOX,
+            cfg.TEST.DETECTIONS_PER_IM, cfg.TEST.BBOX_REG
+        )
+        cfg.MODEL.NUM_CLASSES = 6
+        cfg.RETINANET.CLASS_SPECIFIC_BBOX = class_specific_bbox
+        cfg.TEST.DETECTIONS_PER_IM = detections_per_im
+        cfg.TEST.BBOX_REG = True
+        try:
+            A = cfg.RETINANET.SCALES_PER_OCTAVE * len(
+                cfg.RETINANET.ASPECT_RATIOS
+            )
+            C = cfg.MODEL.NUM_CLASSES - 1
+            bbox_dim = 4 * C if class_specific_bbox else 4
+            im_shape = (300, 450, 3)
+            im_scale = 1.5
+            cls_probs, box_preds = [], []
+            for lvl in range(cfg.FPN.RPN_MIN_LEVEL, cfg.FPN.RPN_MAX_LEVEL + 1):
+                H = int(np.ceil(im_shape[0] * im_scale / 2**lvl))
+                W = int(np.ceil(im_shape[1] * im_scale / 2**lvl))
+                cls_probs.append(
+                    (rng.rand(1, A * C, H, W) ** 4).astype(np.float32)
+                )
+                box_preds.append(
+                    (rng.randn(1, A * bbox_dim, H, W) * 0.2).astype(np.float32)
+                )
+            cls_boxes = test_retinanet.box_results_from_outputs(
+                cls_probs, box_preds, im_scale, im_shape
+            )
+            ref_cls_boxes = reference_box_results(
+                cls_probs, box_preds, im_scale, im_shape
+            )
+            self.assertEqual(len(cls_boxes), len(ref_cls_boxes))
+            for boxes, ref_boxes in zip(cls_boxes[1:], ref_cls_boxes[1:]):
+                self.assertEqual(boxes.dtype, ref_boxes.dtype)
+                np.testing.assert_array_equal(boxes, ref_boxes)
+        finally:
+            (
+                cfg.MODEL.NUM_CLASSES, cfg.RETINANET.CLASS_SPECIFIC_BBOX,
+                cfg.TEST.DETECTIONS_PER_IM, cfg.TEST.BBOX_REG
+            ) = old_cfg
+
+    def test_equivalence(self):
+        self._test_equivalence(False, 100)
+
+    def test_equivalence_class_specific_bbox(self):
+        self._test_equivalence(True, 100)
+
+    def test_equivalence_all_detections(self):
+        self._test_equivalence(False, 100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
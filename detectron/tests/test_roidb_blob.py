@@ -0,0 +1,94 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import scipy.sparse
+import unittest
+
+import detectron.utils.roidb_blob as roidb_blob_utils
+
+
+def random_entry(rng, num_boxes, num_classes=81, num_keypoints=17):
+    gt_classes = rng.randint(1, num_classes, size=num_boxes).astype(np.int32)
+    is_crowd = np.zeros(num_boxes, dtype=np.bool_)
+    is_crowd[-1] = True
+    gt_overlaps = np.zeros((num_boxes, num_classes), dtype=np.float32)
+    gt_overlaps[np.arange(num_boxes), gt_classes] = 1.0
+    gt_overlaps[is_crowd, :] = -1.0
+    segms = [
+        [(rng.rand(2 * rng.randint(3, 10)) * 100).tolist()
+         for _ in range(rng.randint(1, 3))]
+        for _ in range(num_boxes - 3)
+    ]
+    # Uncompressed, compressed and flipped (list of compressed) RLEs
+    segms.append({'size': [20, 30], 'counts': [5, 10, 585]})
+    segms.append({'size': [20, 30], 'counts': b'Z9;0'})
+    segms.append([{'size': [20, 30], 'counts': b'0W;'}])
+    return {
+        'boxes': (rng.rand(num_boxes, 4) * 100).astype(np.float32),
+        'gt_classes': gt_classes,
+        'seg_areas': rng.rand(num_boxes).astype(np.float32),
+        'is_crowd': is_crowd,
+        'box_to_gt_ind_map': np.arange(num_boxes, dtype=np.int32),
+        'gt_overlaps': scipy.sparse.csr_matrix(gt_overlaps),
+        'segms': segms,
+        'gt_keypoints': rng.randint(
+            0, 100, size=(num_boxes, 3, num_keypoints)
+        ).astype(np.int32),
+        'has_visible_keypoints': True,
+        # Not part of the minimal roidb
+        'image': 'image.jpg',
+    }
+
+
+class TestRoidbBlob(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        roidb = [random_entry(rng, 8), random_entry(rng, 4)]
+        blob = roidb_blob_utils.serialize(roidb)
+        self.assertEqual(blob.dtype, np.int32)
+        decoded = roidb_blob_utils.deserialize(blob)
+        self.assertEqual(len(decoded), len(roidb))
+        for entry, decoded_entry in zip(roidb, decoded):
+            self.assertEqual(
+                set(decoded_entry.keys()), set(entry.keys()) - {'image'}
+            )
+            for k in ['boxes', 'gt_classes', 'seg_areas', 'is_crowd',
+                      'box_to_gt_ind_map', 'gt_keypoints']:
+                self.assertEqual(decoded_entry[k].dtype, entry[k].dtype)
+                np.testing.assert_array_equal(decoded_entry[k], entry[k])
+            np.testing.assert_array_equal(
+                decoded_entry['gt_overlaps'].toarray(),
+                entry['gt_overlaps'].toarray()
+            )
+            self.assertEqual(decoded_entry['segms'], entry['segms'])
+            self.assertEqual(decoded_entry['has_visible_keypoints'], True)
+
+    def test_entries_are_not_shared(self):
+        rng = np.random.RandomState(0)
+        blob = roidb_blob_utils.serialize([random_entry(rng, 5)])
+        decoded = roidb_blob_utils.deserialize(blob)
+        decoded[0]['boxes'] = np.zeros((0, 4), dtype=np.float32)
+        decoded_again = roidb_blob_utils.deserialize(blob)
+        self.assertEqual(decoded_again[0]['boxes'].shape, (5, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
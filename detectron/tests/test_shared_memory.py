@@ -0,0 +1,67 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.utils.shared_memory import SharedMemorySlotPool
+from detectron.utils.shared_memory import SlotWriter
+
+
+class TestSlotWriter(unittest.TestCase):
+    def setUp(self):
+        self.pool = SharedMemorySlotPool(2, 1024)
+
+    def test_zeros_are_written_in_place(self):
+        writer = SlotWriter(self.pool, 1)
+        data = writer.zeros((2, 3, 4), np.float32)
+        self.assertEqual(data.tolist(), np.zeros((2, 3, 4)).tolist())
+        data[...] = np.arange(data.size).reshape(data.shape)
+        labels = np.array([1, 2, 3], dtype=np.int32)
+        metadata = writer.write([data, labels])
+        # The data array is already stored in the slot; labels is copied
+        self.assertEqual(metadata[0][2], self.pool.slot_bytes)
+        out = self.pool.read(metadata)
+        self.assertTrue(np.shares_memory(out[0], data))
+        self.assertEqual(out[0].tolist(), data.tolist())
+        self.assertEqual(out[1].tolist(), labels.tolist())
+        self.assertEqual(out[1].dtype, np.int32)
+
+    def test_reset_reuses_the_slot(self):
+        writer = SlotWriter(self.pool, 0)
+        writer.zeros((200, ), np.float32)
+        writer.reset()
+        data = writer.zeros((200, ), np.float32)
+        self.assertEqual(writer.write([data])[0][2], 0)
+
+    def test_arrays_that_do_not_fit(self):
+        writer = SlotWriter(self.pool, 0)
+        # Allocated outside of the slot if there is no room left for it
+        data = writer.zeros((300, ), np.float32)
+        slot = self.pool.read([('|u1', (self.pool.slot_bytes, ), 0)])[0]
+        self.assertFalse(np.shares_memory(data, slot))
+        self.assertFalse(writer.fits([data]))
+        small = writer.zeros((16, ), np.float32)
+        self.assertTrue(writer.fits([small, np.zeros(200, np.float32)]))
+        self.assertFalse(writer.fits([small, np.zeros(250, np.float32)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
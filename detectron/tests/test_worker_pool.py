@@ -0,0 +1,109 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from detectron.core.config import cfg
+import detectron.utils.subprocess as subprocess_utils
+
+# A worker binary that squares the indices of its chunks, and fails on chunks
+# that hold a negative index
+_WORKER_SCRIPT = """#!{python}
+import argparse
+import detectron.utils.subprocess as subprocess_utils
+
+def process_chunk(inds):
+    assert min(inds) >= 0
+    return [i * i for i in inds]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--worker', dest='worker_address')
+parser.add_argument('--cfg', dest='cfg_file')
+parser.add_argument('opts', nargs=argparse.REMAINDER)
+args = parser.parse_args()
+subprocess_utils.run_worker(args.worker_address, process_chunk)
+"""
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.binary = os.path.join(self.output_dir, 'worker.py')
+        with open(self.binary, 'w') as f:
+            f.write(_WORKER_SCRIPT.format(python=sys.executable))
+        os.chmod(self.binary, os.stat(self.binary).st_mode | stat.S_IEXEC)
+        self.old_cpu_cfg = dict(cfg.CPU_INFERENCE)
+        # Run the workers on the CPU, without pinning them to cores (the test
+        # machine may have fewer cores than workers)
+        cfg.CPU_INFERENCE.ENABLED = True
+        cfg.CPU_INFERENCE.PIN_WORKERS = False
+
+    def tearDown(self):
+        cfg.CPU_INFERENCE.update(self.old_cpu_cfg)
+        shutil.rmtree(self.output_dir)
+
+    def test_results(self):
+        chunks = [list(range(start, start + 3)) for start in range(0, 30, 3)]
+        cfg.CPU_INFERENCE.NUM_WORKERS = 3
+        results = dict(
+            subprocess_utils.process_in_worker_pool(
+                'test', chunks, self.binary, self.output_dir,
+                poll_interval=0.1
+            )
+        )
+        self.assertEqual(sorted(results.keys()), list(range(len(chunks))))
+        for chunk_index, chunk in enumerate(chunks):
+            self.assertEqual(results[chunk_index], [i * i for i in chunk])
+
+    def test_worker_failure(self):
+        chunks = [[0, 1], [-1], [2, 3]]
+        cfg.CPU_INFERENCE.NUM_WORKERS = 2
+        with self.assertRaises(AssertionError):
+            list(
+                subprocess_utils.process_in_worker_pool(
+                    'test', chunks, self.binary, self.output_dir,
+                    poll_interval=0.1
+                )
+            )
+
+    def test_cpu_worker_settings(self):
+        cfg.CPU_INFERENCE.NUM_WORKERS = 2
+        cfg.CPU_INFERENCE.THREADS_PER_WORKER = 3
+        worker_settings = subprocess_utils._get_worker_settings()
+        self.assertEqual(len(worker_settings), 2)
+        for worker_env, cmd_prefix in worker_settings:
+            self.assertEqual(worker_env['CUDA_VISIBLE_DEVICES'], '')
+            self.assertEqual(worker_env['OMP_NUM_THREADS'], '3')
+            self.assertEqual(worker_env['MKL_NUM_THREADS'], '3')
+            self.assertEqual(cmd_prefix, '')
+
+    def test_chunks(self):
+        chunks = subprocess_utils.get_chunks(40)
+        self.assertEqual(sum(chunks, []), list(range(40)))
+        self.assertTrue(all(len(chunk) > 0 for chunk in chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
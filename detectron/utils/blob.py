@@ -48,12 +48,10 @@ def get_image_blob(im, target_scale, target_max_size):
         im_scale (float): image scale (target size) / (original size)
         im_info (ndarray)
     """
-    processed_im, im_scale = prep_im_for_blob(
-        im, cfg.PIXEL_MEANS, target_scale, target_max_size
-    )
-    blob = im_list_to_blob(processed_im)
+    im_scale = get_im_scale(im.shape, target_scale, target_max_size)
+    blob = prep_ims_for_blob([im], cfg.PIXEL_MEANS, [im_scale])
     # NOTE: this height and width may be larger than actual scaled input image
-    # due to the FPN.COARSEST_STRIDE related padding in im_list_to_blob. We are
+    # due to the FPN.COARSEST_STRIDE related padding in prep_ims_for_blob. We are
     # maintaining this behavior for now to make existing results exactly
     # reproducible (in practice using the true input image height and width
     # yields nearly the same results, but they are sometimes slightly different
@@ -64,6 +62,33 @@ def get_image_blob(im, target_scale, target_max_size):
     return blob, im_scale, im_info.astype(np.float32)
 
 
+def get_image_batch_blob(ims, target_scale, target_max_size):
+    """Convert a list of images into a single, zero padded network input.
+
+    Arguments:
+        ims (list): color images in BGR order
+
+    Returns:
+        blob (ndarray): a data blob holding the images
+        im_scales (list): image scale (target size) / (original size) of each
+            image
+        im_info (ndarray): (num images, 3) im_info of each image, holding the
+            height and width of the blob that the image would have on its own
+            (see get_image_blob)
+    """
+    im_scales = [
+        get_im_scale(im.shape, target_scale, target_max_size) for im in ims
+    ]
+    blob = prep_ims_for_blob(ims, cfg.PIXEL_MEANS, im_scales)
+    im_info = np.zeros((len(ims), 3), dtype=np.float32)
+    for i, (im, im_scale) in enumerate(zip(ims, im_scales)):
+        # Resized shape, rounded as in cv2.resize
+        resized_shape = np.round(np.array(im.shape[:2]) * im_scale)
+        im_info[i, :2] = get_max_shape([resized_shape])
+        im_info[i, 2] = im_scale
+    return blob, im_scales, im_info
+
+
 def im_list_to_blob(ims):
     """Convert a list of images into a network input. Assumes images were
     prepared using prep_im_for_blob or equivalent: i.e.
@@ -76,13 +101,7 @@ def im_list_to_blob(ims):
     """
     if not isinstance(ims, list):
         ims = [ims]
-    max_shape = np.array([im.shape for im in ims]).max(axis=0)
-    # Pad the image so they can be divisible by a stride
-    if cfg.FPN.FPN_ON:
-        stride = float(cfg.FPN.COARSEST_STRIDE)
-        max_shape[0] = int(np.ceil(max_shape[0] / stride) * stride)
-        max_shape[1] = int(np.ceil(max_shape[1] / stride) * stride)
-
+    max_shape = get_max_shape([im.shape for im in ims])
     num_images = len(ims)
     blob = np.zeros(
         (num_images, max_shape[0], max_shape[1], 3), dtype=np.float32
@@ -97,6 +116,56 @@ def im_list_to_blob(ims):
     return blob
 
 
+def get_max_shape(im_shapes):
+    """Return the (height, width) of a blob that can hold images of the given
+    shapes, padded so that it is divisible by FPN.COARSEST_STRIDE if needed.
+    """
+    max_shape = np.array([im_shape[:2] for im_shape in im_shapes]).max(axis=0)
+    # Pad the image so they can be divisible by a stride
+    if cfg.FPN.FPN_ON:
+        stride = float(cfg.FPN.COARSEST_STRIDE)
+        max_shape[0] = int(np.ceil(max_shape[0] / stride) * stride)
+        max_shape[1] = int(np.ceil(max_shape[1] / stride) * stride)
+    return max_shape
+
+
+def prep_ims_for_blob(ims, pixel_means, im_scales, zeros=np.zeros):
+    """Convert a list of images into a network input. This is a fused version
+    of prep_im_for_blob followed by im_list_to_blob: each image (BGR, usually
+    uint8) is resized by its scale factor in im_scales (images with a scale
+    factor of 1 are used as is), then written with pixel_means subtracted
+    straight into a zero padded, C-contiguous float32 NCHW blob. Resizing before
+    subtracting the means means that, for uint8 images, the result differs from
+    that of prep_im_for_blob + im_list_to_blob by the rounding of the resized
+    pixels only. The blob is allocated with zeros(shape, dtype), which lets the
+    caller build it in place (e.g., in shared memory).
+    """
+    resized_ims = []
+    for im, im_scale in zip(ims, im_scales):
+        if im_scale != 1.0:
+            im = cv2.resize(
+                np.ascontiguousarray(im),
+                None,
+                None,
+                fx=im_scale,
+                fy=im_scale,
+                interpolation=cv2.INTER_LINEAR
+            )
+        resized_ims.append(im)
+    max_shape = get_max_shape([im.shape for im in resized_ims])
+    blob = zeros(
+        (len(resized_ims), 3, max_shape[0], max_shape[1]), np.float32
+    )
+    pixel_means = np.asarray(pixel_means).reshape((3, 1, 1))
+    for i, im in enumerate(resized_ims):
+        # Move channels (axis 2) to axis 0 while subtracting the means
+        np.subtract(
+            im.transpose((2, 0, 1)), pixel_means,
+            out=blob[i, :, :im.shape[0], :im.shape[1]]
+        )
+    return blob
+
+
 def prep_im_for_blob(im, pixel_means, target_size, max_size):
     """Prepare an image for use as a network input blob. Specially:
       - Subtract per-channel pixel mean
@@ -107,13 +176,7 @@ def prep_im_for_blob(im, pixel_means, target_size, max_size):
     """
     im = im.astype(np.float32, copy=False)
     im -= pixel_means
-    im_shape = im.shape
-    im_size_min = np.min(im_shape[0:2])
-    im_size_max = np.max(im_shape[0:2])
-    im_scale = float(target_size) / float(im_size_min)
-    # Prevent the biggest axis from being more than max_size
-    if np.round(im_scale * im_size_max) > max_size:
-        im_scale = float(max_size) / float(im_size_max)
+    im_scale = get_im_scale(im.shape, target_size, max_size)
     im = cv2.resize(
         im,
         None,
@@ -125,6 +188,20 @@ def prep_im_for_blob(im, pixel_means, target_size, max_size):
     return im, im_scale
 
 
+def get_im_scale(im_shape, target_size, max_size):
+    """Return the scale factor that resizes an image of shape im_shape so that
+    its shorter side is target_size, while its longer side is capped at
+    max_size.
+    """
+    im_size_min = np.min(im_shape[0:2])
+    im_size_max = np.max(im_shape[0:2])
+    im_scale = float(target_size) / float(im_size_min)
+    # Prevent the biggest axis from being more than max_size
+    if np.round(im_scale * im_size_max) > max_size:
+        im_scale = float(max_size) / float(im_size_max)
+    return im_scale
+
+
 def zeros(shape, int32=False):
     """Return a blob of all zeros of the given shape with the correct float or
     int data type.
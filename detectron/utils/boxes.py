@@ -266,47 +266,57 @@ def box_voting(top_dets, all_dets, thresh, scoring_method='ID', beta=1.0):
     """
     # top_dets is [N, 5] each row is [x1 y1 x2 y2, sore]
     # all_dets is [N, 5] each row is [x1 y1 x2 y2, sore]
+    if scoring_method not in (
+        'ID', 'TEMP_AVG', 'AVG', 'IOU_AVG', 'GENERALIZED_AVG', 'QUASI_SUM'
+    ):
+        raise NotImplementedError(
+            'Unknown scoring method {}'.format(scoring_method)
+        )
     top_dets_out = top_dets.copy()
-    top_boxes = top_dets[:, :4]
-    all_boxes = all_dets[:, :4]
-    all_scores = all_dets[:, 4]
-    top_to_all_overlaps = bbox_overlaps(top_boxes, all_boxes)
-    for k in range(top_dets_out.shape[0]):
-        inds_to_vote = np.where(top_to_all_overlaps[k] >= thresh)[0]
-        boxes_to_vote = all_boxes[inds_to_vote, :]
-        ws = all_scores[inds_to_vote]
-        top_dets_out[k, :4] = np.average(boxes_to_vote, axis=0, weights=ws)
-        if scoring_method == 'ID':
-            # Identity, nothing to do
-            pass
-        elif scoring_method == 'TEMP_AVG':
-            # Average probabilities (considered as P(detected class) vs.
-            # P(not the detected class)) after smoothing with a temperature
-            # hyperparameter.
-            P = np.vstack((ws, 1.0 - ws))
-            P_max = np.max(P, axis=0)
-            X = np.log(P / P_max)
-            X_exp = np.exp(X / beta)
-            P_temp = X_exp / np.sum(X_exp, axis=0)
-            P_avg = P_temp[0].mean()
-            top_dets_out[k, 4] = P_avg
-        elif scoring_method == 'AVG':
-            # Combine new probs from overlapping boxes
-            top_dets_out[k, 4] = ws.mean()
-        elif scoring_method == 'IOU_AVG':
-            P = ws
-            ws = top_to_all_overlaps[k, inds_to_vote]
-            P_avg = np.average(P, weights=ws)
-            top_dets_out[k, 4] = P_avg
-        elif scoring_method == 'GENERALIZED_AVG':
-            P_avg = np.mean(ws**beta)**(1.0 / beta)
-            top_dets_out[k, 4] = P_avg
-        elif scoring_method == 'QUASI_SUM':
-            top_dets_out[k, 4] = ws.sum() / float(len(ws))**beta
-        else:
-            raise NotImplementedError(
-                'Unknown scoring method {}'.format(scoring_method)
-            )
+    num_top = top_dets.shape[0]
+    top_to_all_overlaps = bbox_overlaps(top_dets[:, :4], all_dets[:, :4])
+    # (top det, voting det) pairs of the thresholded overlaps, grouped by top
+    # det; the votes are reduced per top det with weighted bincounts
+    top_inds, vote_inds = np.nonzero(top_to_all_overlaps >= thresh)
+    boxes_to_vote = all_dets[vote_inds, :4].astype(np.float64)
+    ws = all_dets[vote_inds, 4].astype(np.float64)
+    num_votes = np.bincount(top_inds, minlength=num_top)
+    ws_sum = np.bincount(top_inds, weights=ws, minlength=num_top)
+    for j in range(4):
+        top_dets_out[:, j] = np.bincount(
+            top_inds, weights=ws * boxes_to_vote[:, j], minlength=num_top
+        ) / ws_sum
+    if scoring_method == 'ID':
+        # Identity, nothing to do
+        pass
+    elif scoring_method == 'TEMP_AVG':
+        # Average probabilities (considered as P(detected class) vs.
+        # P(not the detected class)) after smoothing with a temperature
+        # hyperparameter.
+        P = np.vstack((ws, 1.0 - ws))
+        P_max = np.max(P, axis=0)
+        X = np.log(P / P_max)
+        X_exp = np.exp(X / beta)
+        P_temp = X_exp / np.sum(X_exp, axis=0)
+        top_dets_out[:, 4] = np.bincount(
+            top_inds, weights=P_temp[0], minlength=num_top
+        ) / num_votes
+    elif scoring_method == 'AVG':
+        # Combine new probs from overlapping boxes
+        top_dets_out[:, 4] = ws_sum / num_votes
+    elif scoring_method == 'IOU_AVG':
+        # Average of the probs weighted by the overlaps
+        vote_overlaps = top_to_all_overlaps[top_inds, vote_inds]
+        top_dets_out[:, 4] = np.bincount(
+            top_inds, weights=ws * vote_overlaps, minlength=num_top
+        ) / np.bincount(top_inds, weights=vote_overlaps, minlength=num_top)
+    elif scoring_method == 'GENERALIZED_AVG':
+        top_dets_out[:, 4] = (
+            np.bincount(top_inds, weights=ws**beta, minlength=num_top) /
+            num_votes
+        )**(1.0 / beta)
+    elif scoring_method == 'QUASI_SUM':
+        top_dets_out[:, 4] = ws_sum / num_votes.astype(np.float64)**beta
 
     return top_dets_out
 
@@ -315,9 +325,48 @@ def nms(dets, thresh):
     """Apply classic DPM-style greedy NMS."""
     if dets.shape[0] == 0:
         return []
+    if _use_bitmask_nms():
+        return batched_nms(dets, [0, dets.shape[0]], thresh)
     return cython_nms.nms(dets, thresh)
 
 
+def batched_nms(dets, set_offsets, thresh, max_keep=-1):
+    """Apply classic DPM-style greedy NMS independently to each set of
+    detections dets[set_offsets[s]:set_offsets[s + 1]] (e.g., to the
+    detections of each class) in a single call. Returns the increasing indices
+    of the kept detections. The sets are processed in parallel on all CPU
+    cores. If max_keep > 0, at most the max_keep highest scoring detections
+    are kept in each set, and NMS stops once they are found.
+    """
+    return cython_nms.batched_nms(
+        dets, np.asarray(set_offsets, dtype=np.int64), thresh,
+        max_keep=max_keep, bitmask=_use_bitmask_nms()
+    )
+
+
+def nms_per_set(dets, set_offsets, thresh, max_keep=-1):
+    """Same as batched_nms, but returns the list of the indices of the kept
+    detections of each set, relative to the start of the set (i.e., the result
+    of nms on each set).
+    """
+    set_offsets = np.asarray(set_offsets, dtype=np.int64)
+    keep = batched_nms(dets, set_offsets, thresh, max_keep=max_keep)
+    keep_offsets = np.searchsorted(keep, set_offsets)
+    return [
+        keep[keep_offsets[s]:keep_offsets[s + 1]] - set_offsets[s]
+        for s in range(len(set_offsets) - 1)
+    ]
+
+
+def _use_bitmask_nms():
+    """Whether cfg.NMS_KERNEL selects the bitmask-tiled NMS kernel."""
+    if cfg.NMS_KERNEL == 'greedy':
+        return False
+    elif cfg.NMS_KERNEL == 'bitmask':
+        return True
+    raise ValueError('NMS_KERNEL must be "greedy" or "bitmask"')
+
+
 def soft_nms(
     dets, sigma=0.5, overlap_thresh=0.3, score_thresh=0.001, method='linear'
 ):
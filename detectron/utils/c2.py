@@ -30,6 +30,7 @@ from caffe2.python import dyndep
 from caffe2.python import scope
 from caffe2.python import workspace
 
+from detectron.core.config import cfg
 import detectron.utils.env as envu
 
 
@@ -102,6 +103,19 @@ def UnscopeName(possibly_scoped_name):
         possibly_scoped_name.rfind(scope._NAMESCOPE_SEPARATOR) + 1:]
 
 
+def get_cpu_inference_init_args():
+    """Return the Caffe2 GlobalInit arguments that set the number of intra-op
+    threads in CPU inference mode (see cfg.CPU_INFERENCE.THREADS_PER_WORKER).
+    """
+    num_threads = cfg.CPU_INFERENCE.THREADS_PER_WORKER
+    if not cfg.CPU_INFERENCE.ENABLED or num_threads <= 0:
+        return []
+    return [
+        '--caffe2_omp_num_threads={}'.format(num_threads),
+        '--caffe2_mkl_num_threads={}'.format(num_threads)
+    ]
+
+
 @contextlib.contextmanager
 def NamedCudaScope(gpu_id):
     """Creates a GPU name scope and CUDA device scope. This function is provided
@@ -111,6 +125,20 @@ def NamedCudaScope(gpu_id):
             yield
 
 
+@contextlib.contextmanager
+def NamedDeviceScope(gpu_id):
+    """Creates the GPU name scope of `gpu_id` and the device scope used for
+    inference: the CUDA device `gpu_id`, or the CPU in CPU inference mode (see
+    cfg.CPU_INFERENCE)."""
+    if cfg.CPU_INFERENCE.ENABLED:
+        with GpuNameScope(gpu_id):
+            with CpuScope():
+                yield
+    else:
+        with NamedCudaScope(gpu_id):
+            yield
+
+
 @contextlib.contextmanager
 def GpuNameScope(gpu_id):
     """Create a name scope for GPU device `gpu_id`."""
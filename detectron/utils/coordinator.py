@@ -31,8 +31,9 @@ log = logging.getLogger(__name__)
 
 class Coordinator(object):
 
-    def __init__(self):
-        self._event = threading.Event()
+    def __init__(self, event=None):
+        # A multiprocessing.Event may be passed in to coordinate with processes
+        self._event = threading.Event() if event is None else event
 
     def request_stop(self):
         log.debug('Coordinator stopping')
@@ -71,3 +71,95 @@ def bbox_overlaps(
                         )
                         overlaps[n, k] = iw * ih / ua
     return overlaps
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_t _overlap(
+        const DTYPE_t[:, :] boxes, Py_ssize_t n,
+        const DTYPE_t[:, :] query_boxes, Py_ssize_t k) nogil:
+    # Same arithmetic as in bbox_overlaps
+    cdef DTYPE_t iw, ih, box_area
+    cdef DTYPE_t ua
+    box_area = (
+        (query_boxes[k, 2] - query_boxes[k, 0] + 1) *
+        (query_boxes[k, 3] - query_boxes[k, 1] + 1)
+    )
+    iw = (
+        min(boxes[n, 2], query_boxes[k, 2]) -
+        max(boxes[n, 0], query_boxes[k, 0]) + 1
+    )
+    if iw > 0:
+        ih = (
+            min(boxes[n, 3], query_boxes[k, 3]) -
+            max(boxes[n, 1], query_boxes[k, 1]) + 1
+        )
+        if ih > 0:
+            ua = float(
+                (boxes[n, 2] - boxes[n, 0] + 1) *
+                (boxes[n, 3] - boxes[n, 1] + 1) +
+                box_area - iw * ih
+            )
+            return iw * ih / ua
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def grid_bbox_overlaps_max(
+        const DTYPE_t[:, :] anchors,
+        const DTYPE_t[:, :] query_boxes,
+        const np.int64_t[:, :, :] cell_ranges,
+        Py_ssize_t field_size,
+        const np.int64_t[:] anchor_pos,
+        DTYPE_t[:] anchor_max,
+        np.int64_t[:] anchor_argmax,
+        DTYPE_t[:] query_max,
+        np.uint8_t[:] anchor_is_max=None):
+    """
+    Reduce the overlaps between a field of anchors and the query boxes
+    without computing the dense (N, K) overlaps.
+
+    Parameters
+    ----------
+    anchors: (F * F * A, 4) ndarray of float, A anchors at each cell of an
+      (F, F) grid
+    query_boxes: (K, 4) ndarray of float
+    cell_ranges: (K, A, 4) ndarray of int, the (x_lo, x_hi, y_lo, y_hi)
+      inclusive range of cells of the anchors that may overlap each query box
+    field_size: F
+    anchor_pos: (F * F * A, ) ndarray of int, the output position of each
+      anchor (or -1 to ignore it)
+    anchor_max, anchor_argmax, query_max: the per anchor max overlap (and
+      first query box with it) and the per query box max overlap, updated
+      in place
+    anchor_is_max: if given, only mark the anchors whose overlap with some
+      query box equals its query_max (which must be final)
+    """
+    cdef Py_ssize_t K = query_boxes.shape[0]
+    cdef Py_ssize_t A = cell_ranges.shape[1]
+    cdef Py_ssize_t F = field_size
+    cdef Py_ssize_t k, a, ix, iy, n, pos
+    cdef bint mark_ties = anchor_is_max is not None
+    cdef DTYPE_t overlap
+    with nogil:
+        for k in range(K):
+            for a in range(A):
+                for iy in range(cell_ranges[k, a, 2], cell_ranges[k, a, 3] + 1):
+                    for ix in range(
+                        cell_ranges[k, a, 0], cell_ranges[k, a, 1] + 1
+                    ):
+                        n = (iy * F + ix) * A + a
+                        pos = anchor_pos[n]
+                        if pos < 0:
+                            continue
+                        overlap = _overlap(anchors, n, query_boxes, k)
+                        if overlap <= 0:
+                            continue
+                        if mark_ties:
+                            if overlap == query_max[k]:
+                                anchor_is_max[pos] = 1
+                            continue
+                        if overlap > anchor_max[pos]:
+                            anchor_max[pos] = overlap
+                            anchor_argmax[pos] = k
+                        if overlap > query_max[k]:
+                            query_max[k] = overlap
@@ -22,6 +22,9 @@
 # --------------------------------------------------------
 
 cimport cython
+from cython.parallel import prange
+cimport openmp
+from libc.stdlib cimport calloc, free
 import numpy as np
 cimport numpy as np
 
@@ -86,6 +89,221 @@ def nms(np.ndarray[np.float32_t, ndim=2] dets, np.float32_t thresh):
 
     return np.where(suppressed == 0)[0]
 
+
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+cdef int _nms_set(
+    np.float32_t* x1,
+    np.float32_t* y1,
+    np.float32_t* x2,
+    np.float32_t* y2,
+    np.float32_t* areas,
+    np.intp_t* order,
+    int ndets,
+    np.float32_t thresh,
+    int max_keep,
+    np.uint8_t* suppressed
+) nogil:
+    """Greedy NMS of the ndets boxes order[0], ..., order[ndets - 1] (sorted by
+    decreasing score). Same as the loop in nms, but stops (suppressing all
+    remaining boxes) once max_keep boxes are kept if max_keep > 0. Returns 0
+    (an int rather than void, such that calls do not need to check for
+    exceptions with the GIL)."""
+    cdef int _i, _j
+    cdef int nkeep = 0
+    cdef np.intp_t i, j
+    cdef np.float32_t ix1, iy1, ix2, iy2, iarea
+    cdef np.float32_t xx1, yy1, xx2, yy2
+    cdef np.float32_t w, h
+    cdef np.float32_t inter, ovr
+
+    for _i in range(ndets):
+        i = order[_i]
+        if suppressed[i] == 1:
+            continue
+        nkeep += 1
+        if nkeep == max_keep:
+            for _j in range(_i + 1, ndets):
+                suppressed[order[_j]] = 1
+            break
+        ix1 = x1[i]
+        iy1 = y1[i]
+        ix2 = x2[i]
+        iy2 = y2[i]
+        iarea = areas[i]
+        for _j in range(_i + 1, ndets):
+            j = order[_j]
+            if suppressed[j] == 1:
+                continue
+            xx1 = max(ix1, x1[j])
+            yy1 = max(iy1, y1[j])
+            xx2 = min(ix2, x2[j])
+            yy2 = min(iy2, y2[j])
+            w = max(0.0, xx2 - xx1 + 1)
+            h = max(0.0, yy2 - yy1 + 1)
+            inter = w * h
+            ovr = inter / (iarea + areas[j] - inter)
+            if ovr >= thresh:
+                suppressed[j] = 1
+    return 0
+
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+cdef int _nms_set_bitmask(
+    np.float32_t* x1,
+    np.float32_t* y1,
+    np.float32_t* x2,
+    np.float32_t* y2,
+    np.float32_t* areas,
+    np.intp_t* order,
+    int ndets,
+    np.float32_t thresh,
+    int max_keep,
+    np.uint8_t* suppressed
+) nogil:
+    """Same as _nms_set, but x1, y1, x2, y2 and areas are those of the boxes
+    order[0], ..., order[ndets - 1], i.e., sorted by decreasing score. The
+    suppressed boxes are tracked in a bitmask with one bit per (sorted) box.
+    Each kept box computes its overlaps with the following boxes in tiles of
+    64 boxes, without branches, into a 64 bit mask that is ORed into the
+    bitmask. Tiles whose boxes are all suppressed already are skipped.
+    Returns -1 if the bitmask cannot be allocated, 0 otherwise.
+    """
+    cdef int nblocks = (ndets + 63) // 64
+    cdef np.uint64_t* removed = <np.uint64_t*>calloc(
+        nblocks, sizeof(np.uint64_t)
+    )
+    if removed == NULL:
+        return -1
+    cdef int i, j, b, start, end
+    cdef int nkeep = 0
+    cdef np.uint64_t mask
+    cdef np.uint8_t overlapping[64]
+    cdef np.float32_t ix1, iy1, ix2, iy2, iarea
+    cdef np.float32_t xx1, yy1, xx2, yy2
+    cdef np.float32_t w, h
+    cdef np.float32_t inter, ovr
+
+    for i in range(ndets):
+        if (removed[i >> 6] >> (i & 63)) & 1:
+            suppressed[order[i]] = 1
+            continue
+        nkeep += 1
+        if nkeep == max_keep:
+            for j in range(i + 1, ndets):
+                suppressed[order[j]] = 1
+            break
+        ix1 = x1[i]
+        iy1 = y1[i]
+        ix2 = x2[i]
+        iy2 = y2[i]
+        iarea = areas[i]
+        for b in range((i + 1) >> 6, nblocks):
+            if ~removed[b] == 0:
+                continue
+            start = i + 1 if b == (i + 1) >> 6 else b << 6
+            end = ndets if b == nblocks - 1 else (b + 1) << 6
+            # The overlaps are computed in a separate loop without branches or
+            # function calls, which the compiler can vectorize
+            for j in range(start, end):
+                xx1 = ix1 if ix1 >= x1[j] else x1[j]
+                yy1 = iy1 if iy1 >= y1[j] else y1[j]
+                xx2 = ix2 if ix2 <= x2[j] else x2[j]
+                yy2 = iy2 if iy2 <= y2[j] else y2[j]
+                w = xx2 - xx1 + 1
+                h = yy2 - yy1 + 1
+                w = w if w >= 0 else 0
+                h = h if h >= 0 else 0
+                inter = w * h
+                ovr = inter / (iarea + areas[j] - inter)
+                overlapping[j - start] = ovr >= thresh
+            mask = 0
+            for j in range(start, end):
+                mask |= (<np.uint64_t>overlapping[j - start]) << (j & 63)
+            removed[b] |= mask
+    free(removed)
+    return 0
+
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+def batched_nms(
+    np.ndarray[np.float32_t, ndim=2] dets,
+    np.ndarray[np.int64_t, ndim=1] set_offsets,
+    np.float32_t thresh,
+    int num_threads=0,
+    int max_keep=-1,
+    bint bitmask=False
+):
+    """Apply greedy NMS independently to each of several sets of detections.
+    The detections of set s are dets[set_offsets[s]:set_offsets[s + 1]].
+    Returns the (increasing) indices into dets of the kept detections, which
+    are the results of nms on each set, offset by the start of the set.
+
+    The sets are processed in parallel by num_threads OpenMP threads (by
+    default, as many as OMP_NUM_THREADS or the number of CPU cores). If
+    max_keep > 0, only the max_keep highest scoring detections kept by NMS are
+    kept in each set, and NMS stops once they are found. If bitmask is True,
+    the bitmask-tiled kernel is used (see _nms_set_bitmask), which is faster
+    for large sets and gives the same results. The results are those of nms
+    on each set, including for tied scores.
+    """
+    cdef int ndets = dets.shape[0]
+    cdef int nsets = set_offsets.shape[0] - 1
+    cdef int s, start, end
+    if ndets == 0:
+        return np.zeros((0, ), dtype=np.intp)
+    assert set_offsets[0] == 0 and set_offsets[nsets] == ndets
+
+    # Sort each set by decreasing score, with the same sort as nms such that
+    # tied scores are ordered (and thus suppressed) exactly as in nms
+    scores = dets[:, 4]
+    cdef np.ndarray[np.intp_t, ndim=1] order = np.empty((ndets), dtype=np.intp)
+    for s in range(nsets):
+        start = set_offsets[s]
+        end = set_offsets[s + 1]
+        order[start:end] = scores[start:end].argsort()[::-1] + start
+    # The greedy kernel reads the boxes through order, while the bitmask
+    # kernel reads them in sorted order
+    boxes = dets[order, :4] if bitmask else dets[:, :4]
+    cdef np.ndarray[np.float32_t, ndim=1] x1 = np.ascontiguousarray(boxes[:, 0])
+    cdef np.ndarray[np.float32_t, ndim=1] y1 = np.ascontiguousarray(boxes[:, 1])
+    cdef np.ndarray[np.float32_t, ndim=1] x2 = np.ascontiguousarray(boxes[:, 2])
+    cdef np.ndarray[np.float32_t, ndim=1] y2 = np.ascontiguousarray(boxes[:, 3])
+    cdef np.ndarray[np.float32_t, ndim=1] areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    cdef np.ndarray[np.uint8_t, ndim=1] suppressed = \
+            np.zeros((ndets), dtype=np.uint8)
+
+    cdef int status = 0
+    if num_threads <= 0:
+        num_threads = openmp.omp_get_max_threads()
+    # Sets have very different sizes (e.g., the detections of each class), so
+    # they are handed out to the threads one at a time
+    with nogil:
+        for s in prange(
+            nsets, schedule='dynamic', chunksize=1, num_threads=num_threads
+        ):
+            start = set_offsets[s]
+            if bitmask:
+                status |= _nms_set_bitmask(
+                    &x1[start], &y1[start], &x2[start], &y2[start],
+                    &areas[start], &order[start],
+                    set_offsets[s + 1] - set_offsets[s], thresh, max_keep,
+                    &suppressed[0]
+                )
+            else:
+                _nms_set(
+                    &x1[0], &y1[0], &x2[0], &y2[0], &areas[0], &order[start],
+                    set_offsets[s + 1] - set_offsets[s], thresh, max_keep,
+                    &suppressed[0]
+                )
+    if status != 0:
+        raise MemoryError()
+
+    return np.where(suppressed == 0)[0]
+
 # ----------------------------------------------------------
 # Soft-NMS: Improving Object Detection With One Line of Code
 # Copyright (c) University of Maryland, College Park
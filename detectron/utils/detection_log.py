@@ -0,0 +1,191 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Streaming, resumable on-disk log of detection results.
+
+A detection log is a directory that holds the detections of an inference run
+(see cfg.TEST.DETECTION_LOG). The detections are appended image by image and
+written in chunks of images, each chunk being an .npz file of the flat arrays
+of a chunk of DetectionResultsBuilder (see utils/detection_results.py).
+
+Chunks are written to a temporary file first and then renamed, such that a
+crashed run leaves only complete chunks behind. A log can then be resumed,
+skipping the images that it already holds. load_detection_log reads a log back
+into DetectionResults.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import glob
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import uuid
+
+from detectron.utils.detection_results import DetectionResults
+from detectron.utils.detection_results import DetectionResultsBuilder
+
+logger = logging.getLogger(__name__)
+
+_META_FILE = 'meta.json'
+_CHUNK_PATTERN = 'chunk_{:06d}.npz'
+
+
+def is_detection_log(path):
+    """Whether path is a detection log (rather than a detections pickle)."""
+    return os.path.isdir(path) and \
+        os.path.exists(os.path.join(path, _META_FILE))
+
+
+def load_detections(path):
+    """Load the detections saved by test_net, either as a detection log or as
+    a detections file. Returns their DetectionResults and the yaml dump of the
+    config they were computed with."""
+    if is_detection_log(path):
+        return load_detection_log(path)
+    with open(path, 'rb') as f:
+        dets = pickle.load(f)
+    detections = DetectionResults.from_all_results(
+        dets['all_boxes'], dets['all_segms'], dets['all_keyps']
+    )
+    return detections, dets['cfg']
+
+
+class DetectionLogWriter(object):
+    """Append the detections of each image to a detection log."""
+
+    def __init__(
+        self, log_dir, num_images, num_classes, has_segms=False,
+        has_keyps=False, cfg_yaml='', resume=False, ims_per_chunk=100
+    ):
+        self.log_dir = log_dir
+        self._ims_per_chunk = ims_per_chunk
+        self._done = set()
+        self._next_chunk = 0
+        meta = dict(
+            num_images=num_images, num_classes=num_classes, cfg=cfg_yaml
+        )
+        if resume and is_detection_log(log_dir):
+            log_meta = _load_meta(log_dir)
+            assert log_meta['num_images'] == num_images and \
+                log_meta['num_classes'] == num_classes, \
+                'Detection log \'{}\' does not match the dataset or the ' \
+                'model'.format(log_dir)
+            for tmp_file in glob.glob(os.path.join(log_dir, '*.tmp')):
+                os.remove(tmp_file)
+            chunk_files = _get_chunk_files(log_dir)
+            for chunk_file in chunk_files:
+                with np.load(chunk_file) as chunk:
+                    self._done.update(chunk['image_inds'].tolist())
+            if len(chunk_files) > 0:
+                self._next_chunk = _get_chunk_index(chunk_files[-1]) + 1
+            logger.info(
+                'Resuming detection log {}: {:d}/{:d} images done'.format(
+                    log_dir, len(self._done), num_images
+                )
+            )
+        else:
+            if is_detection_log(log_dir):
+                logger.info('Discarding detection log {}'.format(log_dir))
+                shutil.rmtree(log_dir)
+            os.makedirs(log_dir)
+            with open(os.path.join(log_dir, _META_FILE), 'w') as f:
+                json.dump(meta, f)
+        self._builder = DetectionResultsBuilder(
+            num_images, num_classes, has_segms=has_segms, has_keyps=has_keyps
+        )
+
+    @property
+    def done_inds(self):
+        """The indices of the images that are in the log (including the
+        buffered ones)."""
+        return self._done
+
+    def append(self, i, cls_boxes_i, cls_segms_i, cls_keyps_i):
+        """Append the detections of image i (as returned by im_detect_all)."""
+        assert i not in self._done, \
+            'Image {} is already in the detection log'.format(i)
+        self._done.add(i)
+        self._builder.append(i, cls_boxes_i, cls_segms_i, cls_keyps_i)
+        if self._builder.num_pending_images >= self._ims_per_chunk:
+            self.flush()
+
+    def append_chunk(self, chunk):
+        """Append a chunk of detections (see DetectionResultsBuilder)."""
+        image_inds = chunk['image_inds'].tolist()
+        assert self._done.isdisjoint(image_inds), \
+            'Images already in the detection log'
+        self._done.update(image_inds)
+        self._builder.append_chunk(chunk)
+        if self._builder.num_pending_images >= self._ims_per_chunk:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered detections to the log as a chunk."""
+        chunk = self._builder.pop_chunk()
+        if chunk is None:
+            return
+        chunk_file = os.path.join(
+            self.log_dir, _CHUNK_PATTERN.format(self._next_chunk)
+        )
+        # Write to a temporary file first, such that the log never holds a
+        # partially written chunk
+        tmp_file = '{}.{}.tmp'.format(chunk_file, uuid.uuid4().hex)
+        try:
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, **chunk)
+            os.rename(tmp_file, chunk_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        self._next_chunk += 1
+
+    def close(self):
+        self.flush()
+
+
+def load_detection_log(log_dir):
+    """Load a detection log. Returns its DetectionResults and the yaml dump of
+    the config it was written with."""
+    assert is_detection_log(log_dir), \
+        'Detection log \'{}\' not found'.format(log_dir)
+    meta = _load_meta(log_dir)
+    chunks = []
+    for chunk_file in _get_chunk_files(log_dir):
+        with np.load(chunk_file) as chunk:
+            chunks.append({k: chunk[k] for k in chunk.files})
+    detections = DetectionResults(
+        meta['num_images'], meta['num_classes'], chunks
+    )
+    return detections, meta['cfg']
+
+
+def _load_meta(log_dir):
+    with open(os.path.join(log_dir, _META_FILE), 'r') as f:
+        return json.load(f)
+
+
+def _get_chunk_files(log_dir):
+    return sorted(glob.glob(os.path.join(log_dir, 'chunk_*.npz')))
+
+
+def _get_chunk_index(chunk_file):
+    return int(os.path.basename(chunk_file)[len('chunk_'):-len('.npz')])
@@ -0,0 +1,476 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Columnar storage of the detection results of a dataset.
+
+The detections of an image are returned by im_detect_all as lists indexed by
+class (class 0 is __background__ and always empty):
+
+  cls_boxes[cls] = N x 5 array with columns (x1, y1, x2, y2, score)
+  cls_segms[cls] = [...] list of COCO RLE encoded masks that are in 1:1
+    correspondence with the boxes in cls_boxes[cls] (None without masks)
+  cls_keyps[cls] = [...] list of keypoints results, each encoded as a 2D
+    array (4, #keypoints) with the 4 rows corresponding to [x, y, logit, prob]
+    (See: utils.keypoints.heatmaps_to_keypoints). Keypoints are recorded for
+    person (cls = 1); they are in 1:1 correspondence with the boxes in
+    cls_boxes[cls] (None without keypoints)
+
+DetectionResults stores the detections of all images of a dataset as flat
+arrays with one row per detection, sorted by class and then by image:
+
+  det_image_inds: (num_dets, ) image index of each detection
+  det_classes:    (num_dets, ) class of each detection
+  dets:           (num_dets, 5) detections (x1, y1, x2, y2, score)
+  keyp_inds:      (num_dets, ) row of each detection in keyps (-1 for none)
+  keyps:          (num_keyps, 4, #keypoints) keypoints
+
+and the RLE masks as the sizes and the concatenated counts of all masks. The
+detections of a class are a slice of the arrays, and the detections of a class
+in an image a slice of those. For existing code, all_boxes, all_segms and
+all_keyps give access to the results as [cls][image] lists of the per-image
+results above, and to_all_results converts them to such lists (the format of
+detections files).
+
+The results are collected with DetectionResultsBuilder, as chunks of flat
+arrays that are also the chunks of detection logs (see utils/detection_log.py):
+
+  image_inds:     (num_images, ) indices of the images of the chunk
+  det_image_inds: (num_dets, ) image index of each detection
+  det_classes:    (num_dets, ) class of each detection
+  dets:           (num_dets, 5) detections (x1, y1, x2, y2, score)
+
+and, for models with masks or keypoints:
+
+  segm_sizes:     (num_dets, 2) (height, width) of each COCO RLE mask
+  segm_lengths:   (num_dets, ) length of the RLE counts of each mask
+  segm_counts:    (total_length, ) RLE counts of all masks (uint8)
+  keyp_inds:      (num_dets, ) row of each detection in keyps (-1 for none)
+  keyps:          (num_keyps, 4, #keypoints) keypoints of the chunk
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+
+class DetectionResults(object):
+    """The detections of the images of a dataset, stored column-wise."""
+
+    def __init__(self, num_images, num_classes, chunks=()):
+        self.num_images = num_images
+        self.num_classes = num_classes
+        arrays = _concat_chunks(chunks)
+        image_inds = arrays['image_inds']
+        assert len(np.unique(image_inds)) == len(image_inds), \
+            'Duplicate images in the detection results'
+        # The images that have results (images that were not processed, e.g.,
+        # for lack of proposals, have empty results)
+        self.image_inds = np.sort(image_inds)
+        self._done = np.zeros(num_images, dtype=np.bool_)
+        self._done[image_inds] = True
+
+        # Sort the detections by image (keeping the class order within each
+        # image), and then by class
+        order = np.argsort(arrays['det_image_inds'], kind='mergesort')
+        order = order[
+            np.argsort(arrays['det_classes'][order], kind='mergesort')
+        ]
+        self.dets = arrays['dets'][order]
+        self.det_classes = arrays['det_classes'][order]
+        self.det_image_inds = arrays['det_image_inds'][order]
+        self._class_offsets = np.searchsorted(
+            self.det_classes, np.arange(num_classes + 1)
+        )
+        # The rows of the detections of each image, in class order
+        self._image_order = np.argsort(self.det_image_inds, kind='mergesort')
+        self._image_offsets = np.searchsorted(
+            self.det_image_inds[self._image_order], np.arange(num_images + 1)
+        )
+
+        self.has_segms = 'segm_counts' in arrays
+        if self.has_segms:
+            segm_lengths = arrays['segm_lengths']
+            segm_ends = np.cumsum(segm_lengths)
+            self._segm_starts = (segm_ends - segm_lengths)[order]
+            self._segm_ends = segm_ends[order]
+            self._segm_sizes = arrays['segm_sizes'][order]
+            self._segm_counts = arrays['segm_counts']
+        self.has_keyps = 'keyp_inds' in arrays
+        if self.has_keyps:
+            self.keyp_inds = arrays['keyp_inds'][order]
+            self.keyps = arrays['keyps']
+
+    @classmethod
+    def from_all_results(cls, all_boxes, all_segms, all_keyps):
+        """Convert results in the all_boxes[cls][image] format (e.g., from a
+        detections file written by an earlier version)."""
+        num_classes = len(all_boxes)
+        num_images = len(all_boxes[0])
+        has_segms = any(len(segms) > 0 for cls_segms in all_segms
+                        for segms in cls_segms)
+        has_keyps = any(len(keyps) > 0 for cls_keyps in all_keyps
+                        for keyps in cls_keyps)
+        builder = DetectionResultsBuilder(
+            num_images, num_classes, has_segms=has_segms, has_keyps=has_keyps
+        )
+        for i in range(num_images):
+            cls_boxes_i = [all_boxes[j][i] for j in range(num_classes)]
+            if all(isinstance(boxes, list) for boxes in cls_boxes_i):
+                # Not processed
+                continue
+            builder.append(
+                i, cls_boxes_i,
+                [all_segms[j][i] for j in range(num_classes)]
+                if has_segms else None,
+                [all_keyps[j][i] for j in range(num_classes)]
+                if has_keyps else None
+            )
+        return builder.build()
+
+    def to_all_results(self):
+        """Return the results as (all_boxes, all_segms, all_keyps) lists in
+        the all_boxes[cls][image] format (e.g., for detections files)."""
+        return tuple(
+            [all_r[j] for j in range(self.num_classes)]
+            for all_r in [self.all_boxes, self.all_segms, self.all_keyps]
+        )
+
+    def __len__(self):
+        """Number of detections."""
+        return len(self.dets)
+
+    def get_class_rows(self, cls_ind):
+        """Return the rows of the detections of class cls_ind (a slice)."""
+        return slice(
+            self._class_offsets[cls_ind], self._class_offsets[cls_ind + 1]
+        )
+
+    def get_class_image_offsets(self, cls_ind):
+        """Return the (num_images + 1, ) offsets of the rows of the detections
+        of class cls_ind in each image."""
+        rows = self.get_class_rows(cls_ind)
+        return rows.start + np.searchsorted(
+            self.det_image_inds[rows], np.arange(self.num_images + 1)
+        )
+
+    def get_segms(self, rows):
+        """Return the COCO RLE masks of the detections in rows (a slice or
+        an index array)."""
+        if isinstance(rows, slice):
+            rows = range(*rows.indices(len(self)))
+        segms = []
+        for r in rows:
+            height, width = self._segm_sizes[r]
+            counts = self._segm_counts[self._segm_starts[r]:self._segm_ends[r]]
+            segms.append(
+                {'size': [int(height), int(width)], 'counts': counts.tobytes()}
+            )
+        return segms
+
+    def get_keyps(self, rows):
+        """Return the keypoints of the detections in rows (a slice or an
+        index array), or [] if they have none."""
+        keyp_inds = self.keyp_inds[rows]
+        if len(keyp_inds) == 0 or keyp_inds[0] < 0:
+            return []
+        return list(self.keyps[keyp_inds])
+
+    def get_image_results(self, i):
+        """Return the (cls_boxes, cls_segms, cls_keyps) of image i."""
+        if not self._done[i]:
+            return tuple(
+                [[] for _ in range(self.num_classes)] for _ in range(3)
+            )
+        rows = self._image_order[
+            self._image_offsets[i]:self._image_offsets[i + 1]
+        ]
+        class_offsets = np.searchsorted(
+            self.det_classes[rows], np.arange(self.num_classes + 1)
+        )
+        cls_rows = [
+            rows[class_offsets[j]:class_offsets[j + 1]]
+            for j in range(self.num_classes)
+        ]
+        cls_boxes = [[]] + [self.dets[r] for r in cls_rows[1:]]
+        cls_segms = None
+        if self.has_segms:
+            cls_segms = [[]] + [self.get_segms(r) for r in cls_rows[1:]]
+        cls_keyps = None
+        if self.has_keyps:
+            cls_keyps = [[]] + [self.get_keyps(r) for r in cls_rows[1:]]
+        return cls_boxes, cls_segms, cls_keyps
+
+    @property
+    def all_boxes(self):
+        """all_boxes[cls][image] access to cls_boxes (see above)."""
+        return _ClassResults(self, self._get_class_boxes)
+
+    @property
+    def all_segms(self):
+        """all_segms[cls][image] access to cls_segms (see above)."""
+        return _ClassResults(self, self._get_class_segms)
+
+    @property
+    def all_keyps(self):
+        """all_keyps[cls][image] access to cls_keyps (see above)."""
+        return _ClassResults(self, self._get_class_keyps)
+
+    def _get_image_rows(self, cls_ind):
+        """Return the rows of the detections of class cls_ind in each image,
+        as a list of slices (None for the images without results)."""
+        offsets = self.get_class_image_offsets(cls_ind)
+        return [
+            slice(offsets[i], offsets[i + 1]) if self._done[i] else None
+            for i in range(self.num_images)
+        ]
+
+    def _get_class_boxes(self, cls_ind):
+        return [
+            self.dets[rows] if rows is not None else []
+            for rows in self._get_image_rows(cls_ind)
+        ]
+
+    def _get_class_segms(self, cls_ind):
+        if not self.has_segms:
+            return [[] for _ in range(self.num_images)]
+        return [
+            self.get_segms(rows) if rows is not None else []
+            for rows in self._get_image_rows(cls_ind)
+        ]
+
+    def _get_class_keyps(self, cls_ind):
+        if not self.has_keyps:
+            return [[] for _ in range(self.num_images)]
+        return [
+            self.get_keyps(rows) if rows is not None else []
+            for rows in self._get_image_rows(cls_ind)
+        ]
+
+
+class DetectionResultsBuilder(object):
+    """Collect the detections of images into DetectionResults."""
+
+    def __init__(
+        self, num_images, num_classes, has_segms=False, has_keyps=False
+    ):
+        self.num_images = num_images
+        self.num_classes = num_classes
+        # Whether the detections have masks and keypoints is fixed by the
+        # model, rather than by the appended images, such that the chunks of
+        # images without detections still hold (empty) mask and keypoint
+        # arrays and can be merged with the others
+        self.has_segms = has_segms
+        self.has_keyps = has_keyps
+        self._chunks = []
+        self._reset_buffer()
+
+    @property
+    def num_pending_images(self):
+        """Number of images appended since the last pop_chunk."""
+        return len(self._buffer['image_inds']) + sum(
+            len(chunk['image_inds']) for chunk in self._chunks
+        )
+
+    def append(self, i, cls_boxes_i, cls_segms_i, cls_keyps_i):
+        """Append the detections of image i (as returned by im_detect_all)."""
+        buf = self._buffer
+        buf['image_inds'].append(i)
+        # Skip cls_idx 0 (__background__)
+        num_dets = [len(boxes) for boxes in cls_boxes_i[1:]]
+        # Classes without detections may be [] rather than (0, 5) arrays
+        buf['dets'].append(np.vstack(
+            [np.zeros((0, 5), dtype=np.float32)] +
+            [boxes for boxes in cls_boxes_i[1:] if len(boxes) > 0]
+        ))
+        buf['det_classes'].append(
+            np.repeat(np.arange(1, len(cls_boxes_i), dtype=np.int32), num_dets)
+        )
+        buf['det_image_inds'].append(
+            np.full(sum(num_dets), i, dtype=np.int32)
+        )
+        if cls_segms_i is not None:
+            assert self.has_segms, 'Masks appended to results without masks'
+            rles = [rle for segms in cls_segms_i[1:] for rle in segms]
+            assert len(rles) == sum(num_dets)
+            buf['segm_sizes'].extend(rle['size'] for rle in rles)
+            buf['segm_counts'].extend(rle['counts'] for rle in rles)
+        elif self.has_segms:
+            # im_detect_all returns no masks for images without detections
+            assert sum(num_dets) == 0, 'Detections without masks'
+        if cls_keyps_i is not None:
+            assert self.has_keyps, \
+                'Keypoints appended to results without keypoints'
+            for keyps, n in zip(cls_keyps_i[1:], num_dets):
+                if len(keyps) == 0:
+                    buf['keyp_inds'].append(np.full(n, -1, dtype=np.int64))
+                    continue
+                assert len(keyps) == n
+                buf['keyp_inds'].append(
+                    np.arange(n, dtype=np.int64) + len(buf['keyps'])
+                )
+                buf['keyps'].extend(keyps)
+        elif self.has_keyps:
+            buf['keyp_inds'].append(
+                np.full(sum(num_dets), -1, dtype=np.int64)
+            )
+
+    def append_chunk(self, chunk):
+        """Append a chunk of detections (as returned by pop_chunk)."""
+        assert ('segm_counts' in chunk) == self.has_segms and \
+            ('keyp_inds' in chunk) == self.has_keyps, \
+            'Chunk without the masks or keypoints of the results (or vice ' \
+            'versa)'
+        self._flush_buffer()
+        self._chunks.append(chunk)
+
+    def pop_chunk(self):
+        """Return the detections appended since the last call as a chunk of
+        flat arrays (see above), or None if there are none."""
+        self._flush_buffer()
+        if len(self._chunks) == 0:
+            return None
+        chunk = _concat_chunks(self._chunks)
+        self._chunks = []
+        return chunk
+
+    def build(self):
+        """Return the DetectionResults of all appended detections."""
+        self._flush_buffer()
+        return DetectionResults(
+            self.num_images, self.num_classes, self._chunks
+        )
+
+    def _flush_buffer(self):
+        buf = self._buffer
+        if len(buf['image_inds']) == 0:
+            return
+        chunk = {
+            'image_inds': np.array(buf['image_inds'], dtype=np.int64),
+            'det_image_inds': np.concatenate(buf['det_image_inds']),
+            'det_classes': np.concatenate(buf['det_classes']),
+            'dets': np.vstack(buf['dets']),
+        }
+        if self.has_segms:
+            chunk['segm_sizes'] = np.array(
+                buf['segm_sizes'], dtype=np.int32
+            ).reshape((-1, 2))
+            chunk['segm_lengths'] = np.array(
+                [len(counts) for counts in buf['segm_counts']], dtype=np.int64
+            )
+            chunk['segm_counts'] = np.frombuffer(
+                b''.join(buf['segm_counts']), dtype=np.uint8
+            )
+        if self.has_keyps:
+            chunk['keyp_inds'] = np.concatenate(
+                [np.zeros(0, dtype=np.int64)] + buf['keyp_inds']
+            )
+            # (0, ) if the chunk has no keypoints
+            chunk['keyps'] = np.array(buf['keyps'], dtype=np.float32)
+        self._chunks.append(chunk)
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        self._buffer = {
+            k: [] for k in [
+                'image_inds', 'det_image_inds', 'det_classes', 'dets',
+                'segm_sizes', 'segm_counts', 'keyp_inds', 'keyps'
+            ]
+        }
+
+
+class _ClassResults(object):
+    """all_boxes[cls][image] style access to DetectionResults. The per-image
+    list of a class is built when the class is accessed."""
+
+    def __init__(self, detections, get_class_results):
+        self._num_classes = detections.num_classes
+        self._num_images = detections.num_images
+        self._get_class_results = get_class_results
+        # The most recently accessed class, for all_boxes[cls][image] loops
+        self._cached_cls_ind = None
+        self._cached_results = None
+
+    def __len__(self):
+        return self._num_classes
+
+    def __getitem__(self, cls_ind):
+        if cls_ind < 0:
+            cls_ind += self._num_classes
+        if cls_ind < 0 or cls_ind >= self._num_classes:
+            raise IndexError('Class index out of range')
+        if cls_ind == 0:
+            # __background__
+            return [[] for _ in range(self._num_images)]
+        if cls_ind != self._cached_cls_ind:
+            self._cached_results = self._get_class_results(cls_ind)
+            self._cached_cls_ind = cls_ind
+        return self._cached_results
+
+    def __iter__(self):
+        for cls_ind in range(self._num_classes):
+            yield self[cls_ind]
+
+
+def _concat_chunks(chunks):
+    """Concatenate chunks of flat arrays (see above) into one."""
+    if len(chunks) == 1:
+        return chunks[0]
+    arrays = {
+        'image_inds': np.concatenate(
+            [np.zeros(0, dtype=np.int64)] +
+            [chunk['image_inds'] for chunk in chunks]
+        ),
+        'det_image_inds': np.concatenate(
+            [np.zeros(0, dtype=np.int32)] +
+            [chunk['det_image_inds'] for chunk in chunks]
+        ),
+        'det_classes': np.concatenate(
+            [np.zeros(0, dtype=np.int32)] +
+            [chunk['det_classes'] for chunk in chunks]
+        ),
+        'dets': np.vstack(
+            [np.zeros((0, 5), dtype=np.float32)] +
+            [chunk['dets'] for chunk in chunks]
+        ),
+    }
+    has_segms = ['segm_counts' in chunk for chunk in chunks]
+    assert all(has_segms) or not any(has_segms), \
+        'Detection results with and without masks'
+    if len(chunks) > 0 and all(has_segms):
+        for k in ['segm_sizes', 'segm_lengths', 'segm_counts']:
+            arrays[k] = np.concatenate([chunk[k] for chunk in chunks])
+    has_keyps = ['keyp_inds' in chunk for chunk in chunks]
+    assert all(has_keyps) or not any(has_keyps), \
+        'Detection results with and without keypoints'
+    if len(chunks) > 0 and all(has_keyps):
+        # The keypoint rows are relative to the keypoints of each chunk
+        keyp_inds, keyps = [], []
+        num_keyps = 0
+        for chunk in chunks:
+            keyp_inds.append(
+                np.where(
+                    chunk['keyp_inds'] >= 0, chunk['keyp_inds'] + num_keyps, -1
+                )
+            )
+            if len(chunk['keyps']) > 0:
+                keyps.append(chunk['keyps'])
+                num_keyps += len(chunk['keyps'])
+        arrays['keyp_inds'] = np.concatenate(keyp_inds)
+        arrays['keyps'] = np.concatenate(keyps) if len(keyps) > 0 \
+            else np.zeros(0, dtype=np.float32)
+    return arrays
@@ -0,0 +1,107 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""On-disk cache of decoded images resized to the training scales.
+
+Each cache entry holds one image, decoded and resized for one (target size, max
+size) pair, as a uint8 BGR array in a .npy file. Entries are keyed by the image
+file (path, modification time and size), the original image size and the
+(target size, max size) pair, and are read through memory mapping.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cv2
+import errno
+import hashlib
+import json
+import numpy as np
+import os
+import uuid
+
+import detectron.utils.blob as blob_utils
+
+
+def get_resized_image(cache_dir, im_path, im_size, target_size, max_size):
+    """Return the image at im_path resized for (target_size, max_size) as a
+    uint8 array, along with the scale factor that was used. im_size is the
+    (height, width) of the original image. Images that are not in the cache yet
+    are decoded, resized and added to it.
+    """
+    im_scale = blob_utils.get_im_scale(im_size, target_size, max_size)
+    cache_file = get_cache_file(
+        cache_dir, im_path, im_size, target_size, max_size
+    )
+    if os.path.exists(cache_file):
+        im = np.load(cache_file, mmap_mode='r')
+        resized_size = tuple(
+            int(np.round(s * im_scale)) for s in im_size[:2]
+        )
+        assert im.shape[:2] == resized_size, \
+            'Cached image \'{}\' of size {} does not match the size {} of ' \
+            'image \'{}\' resized by {}'.format(
+                cache_file, im.shape[:2], resized_size, im_path, im_scale
+            )
+        return im, im_scale
+    im = cv2.imread(im_path)
+    assert im is not None, 'Failed to read image \'{}\''.format(im_path)
+    assert im.shape[:2] == tuple(im_size), \
+        'Size of image \'{}\' does not match {}'.format(im_path, im_size)
+    im = cv2.resize(
+        im,
+        None,
+        None,
+        fx=im_scale,
+        fy=im_scale,
+        interpolation=cv2.INTER_LINEAR
+    )
+    _save_atomically(cache_file, im)
+    return im, im_scale
+
+
+def get_cache_file(cache_dir, im_path, im_size, target_size, max_size):
+    """Return the path of the cache entry of the image at im_path, of size
+    im_size, resized for (target_size, max_size). The entry changes if the
+    image file is modified."""
+    stat = os.stat(im_path)
+    key = json.dumps([
+        os.path.abspath(im_path), stat.st_mtime, stat.st_size,
+        [int(s) for s in im_size[:2]]
+    ])
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(
+        cache_dir, '{}_{}'.format(target_size, max_size), key[:2],
+        key + '.npy'
+    )
+
+
+def _save_atomically(cache_file, im):
+    """Save the image to cache_file such that concurrent readers never see a
+    partially written entry."""
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            # Created by another loader in the meantime
+            if e.errno != errno.EEXIST:
+                raise
+    tmp_file = '{}.{}.tmp'.format(cache_file, uuid.uuid4().hex)
+    with open(tmp_file, 'wb') as f:
+        np.save(f, im)
+    os.rename(tmp_file, cache_file)
@@ -68,11 +68,13 @@ def initialize_gpu_from_weights_file(model, weights_file, gpu_id=0):
         # Backwards compat--dictionary used to be only blobs, now they are
         # stored under the 'blobs' key
         src_blobs = src_blobs['blobs']
-    # Initialize weights on GPU gpu_id only
+    # Initialize weights on GPU gpu_id only (or on the CPU for CPU inference)
     unscoped_param_names = OrderedDict()  # Print these out in model order
     for blob in model.params:
         unscoped_param_names[c2_utils.UnscopeName(str(blob))] = True
-    with c2_utils.NamedCudaScope(gpu_id):
+    device_scope = c2_utils.NamedCudaScope if model.train else \
+        c2_utils.NamedDeviceScope
+    with device_scope(gpu_id):
         for unscoped_param_name in unscoped_param_names.keys():
             if (unscoped_param_name.find(']_') >= 0 and
                     unscoped_param_name not in src_blobs):
@@ -0,0 +1,94 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Ordered thread pools for building pipelines of inference stages (e.g.,
+prefetching and post-processing around the net in test_net)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import time
+
+
+def _timed_call(fn, args):
+    start_time = time.time()
+    result = fn(*args)
+    return result, time.time() - start_time
+
+
+class OrderedThreadPool(object):
+    """Runs functions on a pool of threads and returns their results in the
+    order in which the functions were submitted, regardless of the order in
+    which they complete. With num_threads=0 the functions are run serially in
+    the calling thread, when they are submitted.
+
+    If a timer is given, the time spent running each function (on its worker
+    thread) is added to it.
+    """
+
+    def __init__(self, num_threads, timer=None):
+        self._pool = ThreadPool(num_threads) if num_threads > 0 else None
+        self._timer = timer
+        self._pending = deque()
+
+    def __len__(self):
+        """Number of submitted functions whose results were not returned."""
+        return len(self._pending)
+
+    def submit(self, fn, *args):
+        if self._pool is None:
+            self._pending.append(_timed_call(fn, args))
+        else:
+            self._pending.append(
+                self._pool.apply_async(_timed_call, (fn, args))
+            )
+
+    def ready(self):
+        """Whether the result of the oldest pending function is available."""
+        assert len(self._pending) > 0
+        return self._pool is None or self._pending[0].ready()
+
+    def get(self):
+        """Return the result of the oldest pending function, waiting for it
+        to complete if needed. Exceptions raised by the function are
+        re-raised."""
+        pending = self._pending.popleft()
+        result, diff = pending if self._pool is None else pending.get()
+        if self._timer is not None:
+            self._timer.add(diff)
+        return result
+
+    def imap(self, fn, items, max_pending):
+        """Yield fn(item) for each item, in order, running at most max_pending
+        of the calls ahead of the consumer."""
+        assert len(self._pending) == 0 and max_pending > 0
+        for item in items:
+            self.submit(fn, item)
+            if len(self._pending) >= max_pending:
+                yield self.get()
+        while len(self._pending) > 0:
+            yield self.get()
+
+    def close(self):
+        """Stop the worker threads. Pending results are discarded."""
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,318 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Compact binary encoding of the (minimal) roidb entries of a minibatch as an
+int32 blob that can be fed into the workspace, as used by the Python ops that
+label RPN proposals during training.
+
+The blob holds a header, a table with one row per stored array and the raw
+array data:
+
+  header: [magic, version, num_images, minibatch_id, num_arrays] (int64)
+  table:  [image, field, dtype, ndim, dim0, dim1, dim2, offset] (int64) rows
+  data:   array bytes, each array aligned to 8 bytes
+
+Segmentations (polygons and RLEs) are stored as flat arrays along with the
+number of parts of each segmentation and the kind and length of each part.
+Decoding does not use pickle. Decoded minibatches are cached by minibatch id
+so that the ops of the different (cascade) stages of one minibatch decode it
+only once (and can share state derived from it, see get_minibatch_state()).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse
+import threading
+import uuid
+
+_MAGIC = 0x526f4442  # 'RoDB'
+_VERSION = 1
+_HEADER_LEN = 5
+_TABLE_COLS = 8
+_ALIGNMENT = 8
+
+# Data types of the stored arrays
+_DTYPES = [
+    np.dtype(t) for t in
+    (np.bool_, np.int8, np.uint8, np.int32, np.int64, np.float32, np.float64)
+]
+
+# Keys of roidb entries that are stored as is
+_ARRAY_KEYS = [
+    'has_visible_keypoints', 'boxes', 'seg_areas', 'gt_classes', 'is_crowd',
+    'box_to_gt_ind_map', 'gt_keypoints'
+]
+# Arrays storing the (sparse) gt_overlaps matrix
+_GT_OVERLAPS_KEYS = [
+    'gt_overlaps_data', 'gt_overlaps_indices', 'gt_overlaps_indptr',
+    'gt_overlaps_shape'
+]
+# Arrays storing the segms
+_SEGMS_KEYS = [
+    'segm_kinds', 'segm_num_parts', 'part_kinds', 'part_lengths',
+    'part_sizes', 'poly_coords', 'rle_counts', 'rle_bytes'
+]
+_FIELDS = _ARRAY_KEYS + _GT_OVERLAPS_KEYS + _SEGMS_KEYS
+_FIELD_INDEX = {k: i for i, k in enumerate(_FIELDS)}
+
+# Kinds of segms: a list of polygons, an RLE or a list of RLEs (as returned by
+# pycocotools.mask.encode when flipping RLEs)
+_SEGM_POLYS, _SEGM_RLE, _SEGM_RLE_LIST = range(3)
+# Kinds of parts of segms: a polygon, an RLE with a list of counts or an RLE
+# with compressed (string) counts
+_PART_POLY, _PART_RLE, _PART_COMPRESSED_RLE = range(3)
+
+# Most recently decoded minibatches, indexed by minibatch id
+_CACHE_SIZE = 32
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def serialize(roidb):
+    """Encode the roidb entries (restricted to the keys listed above) as an
+    int32 array. See deserialize().
+    """
+    arrays = []
+    for i, entry in enumerate(roidb):
+        for k in _ARRAY_KEYS:
+            if k in entry:
+                arrays.append((i, k, np.asarray(entry[k])))
+        if 'gt_overlaps' in entry:
+            gt_overlaps = scipy.sparse.csr_matrix(entry['gt_overlaps'])
+            arrays += [
+                (i, 'gt_overlaps_data', gt_overlaps.data),
+                (i, 'gt_overlaps_indices', gt_overlaps.indices),
+                (i, 'gt_overlaps_indptr', gt_overlaps.indptr),
+                (i, 'gt_overlaps_shape', np.array(gt_overlaps.shape)),
+            ]
+        if 'segms' in entry:
+            arrays += [
+                (i, k, v) for k, v in zip(
+                    _SEGMS_KEYS, segms_to_arrays(entry['segms'])
+                )
+            ]
+
+    table = np.zeros((len(arrays), _TABLE_COLS), dtype=np.int64)
+    offset = 0
+    for row, (i, k, a) in zip(table, arrays):
+        assert a.ndim <= 3, 'Cannot serialize {}-d array'.format(a.ndim)
+        row[0] = i
+        row[1] = _FIELD_INDEX[k]
+        row[2] = _DTYPES.index(a.dtype)
+        row[3] = a.ndim
+        row[4:4 + a.ndim] = a.shape
+        row[7] = offset
+        offset += _align(a.nbytes)
+    header = np.array(
+        [_MAGIC, _VERSION, len(roidb), _new_minibatch_id(), len(arrays)],
+        dtype=np.int64
+    )
+    data_start = header.nbytes + table.nbytes
+    buf = np.zeros(data_start + offset, dtype=np.uint8)
+    buf[:header.nbytes] = header.view(np.uint8)
+    buf[header.nbytes:data_start] = table.view(np.uint8).ravel()
+    for row, (_, _, a) in zip(table, arrays):
+        start = data_start + row[7]
+        buf[start:start + a.nbytes] = \
+            np.ascontiguousarray(a).view(np.uint8).ravel()
+    return buf.view(np.int32)
+
+
+def deserialize(arr):
+    """Decode a list of roidb entries from an array fetched from a workspace.
+    See serialize(). The arrays of the entries are read-only; the entries
+    themselves are new dicts on every call, so they may be modified freely.
+    """
+    roidb, _ = _get_minibatch(arr)
+    return [dict(entry) for entry in roidb]
+
+
+def get_minibatch_state(arr):
+    """Return a dict that is shared by all the calls for the minibatch encoded
+    in arr (e.g., by the ops of the different cascade stages), in which state
+    derived from the decoded minibatch can be cached.
+    """
+    _, state = _get_minibatch(arr)
+    return state
+
+
+def _get_minibatch(arr):
+    """Return the (cached) decoded roidb and state dict of a minibatch."""
+    # Only read the header (and not the whole array) for cached minibatches
+    header = np.ascontiguousarray(arr[:2 * _HEADER_LEN]).view(np.int64)
+    assert header[0] == _MAGIC and header[1] == _VERSION, \
+        'Invalid serialized roidb'
+    num_images, minibatch_id, num_arrays = header[2:]
+    with _cache_lock:
+        minibatch = _cache.get(minibatch_id)
+    if minibatch is None:
+        minibatch = (_decode(arr.tobytes(), num_images, num_arrays), {})
+        with _cache_lock:
+            _cache[minibatch_id] = minibatch
+            while len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+    return minibatch
+
+
+def _decode(buf, num_images, num_arrays):
+    table = np.frombuffer(
+        buf, dtype=np.int64, count=num_arrays * _TABLE_COLS,
+        offset=_HEADER_LEN * 8
+    ).reshape((num_arrays, _TABLE_COLS))
+    data_start = (_HEADER_LEN + table.size) * 8
+    fields = [{} for _ in range(num_images)]
+    for i, field, dtype, ndim, d0, d1, d2, offset in table.tolist():
+        dtype = _DTYPES[dtype]
+        shape = (d0, d1, d2)[:ndim]
+        fields[i][_FIELDS[field]] = np.frombuffer(
+            buf, dtype=dtype, count=int(np.prod(shape)),
+            offset=data_start + offset
+        ).reshape(shape)
+
+    roidb = []
+    for entry_fields in fields:
+        entry = {k: entry_fields[k] for k in _ARRAY_KEYS if k in entry_fields}
+        if 'has_visible_keypoints' in entry:
+            entry['has_visible_keypoints'] = \
+                bool(entry['has_visible_keypoints'])
+        if 'gt_overlaps_data' in entry_fields:
+            entry['gt_overlaps'] = scipy.sparse.csr_matrix(
+                (
+                    entry_fields['gt_overlaps_data'],
+                    entry_fields['gt_overlaps_indices'],
+                    entry_fields['gt_overlaps_indptr']
+                ),
+                shape=tuple(entry_fields['gt_overlaps_shape'])
+            )
+        if 'segm_kinds' in entry_fields:
+            entry['segms'] = arrays_to_segms(
+                *[entry_fields[k] for k in _SEGMS_KEYS]
+            )
+        roidb.append(entry)
+    return roidb
+
+
+def segms_to_arrays(segms):
+    """Flatten a list of segms into the arrays listed in _SEGMS_KEYS. Parts
+    of each kind are stored contiguously in poly_coords, rle_counts and
+    rle_bytes, respectively.
+    """
+    segm_kinds = []
+    segm_num_parts = []
+    parts = []
+    for segm in segms:
+        if isinstance(segm, dict):
+            segm_kinds.append(_SEGM_RLE)
+            parts.append(segm)
+            segm_num_parts.append(1)
+            continue
+        if len(segm) > 0 and isinstance(segm[0], dict):
+            segm_kinds.append(_SEGM_RLE_LIST)
+        else:
+            segm_kinds.append(_SEGM_POLYS)
+        parts += segm
+        segm_num_parts.append(len(segm))
+
+    part_kinds = []
+    part_lengths = []
+    part_sizes = np.zeros((len(parts), 2), dtype=np.int32)
+    poly_coords = []
+    rle_counts = []
+    rle_bytes = []
+    for i, part in enumerate(parts):
+        if not isinstance(part, dict):
+            part_kinds.append(_PART_POLY)
+            part_lengths.append(len(part))
+            poly_coords += list(part)
+            continue
+        part_sizes[i] = part['size']
+        counts = part['counts']
+        if isinstance(counts, list):
+            part_kinds.append(_PART_RLE)
+            rle_counts += counts
+        else:
+            part_kinds.append(_PART_COMPRESSED_RLE)
+            counts = np.frombuffer(counts, dtype=np.uint8)
+            rle_bytes.append(counts)
+        part_lengths.append(len(counts))
+
+    return (
+        np.array(segm_kinds, dtype=np.int8),
+        np.array(segm_num_parts, dtype=np.int32),
+        np.array(part_kinds, dtype=np.int8),
+        np.array(part_lengths, dtype=np.int32),
+        part_sizes,
+        np.array(poly_coords, dtype=np.float64),
+        np.array(rle_counts, dtype=np.int32),
+        np.concatenate(rle_bytes) if len(rle_bytes) > 0
+        else np.zeros((0, ), dtype=np.uint8),
+    )
+
+
+def arrays_to_segms(
+    segm_kinds, segm_num_parts, part_kinds, part_lengths, part_sizes,
+    poly_coords, rle_counts, rle_bytes, offsets=None
+):
+    """Inverse of segms_to_arrays. offsets are the positions in poly_coords,
+    rle_counts and rle_bytes of the first part of each kind, which allows
+    decoding a range of the segms encoded by one segms_to_arrays call.
+    """
+    parts = []
+    # Into poly_coords, rle_counts and rle_bytes
+    offsets = [0, 0, 0] if offsets is None else [int(o) for o in offsets]
+    for kind, length, size in zip(
+        part_kinds.tolist(), part_lengths.tolist(), part_sizes.tolist()
+    ):
+        start = offsets[kind]
+        offsets[kind] += length
+        if kind == _PART_POLY:
+            parts.append(poly_coords[start:start + length].tolist())
+        elif kind == _PART_RLE:
+            parts.append(
+                {
+                    'size': size,
+                    'counts': rle_counts[start:start + length].tolist()
+                }
+            )
+        else:
+            parts.append(
+                {
+                    'size': size,
+                    'counts': rle_bytes[start:start + length].tobytes()
+                }
+            )
+
+    segms = []
+    start = 0
+    for kind, num_parts in zip(segm_kinds.tolist(), segm_num_parts.tolist()):
+        if kind == _SEGM_RLE:
+            segms.append(parts[start])
+        else:
+            segms.append(parts[start:start + num_parts])
+        start += num_parts
+    return segms
+
+
+def _new_minibatch_id():
+    return uuid.uuid4().int & 0x7fffffffffffffff
+
+
+def _align(num_bytes):
+    return (num_bytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
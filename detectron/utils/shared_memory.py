@@ -0,0 +1,138 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Pool of preallocated shared memory slots for passing numpy arrays between
+processes without pickling them."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import mmap
+import multiprocessing
+import numpy as np
+
+# Byte alignment of each array stored in a slot
+_ALIGNMENT = 64
+
+
+class SharedMemorySlotPool(object):
+    """A fixed number of equally sized slots of anonymous shared memory.
+
+    The memory is mapped when the pool is created, so the pool must be created
+    *before* forking the processes that use it. A producer acquires a free slot
+    from the free_slots queue, builds or copies a list of arrays into it with a
+    SlotWriter and passes the (small) metadata returned by SlotWriter.write()
+    to a consumer. The consumer gets views of the arrays with read() and
+    releases the slot once it is done with them.
+    """
+
+    def __init__(self, num_slots, slot_bytes):
+        self._slot_bytes = _align(slot_bytes)
+        self._buffer = mmap.mmap(-1, num_slots * self._slot_bytes)
+        self._data = np.frombuffer(self._buffer, dtype=np.uint8)
+        self.free_slots = multiprocessing.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+    @property
+    def slot_bytes(self):
+        return self._slot_bytes
+
+    def read(self, metadata):
+        """Return views of the arrays described by metadata (see
+        SlotWriter.write())."""
+        return [
+            np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._data,
+                       offset=offset)
+            for dtype, shape, offset in metadata
+        ]
+
+    def release(self, slot):
+        """Return the slot to the pool of free slots."""
+        self.free_slots.put(slot)
+
+
+class SlotWriter(object):
+    """Stores arrays into a slot of a SharedMemorySlotPool. Arrays allocated
+    with zeros() live in the slot itself, so a producer that builds an array in
+    place (e.g., the data blob of a minibatch) does not need to copy it.
+    write() copies any other array into the remaining space of the slot.
+    """
+
+    def __init__(self, pool, slot):
+        self.slot = slot
+        self._pool = pool
+        self.reset()
+
+    def reset(self):
+        """Discard the arrays allocated so far."""
+        self._offset = self.slot * self._pool.slot_bytes
+        self._allocated = []  # (array, offset) pairs of zeros()
+
+    def zeros(self, shape, dtype):
+        """Return an array of zeros like np.zeros(shape, dtype), allocated in
+        the slot if there is room left for it."""
+        dtype = np.dtype(dtype)
+        num_bytes = _align(int(np.prod(shape)) * dtype.itemsize)
+        if num_bytes > self._free_bytes():
+            return np.zeros(shape, dtype=dtype)
+        a = np.ndarray(
+            shape, dtype=dtype, buffer=self._pool._data, offset=self._offset
+        )
+        a.fill(0)
+        self._allocated.append((a, self._offset))
+        self._offset += num_bytes
+        return a
+
+    def fits(self, arrays):
+        """Return True if the arrays that were not allocated with zeros() fit
+        into the remaining space of the slot."""
+        return sum(
+            _align(a.nbytes) for a in arrays if self._find(a) is None
+        ) <= self._free_bytes()
+
+    def write(self, arrays):
+        """Copy the arrays that were not allocated with zeros() into the slot
+        and return the list of (dtype, shape, offset) metadata needed to read
+        all of them back."""
+        assert self.fits(arrays)
+        metadata = []
+        for a in arrays:
+            offset = self._find(a)
+            if offset is None:
+                offset = self._offset
+                dst = np.ndarray(
+                    a.shape, dtype=a.dtype, buffer=self._pool._data,
+                    offset=offset
+                )
+                dst[...] = a
+                self._offset += _align(a.nbytes)
+            metadata.append((a.dtype.str, a.shape, offset))
+        return metadata
+
+    def _free_bytes(self):
+        return (self.slot + 1) * self._pool.slot_bytes - self._offset
+
+    def _find(self, array):
+        for a, offset in self._allocated:
+            if a is array:
+                return offset
+        return None
+
+
+def _align(num_bytes):
+    return (num_bytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
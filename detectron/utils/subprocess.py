@@ -13,9 +13,10 @@
 # limitations under the License.
 ##############################################################################
 
-"""Primitives for running multiple single-GPU jobs in parallel over subranges of
-data. These are used for running multi-GPU inference. Subprocesses are used to
-avoid the GIL since inference may involve non-trivial amounts of Python code.
+"""Primitives for running multiple single-GPU jobs in parallel as a pool of
+workers that pull chunks of data from a shared queue. These are used for
+running multi-GPU inference. Subprocesses are used to avoid
+the GIL since inference may involve non-trivial amounts of Python code.
 """
 
 from __future__ import absolute_import
@@ -23,12 +24,17 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from distutils.spawn import find_executable
+from multiprocessing.managers import BaseManager
+import datetime
+import multiprocessing
 import os
 import yaml
-import numpy as np
+import Queue
 import subprocess
-import cPickle as pickle
 from six.moves import shlex_quote
+import time
+import uuid
 
 from detectron.core.config import cfg
 
@@ -36,98 +42,267 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def process_in_parallel(
-    tag, total_range_size, binary, output_dir, opts=''
+# The authentication key of the worker pool is passed to the workers through
+# this environment variable (rather than the command line, which other users
+# may see)
+_WORKER_AUTHKEY_ENV = 'DETECTRON_WORKER_AUTHKEY'
+# Index of each worker in the worker pool
+_WORKER_ID_ENV = 'DETECTRON_WORKER_ID'
+
+
+class _WorkerPoolManager(BaseManager):
+    """Serves the task and result queues of a worker pool to its workers."""
+
+
+def use_cpu_workers():
+    """Whether inference runs in CPU worker subprocesses (see
+    cfg.CPU_INFERENCE)."""
+    return cfg.CPU_INFERENCE.ENABLED and cfg.CPU_INFERENCE.NUM_WORKERS > 1
+
+
+def get_chunks(total_range_size):
+    """Split a data processing range into the chunks pulled by the workers of
+    process_in_worker_pool (see cfg.TEST.WORKER_CHUNK_SIZE)."""
+    chunk_size = cfg.TEST.WORKER_CHUNK_SIZE
+    return [
+        list(range(start, min(start + chunk_size, total_range_size)))
+        for start in range(0, total_range_size, chunk_size)
+    ]
+
+
+def process_in_worker_pool(
+    tag, chunks, binary, output_dir, opts='', poll_interval=1.
 ):
-    """Run the specified binary cfg.NUM_GPUS times in parallel, each time as a
-    subprocess that uses one GPU. The binary must accept the command line
-    arguments `--range {start} {end}` that specify a data processing range.
+    """Run the specified binary as a pool of persistent worker subprocesses,
+    one per GPU (cfg.NUM_GPUS), or cfg.CPU_INFERENCE.NUM_WORKERS subprocesses
+    in CPU inference mode. The workers pull chunks of data (e.g., short lists
+    of image indices) from a shared queue until all chunks are processed, so
+    that slow chunks do not leave the other workers idle.
+
+    The binary must accept the command line argument `--worker {address}` and
+    then call run_worker with the address and a function that processes a
+    chunk. The (chunk index, result) pairs are yielded as the workers complete
+    chunks, i.e., not necessarily in order.
     """
-    # Snapshot the current cfg state in order to pass to the inference
-    # subprocesses
-    cfg_file = os.path.join(output_dir, '{}_range_config.yaml'.format(tag))
+    task_queue = Queue.Queue()
+    result_queue = Queue.Queue()
+    for chunk_index, chunk in enumerate(chunks):
+        task_queue.put((chunk_index, chunk))
+    # BaseManager requires native strings as typeids
+    _WorkerPoolManager.register(
+        str('get_tasks'), callable=lambda: task_queue
+    )
+    _WorkerPoolManager.register(
+        str('get_results'), callable=lambda: result_queue
+    )
+    authkey = uuid.uuid4().hex
+    manager = _WorkerPoolManager(
+        address=('127.0.0.1', 0), authkey=authkey.encode('ascii')
+    )
+    manager.start()
+    address = '{}:{}'.format(*manager.address)
+
+    # Snapshot the current cfg state in order to pass to the workers
+    cfg_file = os.path.join(output_dir, '{}_worker_config.yaml'.format(tag))
     with open(cfg_file, 'w') as f:
         yaml.dump(cfg, stream=f)
-    subprocess_env = os.environ.copy()
+    worker_settings = _get_worker_settings()
     processes = []
-    subinds = np.array_split(range(total_range_size), cfg.NUM_GPUS)
-    # Determine GPUs to use
-    cuda_visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
-    if cuda_visible_devices:
-        gpu_inds = map(int, cuda_visible_devices.split(','))
-        assert -1 not in gpu_inds, \
-            'Hiding GPU indices using the \'-1\' index is not supported'
-    else:
-        gpu_inds = range(cfg.NUM_GPUS)
-    # Run the binary in cfg.NUM_GPUS subprocesses
-    for i, gpu_ind in enumerate(gpu_inds):
-        start = subinds[i][0]
-        end = subinds[i][-1] + 1
-        subprocess_env['CUDA_VISIBLE_DEVICES'] = str(gpu_ind)
-        cmd = '{binary} --range {start} {end} --cfg {cfg_file} NUM_GPUS 1 {opts}'
-        cmd = cmd.format(
-            binary=shlex_quote(binary),
-            start=int(start),
-            end=int(end),
-            cfg_file=shlex_quote(cfg_file),
-            opts=' '.join([shlex_quote(opt) for opt in opts])
-        )
-        logger.info('{} range command {}: {}'.format(tag, i, cmd))
-        if i == 0:
-            subprocess_stdout = subprocess.PIPE
-        else:
+    try:
+        tasks = manager.get_tasks()
+        for _ in worker_settings:
+            # One stop signal per worker
+            tasks.put(None)
+        for i, (worker_env, cmd_prefix) in enumerate(worker_settings):
+            subprocess_env = os.environ.copy()
+            subprocess_env.update(worker_env)
+            subprocess_env[_WORKER_AUTHKEY_ENV] = authkey
+            subprocess_env[_WORKER_ID_ENV] = str(i)
+            cmd = '{prefix}{binary} --worker {address} --cfg {cfg_file} ' \
+                'NUM_GPUS 1 {opts}'
+            cmd = cmd.format(
+                prefix=cmd_prefix,
+                binary=shlex_quote(binary),
+                address=address,
+                cfg_file=shlex_quote(cfg_file),
+                opts=' '.join([shlex_quote(opt) for opt in opts])
+            )
+            logger.info(
+                '{} worker command {} (with {}): {}'.format(
+                    tag, i, ' '.join(
+                        '{}={}'.format(k, shlex_quote(v))
+                        for k, v in sorted(worker_env.items())
+                    ), cmd
+                )
+            )
             filename = os.path.join(
-                output_dir, '%s_range_%s_%s.stdout' % (tag, start, end)
+                output_dir, '{}_worker_{}.stdout'.format(tag, i)
             )
-            subprocess_stdout = open(filename, 'w')  # NOQA (close below)
-        p = subprocess.Popen(
-            cmd,
-            shell=True,
-            env=subprocess_env,
-            stdout=subprocess_stdout,
-            stderr=subprocess.STDOUT,
-            bufsize=1
-        )
-        processes.append((i, p, start, end, subprocess_stdout))
-    # Log output from inference processes and collate their results
-    outputs = []
-    for i, p, start, end, subprocess_stdout in processes:
-        log_subprocess_output(i, p, output_dir, tag, start, end)
-        if isinstance(subprocess_stdout, file):  # NOQA (Python 2 for now)
+            subprocess_stdout = open(filename, 'w')
+            p = subprocess.Popen(
+                cmd,
+                shell=True,
+                env=subprocess_env,
+                stdout=subprocess_stdout,
+                stderr=subprocess.STDOUT
+            )
+            processes.append((i, p, subprocess_stdout))
+
+        # Stream the results back, watching for workers that failed
+        results = manager.get_results()
+        worker_chunks = [0] * len(processes)
+        worker_busy_time = [0.] * len(processes)
+        start_time = time.time()
+        num_done = 0
+        while num_done < len(chunks):
+            try:
+                worker_id, chunk_index, result, chunk_time = results.get(
+                    timeout=poll_interval
+                )
+            except Queue.Empty:
+                return_codes = [p.poll() for _, p, _ in processes]
+                for (i, _, _), ret in zip(processes, return_codes):
+                    if ret is not None and ret != 0:
+                        log_worker_output(i, output_dir, tag)
+                        raise AssertionError(
+                            'Worker subprocess {} failed (exit code: {})'.
+                            format(i, ret)
+                        )
+                assert any(ret is None for ret in return_codes), \
+                    'All worker subprocesses exited before the end of the work'
+                continue
+            num_done += 1
+            worker_chunks[worker_id] += 1
+            worker_busy_time[worker_id] += chunk_time
+            if num_done % 10 == 0 or num_done == len(chunks):
+                elapsed = time.time() - start_time
+                eta_seconds = elapsed / num_done * (len(chunks) - num_done)
+                eta = str(datetime.timedelta(seconds=int(eta_seconds)))
+                logger.info(
+                    '{}: {:d}/{:d} chunks done (eta: {})'.format(
+                        tag, num_done, len(chunks), eta
+                    )
+                )
+            yield chunk_index, result
+
+        for i, p, _ in processes:
+            ret = p.wait()
+            log_worker_output(i, output_dir, tag)
+            assert ret == 0, \
+                'Worker subprocess {} failed (exit code: {})'.format(i, ret)
+        elapsed = time.time() - start_time
+        for i in range(len(processes)):
+            logger.info(
+                '{} worker {}: {:d} chunks, {:.3f}s per chunk, busy {:.1f}s '
+                '({:.1f}% of {:.1f}s)'.format(
+                    tag, i, worker_chunks[i],
+                    worker_busy_time[i] / max(worker_chunks[i], 1),
+                    worker_busy_time[i],
+                    100. * worker_busy_time[i] / max(elapsed, 1e-6), elapsed
+                )
+            )
+    finally:
+        for _, p, subprocess_stdout in processes:
+            if p.poll() is None:
+                p.kill()
             subprocess_stdout.close()
-        range_file = os.path.join(
-            output_dir, '%s_range_%s_%s.pkl' % (tag, start, end)
+        manager.shutdown()
+
+
+def _get_worker_settings():
+    """Return the environment variables and the command prefix of each worker
+    subprocess of process_in_worker_pool."""
+    if not cfg.CPU_INFERENCE.ENABLED:
+        return [
+            ({'CUDA_VISIBLE_DEVICES': str(gpu_ind)}, '')
+            for gpu_ind in _get_gpu_inds()
+        ]
+
+    num_workers = cfg.CPU_INFERENCE.NUM_WORKERS
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(multiprocessing.cpu_count()))
+    num_threads = cfg.CPU_INFERENCE.THREADS_PER_WORKER
+    if num_threads <= 0:
+        num_threads = max(1, len(cores) // num_workers)
+    pin_workers = cfg.CPU_INFERENCE.PIN_WORKERS
+    if pin_workers and num_workers * num_threads > len(cores):
+        logger.warning(
+            'Not enough cores ({}) to pin {} workers to {} cores each; the '
+            'workers are not pinned'.format(
+                len(cores), num_workers, num_threads
+            )
         )
-        range_data = pickle.load(open(range_file))
-        outputs.append(range_data)
-    return outputs
+        pin_workers = False
+    if pin_workers and find_executable('taskset') is None:
+        logger.warning('taskset not found; the workers are not pinned')
+        pin_workers = False
+
+    worker_settings = []
+    for i in range(num_workers):
+        worker_env = {
+            # An empty CUDA_VISIBLE_DEVICES hides all GPUs
+            'CUDA_VISIBLE_DEVICES': '',
+            'OMP_NUM_THREADS': str(num_threads),
+            'MKL_NUM_THREADS': str(num_threads),
+        }
+        cmd_prefix = ''
+        if pin_workers:
+            worker_cores = cores[i * num_threads:(i + 1) * num_threads]
+            cmd_prefix = 'taskset -c {} '.format(
+                ','.join(str(core) for core in worker_cores)
+            )
+        worker_settings.append((worker_env, cmd_prefix))
+    return worker_settings
 
 
-def log_subprocess_output(i, p, output_dir, tag, start, end):
-    """Capture the output of each subprocess and log it in the parent process.
-    The first subprocess's output is logged in realtime. The output from the
-    other subprocesses is buffered and then printed all at once (in order) when
-    subprocesses finish.
-    """
-    outfile = os.path.join(
-        output_dir, '%s_range_%s_%s.stdout' % (tag, start, end)
+def run_worker(address, process_chunk):
+    """Worker loop of process_in_worker_pool: process the chunks pulled from
+    the worker pool at address with process_chunk, and send back their
+    results."""
+    host, port = address.rsplit(':', 1)
+    # BaseManager requires native strings as typeids
+    _WorkerPoolManager.register(str('get_tasks'))
+    _WorkerPoolManager.register(str('get_results'))
+    manager = _WorkerPoolManager(
+        address=(host, int(port)),
+        authkey=os.environ[_WORKER_AUTHKEY_ENV].encode('ascii')
     )
+    manager.connect()
+    worker_id = int(os.environ[_WORKER_ID_ENV])
+    tasks = manager.get_tasks()
+    results = manager.get_results()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        chunk_index, chunk = task
+        start_time = time.time()
+        result = process_chunk(chunk)
+        results.put(
+            (worker_id, chunk_index, result, time.time() - start_time)
+        )
+
+
+def log_worker_output(i, output_dir, tag):
+    """Log the output of a worker subprocess in the parent process."""
+    outfile = os.path.join(output_dir, '{}_worker_{}.stdout'.format(tag, i))
     logger.info('# ' + '-' * 76 + ' #')
-    logger.info(
-        'stdout of subprocess %s with range [%s, %s]' % (i, start + 1, end)
-    )
+    logger.info('stdout of worker subprocess {}'.format(i))
     logger.info('# ' + '-' * 76 + ' #')
-    if i == 0:
-        # Stream the piped stdout from the first subprocess in realtime
-        with open(outfile, 'w') as f:
-            for line in iter(p.stdout.readline, b''):
-                print(line.rstrip())
-                f.write(str(line))
-        p.stdout.close()
-        ret = p.wait()
+    with open(outfile, 'r') as f:
+        print(''.join(f.readlines()))
+
+
+def _get_gpu_inds():
+    """Determine GPUs to use."""
+    cuda_visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if cuda_visible_devices:
+        gpu_inds = map(int, cuda_visible_devices.split(','))
+        assert -1 not in gpu_inds, \
+            'Hiding GPU indices using the \'-1\' index is not supported'
     else:
-        # For subprocesses >= 1, wait and dump their log file
-        ret = p.wait()
-        with open(outfile, 'r') as f:
-            print(''.join(f.readlines()))
-    assert ret == 0, 'Range subprocess failed (exit code: {})'.format(ret)
+        gpu_inds = range(cfg.NUM_GPUS)
+    return gpu_inds
+
@@ -43,15 +43,20 @@ class Timer(object):
         self.start_time = time.time()
 
     def toc(self, average=True):
-        self.diff = time.time() - self.start_time
-        self.total_time += self.diff
-        self.calls += 1
-        self.average_time = self.total_time / self.calls
+        self.add(time.time() - self.start_time)
         if average:
             return self.average_time
         else:
             return self.diff
 
+    def add(self, diff):
+        """Record a duration that was measured elsewhere (e.g., on a worker
+        thread, where tic and toc would race)."""
+        self.diff = diff
+        self.total_time += self.diff
+        self.calls += 1
+        self.average_time = self.total_time / self.calls
+
     def reset(self):
         self.total_time = 0.
         self.calls = 0
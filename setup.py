@@ -46,7 +46,11 @@ ext_modules = [
             'detectron/utils/cython_nms.pyx'
         ],
         extra_compile_args=[
-            '-Wno-cpp'
+            '-Wno-cpp',
+            '-fopenmp'
+        ],
+        extra_link_args=[
+            '-fopenmp'
         ],
         include_dirs=[
             _NP_INCLUDE_DIRS
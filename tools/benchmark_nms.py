@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Benchmark the CPU NMS kernels (see NMS_KERNEL in detectron/core/config.py)
+on random RPN-like proposals (boxes jittered around a set of objects, sorted by
+score), with and without stopping after post_nms_top_n kept boxes.
+
+Example usage:
+
+python2 tools/benchmark_nms.py --num-boxes 2000 6000 12000 30000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import numpy as np
+
+from detectron.utils.timer import Timer
+import detectron.utils.cython_nms as cython_nms
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark NMS kernels')
+    parser.add_argument(
+        '--num-boxes',
+        dest='num_boxes',
+        help='Numbers of boxes to benchmark',
+        default=[2000, 6000, 12000, 30000],
+        type=int,
+        nargs='+'
+    )
+    parser.add_argument(
+        '--nms-thresh',
+        dest='nms_thresh',
+        help='NMS overlap threshold',
+        default=0.7,
+        type=float
+    )
+    parser.add_argument(
+        '--post-nms-top-n',
+        dest='post_nms_top_n',
+        help='Number of kept boxes after which NMS may stop',
+        default=2000,
+        type=int
+    )
+    parser.add_argument(
+        '--iters',
+        dest='iters',
+        help='Number of timed iterations per kernel',
+        default=5,
+        type=int
+    )
+    return parser.parse_args()
+
+
+def random_proposals(num_boxes, im_size=1000, num_objects=100, seed=0):
+    """Return (num_boxes, 5) float32 boxes and scores, sorted by score."""
+    rng = np.random.RandomState(seed)
+    centers = rng.rand(num_objects, 2) * im_size
+    sizes = 16 + rng.rand(num_objects, 2) * im_size / 4
+    objs = rng.randint(num_objects, size=num_boxes)
+    xy = centers[objs] + rng.randn(num_boxes, 2) * sizes[objs] / 4
+    wh = sizes[objs] * np.exp(rng.randn(num_boxes, 2) * 0.2)
+    dets = np.hstack(
+        (xy - wh / 2, xy + wh / 2, rng.rand(num_boxes, 1))
+    ).astype(np.float32)
+    return dets[np.argsort(-dets[:, 4])]
+
+
+def time_kernel(f, iters):
+    timer = Timer()
+    f()  # Warm up
+    for _ in range(iters):
+        timer.tic()
+        keep = f()
+        timer.toc()
+    return keep, timer.average_time
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    thresh = np.float32(args.nms_thresh)
+    print(
+        '{:>8} {:>10} {:>8} {:>12} {:>12} {:>8}'.format(
+            'boxes', 'max_keep', 'kept', 'greedy (ms)', 'bitmask (ms)',
+            'speedup'
+        )
+    )
+    for num_boxes in args.num_boxes:
+        dets = random_proposals(num_boxes)
+        set_offsets = np.array([0, num_boxes], dtype=np.int64)
+        for max_keep in [-1, args.post_nms_top_n]:
+            times = {}
+            keeps = {}
+            for bitmask in [False, True]:
+                keeps[bitmask], times[bitmask] = time_kernel(
+                    lambda: cython_nms.batched_nms(
+                        dets, set_offsets, thresh, max_keep=max_keep,
+                        bitmask=bitmask
+                    ), args.iters
+                )
+            assert np.array_equal(keeps[False], keeps[True]), \
+                'The NMS kernels disagree'
+            print(
+                '{:8d} {:>10} {:8d} {:12.2f} {:12.2f} {:7.1f}x'.format(
+                    num_boxes, max_keep if max_keep > 0 else 'none',
+                    len(keeps[True]), times[False] * 1000,
+                    times[True] * 1000, times[False] / times[True]
+                )
+            )
@@ -0,0 +1,128 @@
+#!/usr/bin/env python2
+
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Build the on-disk cache of resized training images (TRAIN.IMAGE_CACHE_DIR)
+for the training datasets and scales of a config ahead of training.
+
+Example usage:
+
+python2 tools/build_image_cache.py \
+    --cfg configs/12_2017_baselines/e2e_faster_rcnn_R-50-FPN_1x.yaml \
+    --num-workers 16 \
+    TRAIN.IMAGE_CACHE_DIR /path/to/image_cache
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import cv2  # NOQA (Must import before importing caffe2 due to bug in cv2)
+import logging
+import multiprocessing
+import sys
+
+from detectron.core.config import assert_and_infer_cfg
+from detectron.core.config import cfg
+from detectron.core.config import merge_cfg_from_file
+from detectron.core.config import merge_cfg_from_list
+from detectron.datasets.json_dataset import JsonDataset
+from detectron.utils.logging import setup_logging
+import detectron.utils.image_cache as image_cache
+
+# OpenCL may be enabled by default in OpenCV3; disable it because it's not
+# thread safe and causes unwanted GPU memory allocations.
+cv2.ocl.setUseOpenCL(False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Build the cache of resized training images'
+    )
+    parser.add_argument(
+        '--cfg',
+        dest='cfg_file',
+        help='Config file for training',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--num-workers',
+        dest='num_workers',
+        help='Number of worker processes',
+        default=multiprocessing.cpu_count(),
+        type=int
+    )
+    parser.add_argument(
+        'opts',
+        help='See detectron/core/config.py for all options',
+        default=None,
+        nargs=argparse.REMAINDER
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+def cache_image(args):
+    im_path, im_size, target_size = args
+    image_cache.get_resized_image(
+        cfg.TRAIN.IMAGE_CACHE_DIR, im_path, im_size, target_size,
+        cfg.TRAIN.MAX_SIZE
+    )
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    assert cfg.TRAIN.IMAGE_CACHE_DIR, 'TRAIN.IMAGE_CACHE_DIR is not set'
+    # Flipped images are read from the entries of the unflipped images, so
+    # only the unflipped images need to be cached
+    tasks = []
+    for dataset_name in cfg.TRAIN.DATASETS:
+        roidb = JsonDataset(dataset_name).get_roidb()
+        for entry in roidb:
+            for target_size in cfg.TRAIN.SCALES:
+                tasks.append(
+                    (
+                        entry['image'], (entry['height'], entry['width']),
+                        target_size
+                    )
+                )
+    logger.info(
+        'Caching {:d} resized images in {}'.format(
+            len(tasks), cfg.TRAIN.IMAGE_CACHE_DIR
+        )
+    )
+    pool = multiprocessing.Pool(args.num_workers)
+    for i, _ in enumerate(pool.imap_unordered(cache_image, tasks, 16)):
+        if (i + 1) % 1000 == 0 or i + 1 == len(tasks):
+            logger.info('{:d}/{:d}'.format(i + 1, len(tasks)))
+    pool.close()
+    pool.join()
+
+
+if __name__ == '__main__':
+    logger = setup_logging(__name__)
+    args = parse_args()
+    if args.cfg_file is not None:
+        merge_cfg_from_file(args.cfg_file)
+    if args.opts is not None:
+        merge_cfg_from_list(args.opts)
+    assert_and_infer_cfg()
+    main(args)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python2
+
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Convert a proposal file in the pickle format (e.g., as written by
+tools/test_net.py for RPN models) into an indexed, memory mapped proposal store
+(see detectron/datasets/proposal_store.py). The store directory can be used
+wherever a proposal file is expected.
+
+Example usage:
+
+python2 tools/build_proposal_store.py \
+    /path/to/rpn_proposals.pkl /path/to/rpn_proposals_store
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+import sys
+
+from detectron.datasets.proposal_store import convert_proposal_file
+from detectron.datasets.proposal_store import ProposalStore
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Convert a proposal file into a proposal store'
+    )
+    parser.add_argument(
+        'proposal_file', help='Proposal file (pickle)', type=str
+    )
+    parser.add_argument(
+        'store_dir', help='Output proposal store directory', type=str
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    assert not os.path.exists(args.store_dir), \
+        '\'{}\' already exists'.format(args.store_dir)
+    convert_proposal_file(args.proposal_file, args.store_dir)
+    print(
+        'Wrote proposals of {:d} images to {}'.format(
+            len(ProposalStore(args.store_dir)), args.store_dir
+        )
+    )
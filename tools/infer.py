@@ -111,7 +111,7 @@ def get_rpn_box_proposals(im, args):
     assert_and_infer_cfg(cache_urls=False)
 
     model = model_engine.initialize_model_from_cfg(args.rpn_pkl)
-    with c2_utils.NamedCudaScope(0):
+    with c2_utils.NamedDeviceScope(0):
         boxes, scores = rpn_engine.im_proposals(model, im)
     return boxes, scores
 
@@ -142,7 +142,7 @@ def main(args):
         cfg.NUM_GPUS = 1
         assert_and_infer_cfg(cache_urls=False)
         model = model_engine.initialize_model_from_cfg(weights_file)
-        with c2_utils.NamedCudaScope(0):
+        with c2_utils.NamedDeviceScope(0):
             cls_boxes_, cls_segms_, cls_keyps_ = \
                 model_engine.im_detect_all(model, im, proposal_boxes)
         cls_boxes = cls_boxes_ if cls_boxes_ is not None else cls_boxes
@@ -89,6 +89,20 @@ def parse_args():
         help='output image even when no object is found',
         action='store_true'
     )
+    parser.add_argument(
+        '--cpu',
+        dest='cpu',
+        help='run inference on the CPU (see cfg.CPU_INFERENCE)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--cpu-threads',
+        dest='cpu_threads',
+        help='number of intra-op threads for CPU inference (default: 0, i.e., '
+        'the OpenMP/MKL default)',
+        default=0,
+        type=int
+    )
     parser.add_argument(
         'im_or_folder', help='image or folder of images', default=None
     )
@@ -110,8 +124,15 @@ def main(args):
 
     merge_cfg_from_file(args.cfg)
     cfg.NUM_GPUS = 1
+    if args.cpu:
+        cfg.CPU_INFERENCE.ENABLED = True
+        cfg.CPU_INFERENCE.THREADS_PER_WORKER = args.cpu_threads
     args.weights = cache_url(args.weights, cfg.DOWNLOAD_CACHE)
     assert_and_infer_cfg(cache_urls=False)
+    workspace.GlobalInit(
+        ['caffe2', '--caffe2_log_level=0'] +
+        c2_utils.get_cpu_inference_init_args()
+    )
 
     assert not cfg.MODEL.RPN_ONLY, \
         'RPN models are not supported'
@@ -134,7 +155,7 @@ def main(args):
         im = cv2.imread(im_name)
         timers = defaultdict(Timer)
         t = time.time()
-        with c2_utils.NamedCudaScope(0):
+        with c2_utils.NamedDeviceScope(0):
             cls_boxes, cls_segms, cls_keyps = infer_engine.im_detect_all(
                 model, im, None, timers=timers
             )
@@ -165,7 +186,6 @@ def main(args):
 
 
 if __name__ == '__main__':
-    workspace.GlobalInit(['caffe2', '--caffe2_log_level=0'])
     setup_logging(__name__)
     args = parse_args()
     main(args)
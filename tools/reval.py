@@ -31,7 +31,6 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import cPickle as pickle
 import os
 import sys
 import yaml
@@ -39,6 +38,7 @@ import yaml
 from detectron.core.config import cfg
 from detectron.datasets import task_evaluation
 from detectron.datasets.json_dataset import JsonDataset
+from detectron.utils.detection_log import load_detections
 from detectron.utils.logging import setup_logging
 import detectron.core.config as core_config
 
@@ -85,18 +85,19 @@ def parse_args():
 
 def do_reval(dataset_name, output_dir, args):
     dataset = JsonDataset(dataset_name)
-    with open(os.path.join(output_dir, 'detections.pkl'), 'rb') as f:
-        dets = pickle.load(f)
+    det_file = os.path.join(output_dir, 'detections.pkl')
+    if not os.path.exists(det_file):
+        # Detections written with cfg.TEST.DETECTION_LOG enabled
+        det_file = os.path.join(output_dir, 'detections_log')
+    detections, cfg_yaml = load_detections(det_file)
     # Override config with the one saved in the detections file
     if args.cfg_file is not None:
-        core_config.merge_cfg_from_cfg(core_config.load_cfg(dets['cfg']))
+        core_config.merge_cfg_from_cfg(core_config.load_cfg(cfg_yaml))
     else:
-        core_config._merge_a_into_b(core_config.load_cfg(dets['cfg']), cfg)
+        core_config._merge_a_into_b(core_config.load_cfg(cfg_yaml), cfg)
     results = task_evaluation.evaluate_all(
         dataset,
-        dets['all_boxes'],
-        dets['all_segms'],
-        dets['all_keyps'],
+        detections,
         output_dir,
         use_matlab=args.matlab_eval
     )
@@ -79,6 +79,14 @@ def parse_args():
         type=int,
         nargs=2
     )
+    parser.add_argument(
+        '--worker',
+        dest='worker_address',
+        help='run as an inference worker of the worker pool at this address '
+        '(see process_in_worker_pool)',
+        default=None,
+        type=str
+    )
     parser.add_argument(
         'opts',
         help='See detectron/core/config.py for all options',
@@ -92,7 +100,6 @@ def parse_args():
 
 
 if __name__ == '__main__':
-    workspace.GlobalInit(['caffe2', '--caffe2_log_level=0'])
     logger = setup_logging(__name__)
     args = parse_args()
     logger.info('Called with args:')
@@ -102,6 +109,10 @@ if __name__ == '__main__':
     if args.opts is not None:
         merge_cfg_from_list(args.opts)
     assert_and_infer_cfg()
+    workspace.GlobalInit(
+        ['caffe2', '--caffe2_log_level=0'] +
+        c2_utils.get_cpu_inference_init_args()
+    )
     logger.info('Testing with config:')
     logger.info(pprint.pformat(cfg))
 
@@ -114,4 +125,5 @@ if __name__ == '__main__':
         ind_range=args.range,
         multi_gpu_testing=args.multi_gpu_testing,
         check_expected_results=True,
+        worker_address=args.worker_address,
     )
@@ -23,12 +23,12 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import cPickle as pickle
 import cv2
 import os
 import sys
 
 from detectron.datasets.json_dataset import JsonDataset
+from detectron.utils.detection_log import load_detections
 import detectron.utils.vis as vis_utils
 
 # OpenCL may be enabled by default in OpenCV3; disable it because it's not
@@ -48,7 +48,7 @@ def parse_args():
     parser.add_argument(
         '--detections',
         dest='detections',
-        help='detections pkl file',
+        help='detections pkl file or detection log',
         default='',
         type=str
     )
@@ -84,21 +84,9 @@ def vis(dataset, detections_pkl, thresh, output_dir, limit=0):
     ds = JsonDataset(dataset)
     roidb = ds.get_roidb()
 
-    with open(detections_pkl, 'r') as f:
-        dets = pickle.load(f)
-
-    assert all(k in dets for k in ['all_boxes', 'all_segms', 'all_keyps']), \
-        'Expected detections pkl file in the format used by test_engine.py'
-
-    all_boxes = dets['all_boxes']
-    all_segms = dets['all_segms']
-    all_keyps = dets['all_keyps']
-
-    def id_or_index(ix, val):
-        if len(val) == 0:
-            return val
-        else:
-            return val[ix]
+    detections, _ = load_detections(detections_pkl)
+    assert detections.num_images == len(roidb), \
+        'Expected detections of the images of {}'.format(dataset)
 
     for ix, entry in enumerate(roidb):
         if limit > 0 and ix >= limit:
@@ -109,15 +97,8 @@ def vis(dataset, detections_pkl, thresh, output_dir, limit=0):
         im = cv2.imread(entry['image'])
         im_name = os.path.splitext(os.path.basename(entry['image']))[0]
 
-        cls_boxes_i = [
-            id_or_index(ix, cls_k_boxes) for cls_k_boxes in all_boxes
-        ]
-        cls_segms_i = [
-            id_or_index(ix, cls_k_segms) for cls_k_segms in all_segms
-        ]
-        cls_keyps_i = [
-            id_or_index(ix, cls_k_keyps) for cls_k_keyps in all_keyps
-        ]
+        cls_boxes_i, cls_segms_i, cls_keyps_i = \
+            detections.get_image_results(ix)
 
         vis_utils.vis_one_image(
             im[:, :, ::-1],